@@ -0,0 +1,240 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+from functools import cached_property
+
+import orjson
+from pymongo.errors import PyMongoError
+
+from compression import compress
+from quote_engine import CatalogArrays, SheetFitIndex
+
+logger = logging.getLogger(__name__)
+
+
+def encode_items(items):
+    """JSON body for a list of catalog items"""
+    return orjson.dumps(items, option=orjson.OPT_SORT_KEYS)
+
+
+def project(item, fields):
+    return item if fields is None else {field: item[field] for field in fields if field in item}
+
+
+def catalog_page(items, ids, after=None, limit=None, fields=None):
+    """One page of id-ordered catalog items after the `after` id cursor.
+
+    `ids` are the ids of `items`, in the same order. Returns the projected
+    items and the cursor of the next page, or None when this page reaches the
+    end of the list.
+    """
+    start = 0 if after is None else bisect.bisect_right(ids, after)
+    end = len(items) if limit is None else min(start + limit, len(items))
+    page = [project(item, fields) for item in items[start:end]]
+    next_cursor = items[end - 1]["id"] if end < len(items) else None
+    return page, next_cursor
+
+
+def ndjson_lines(items, fields=None):
+    """Newline delimited JSON, one catalog item per line"""
+    for item in items:
+        yield orjson.dumps(project(item, fields)) + b"\n"
+
+
+class CatalogSnapshot:
+    """Immutable view of the paper types and machines.
+
+    A snapshot is never modified after it has been built; writers build a new
+    one and swap the reference, so a reader always sees a consistent catalog.
+    The JSON bodies of the listing endpoints and the quote engine arrays are
+    prepared once per snapshot, and so are the compressed listing bodies,
+    at the same gzip level and brotli quality as CompressionMiddleware.
+    """
+
+    def __init__(self, paper_types, machines, version=0, fit_index=None, gzip_level=6, brotli_quality=4):
+        self.paper_types = sorted(paper_types, key=lambda item: item["id"])
+        self.machines = sorted(machines, key=lambda item: item["id"])
+        self.paper_type_ids = [item["id"] for item in self.paper_types]
+        self.machine_ids = [item["id"] for item in self.machines]
+        self.paper_types_json = encode_items(self.paper_types)
+        self.machines_json = encode_items(self.machines)
+        self.digest = hashlib.sha1(
+            self.paper_types_json + b"\n" + self.machines_json
+        ).hexdigest()
+        self.version = version
+        self.fit_index = fit_index
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._compressed = {}
+
+    @cached_property
+    def arrays(self):
+        return CatalogArrays(self.paper_types, self.machines, self.fit_index)
+
+    def compressed(self, name, encoding):
+        """The `name` listing body ("paper_types_json" or "machines_json") compressed with `encoding`.
+
+        Built on first use and kept for the lifetime of the snapshot, so a
+        large catalog is compressed once instead of on every request.
+        """
+        key = (name, encoding)
+        body = self._compressed.get(key)
+        if body is None:
+            body = self._compressed[key] = compress(
+                getattr(self, name), encoding, gzip_level=self.gzip_level, brotli_quality=self.brotli_quality
+            )
+        return body
+
+    @property
+    def etag(self):
+        return f'"{self.digest}"'
+
+    def variant_etag(self, *key):
+        """ETag of a body derived from this snapshot, such as a page or projection, identified by `key`"""
+        return f'"{hashlib.sha1(orjson.dumps([self.digest, *key])).hexdigest()}"'
+
+    def headers(self):
+        return {"ETag": self.etag, "X-Catalog-Version": str(self.version)}
+
+
+class CatalogCache:
+    """In-process catalog served from memory and kept in sync with MongoDB.
+
+    Local writes are applied through put_*/remove_* right after the database
+    write. Writes made by other replicas arrive through a change stream on the
+    database; when change streams are not available (standalone mongod) the
+    collections are polled every `poll_interval` seconds instead. Change
+    events arriving within `debounce` seconds of each other share one
+    reload, so a bulk import does not reload the catalog once per document.
+
+    Every accepted snapshot is built against a shared SheetFitIndex, so a
+    write only computes fit results for sheet sizes the index has not seen.
+    """
+
+    def __init__(self, db, paper_type_model, machine_model, poll_interval=30, debounce=0.2,
+                 gzip_level=6, brotli_quality=4):
+        self.db = db
+        self.paper_type_model = paper_type_model
+        self.machine_model = machine_model
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.compression = {"gzip_level": gzip_level, "brotli_quality": brotli_quality}
+        self.fit_index = SheetFitIndex()
+        self.snapshot = CatalogSnapshot([], [], fit_index=self.fit_index, **self.compression)
+        self._lock = asyncio.Lock()
+        self._watcher = None
+
+    async def start(self):
+        await self.reload()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def reload(self):
+        """Re-read both collections and swap the snapshot if anything changed.
+
+        The read happens under the lock, so a local put_*/remove_* made after
+        it started is applied on top of it instead of being rolled back.
+        """
+        async with self._lock:
+            paper_types = await self.db.paper_types.find().to_list(None)
+            machines = await self.db.machines.find().to_list(None)
+            self._swap(
+                [self.paper_type_model(**doc).dict() for doc in paper_types],
+                [self.machine_model(**doc).dict() for doc in machines],
+            )
+
+    async def put_paper_type(self, paper_type):
+        async with self._lock:
+            current = self.snapshot
+            self._swap(_replace(current.paper_types, paper_type), current.machines)
+
+    async def remove_paper_type(self, paper_type_id):
+        async with self._lock:
+            current = self.snapshot
+            self._swap(_without(current.paper_types, paper_type_id), current.machines)
+
+    async def put_machine(self, machine):
+        async with self._lock:
+            current = self.snapshot
+            self._swap(current.paper_types, _replace(current.machines, machine))
+
+    async def remove_machine(self, machine_id):
+        async with self._lock:
+            current = self.snapshot
+            self._swap(current.paper_types, _without(current.machines, machine_id))
+
+    def _swap(self, paper_types, machines):
+        current = self.snapshot
+        candidate = CatalogSnapshot(paper_types, machines, current.version + 1, self.fit_index, **self.compression)
+        if candidate.digest == current.digest:
+            return
+
+        # Sizes removed from the catalog stay interned; start over once they
+        # outnumber the live ones. Older snapshots keep their own index.
+        print_sizes = {(s["width"], s["height"]) for m in machines for s in m["printSheetSizes"]}
+        stock_sizes = {(s["width"], s["height"]) for p in paper_types for s in p["stockSheetSizes"]}
+        rows, cols = self.fit_index.shape
+        if rows > 2 * len(print_sizes) + 64 or cols > 2 * len(stock_sizes) + 64:
+            self.fit_index = candidate.fit_index = SheetFitIndex(self.fit_index.yield_cache_size)
+
+        # Build the quote arrays now rather than on the first quote
+        candidate.arrays
+        self.snapshot = candidate
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": ["paper_types", "machines"]}}}]
+        polling = False
+        while True:
+            try:
+                async with self.db.watch(pipeline) as stream:
+                    if polling:
+                        logger.info("Catalog change stream available again")
+                        polling = False
+                    # Pick up anything written while the stream was being opened
+                    await self.reload()
+                    async for _ in stream:
+                        await self._coalesce(stream)
+                        await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if not polling:
+                    if isinstance(error, PyMongoError):
+                        logger.info("Catalog change stream unavailable (%s), polling every %ss",
+                                    error, self.poll_interval)
+                    else:
+                        # A document the models reject must not end the watcher
+                        logger.exception("Catalog sync failed, polling every %ss", self.poll_interval)
+                    polling = True
+                await asyncio.sleep(self.poll_interval)
+                try:
+                    await self.reload()
+                except Exception:
+                    logger.exception("Catalog reload failed")
+
+    async def _coalesce(self, stream):
+        """Consume the events that follow the current one within `debounce` seconds"""
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(self.debounce)
+        # Bounded, so a steady stream of writes still reloads every so often
+        deadline = loop.time() + self.debounce
+        while loop.time() < deadline:
+            if await stream.try_next() is None:
+                return
+
+
+def _replace(items, item):
+    return [existing for existing in items if existing["id"] != item["id"]] + [item]
+
+
+def _without(items, item_id):
+    return [existing for existing in items if existing["id"] != item_id]
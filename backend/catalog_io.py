@@ -0,0 +1,197 @@
+import csv
+import io
+import logging
+
+import orjson
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from mongo_errors import DUPLICATE_KEY, INDEX_CONFLICT_CODES
+
+logger = logging.getLogger(__name__)
+
+# Flat CSV layout: one row per sheet size, rows of the same item share a name
+PAPER_TYPE_CSV = {
+    "item_fields": ("name", "gsm", "pricePerTon"),
+    "sheet_fields": ("width", "height", "unit"),
+    "sheets_key": "stockSheetSizes",
+}
+MACHINE_CSV = {
+    "item_fields": ("name", "setupCost", "sheetsPerHour", "setupMinutes"),
+    "sheet_fields": ("width", "height", "clickCost", "duplexSupport", "unit"),
+    "sheets_key": "printSheetSizes",
+}
+
+
+def csv_to_items(text, item_fields, sheet_fields, sheets_key):
+    """Group CSV rows into catalog items by name.
+
+    Item columns are read from the first row of each name. A row with a
+    sheetName or width adds a sheet size; sheetId is optional and defaults to
+    the position of the sheet within its item.
+    """
+    items = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        name = (row.get("name") or "").strip()
+        item = items.get(name)
+        if item is None:
+            item = items[name] = {
+                field: row.get(field) for field in item_fields if row.get(field) not in (None, "")
+            }
+            item["name"] = name
+            item[sheets_key] = []
+        if row.get("sheetName") or row.get("width"):
+            sheet = {
+                field: row[field] for field in sheet_fields if row.get(field) not in (None, "")
+            }
+            sheet["name"] = row.get("sheetName") or ""
+            sheet["id"] = row.get("sheetId") or len(item[sheets_key]) + 1
+            item[sheets_key].append(sheet)
+    return list(items.values())
+
+
+def validate_items(items, model):
+    """Validate every item in one pass.
+
+    Returns the validated dicts and a list of {index, errors} for the items
+    that failed, so a client sees every problem of an import at once. Fields
+    an item leaves out are left out of its dict too, so an update does not
+    reset them to their defaults.
+    """
+    valid = []
+    errors = []
+    seen = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": index, "errors": [{"loc": [], "msg": "Expected an object"}]})
+            continue
+        try:
+            obj = model(**item)
+        except ValidationError as error:
+            errors.append({
+                "index": index,
+                "errors": [{"loc": list(err["loc"]), "msg": err["msg"]} for err in error.errors()],
+            })
+            continue
+        if not obj.name:
+            errors.append({"index": index, "errors": [{"loc": ["name"], "msg": "Name is required"}]})
+        elif obj.name in seen:
+            errors.append({"index": index, "errors": [{"loc": ["name"], "msg": "Duplicate name in import"}]})
+        else:
+            seen.add(obj.name)
+            data = obj.dict()
+            valid.append({field: data[field] for field in obj.dict(exclude_unset=True)})
+    return valid, errors
+
+
+async def ensure_name_index(collection):
+    """Unique index on name, which bulk imports upsert by.
+
+    A non-unique index from an earlier release is replaced. When the
+    collection already holds duplicate names they are logged and a plain
+    index is kept, so startup does not fail on existing data.
+    """
+    try:
+        await collection.create_index("name", unique=True)
+    except OperationFailure as error:
+        if error.code in INDEX_CONFLICT_CODES:
+            await collection.drop_index("name_1")
+            return await ensure_name_index(collection)
+        if error.code != DUPLICATE_KEY:
+            raise
+        duplicates = [doc["_id"] async for doc in collection.aggregate([
+            {"$group": {"_id": "$name", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ])]
+        logger.error("%s has duplicate names %s; name index left non-unique", collection.name, duplicates)
+        await collection.create_index("name")
+
+
+def is_name_conflict(write_error):
+    return write_error["code"] == DUPLICATE_KEY and "name" in write_error.get("keyPattern", {})
+
+
+async def bulk_upsert(collection, items, sequences, sequence_name, defaults=None):
+    """Insert or update items by name with one unordered bulk_write.
+
+    Existing items keep their id; ids for new names are reserved as one block
+    from the sequence allocator. `defaults` fill the fields an item leaves
+    out, on insert only. Every write bumps the item version. Returns the
+    counts and the id of every item in input order.
+
+    A name inserted by a concurrent import fails on the unique name index;
+    those writes are upserted once more, now updating the other import's
+    item, and its id is reported.
+    """
+    defaults = defaults or {}
+    names = [item["name"] for item in items]
+    existing = {
+        doc["name"]: doc["id"]
+        async for doc in collection.find({"name": {"$in": names}}, {"name": 1, "id": 1})
+    }
+    new_ids = iter(await sequences.reserve(
+        sequence_name, sum(1 for name in names if name not in existing)
+    ))
+
+    ids = []
+    operations = []
+    for item in items:
+        item_id = existing[item["name"]] if item["name"] in existing else next(new_ids)
+        ids.append(item_id)
+        on_insert = {field: value for field, value in defaults.items() if field not in item}
+        operations.append(UpdateOne(
+            {"name": item["name"]},
+            {"$set": item, "$setOnInsert": {**on_insert, "id": item_id}, "$inc": {"version": 1}},
+            upsert=True,
+        ))
+
+    try:
+        result = await collection.bulk_write(operations, ordered=False)
+        inserted, updated, upserted = result.upserted_count, result.matched_count, set(result.upserted_ids)
+    except BulkWriteError as error:
+        if not all(is_name_conflict(write_error) for write_error in error.details["writeErrors"]):
+            raise
+        inserted, updated, upserted = await _retry_name_conflicts(collection, operations, error.details)
+
+    # New names a concurrent import wrote first matched its item: report that id
+    taken = [index for index, name in enumerate(names) if name not in existing and index not in upserted]
+    if taken:
+        current = {
+            doc["name"]: doc["id"]
+            async for doc in collection.find({"name": {"$in": [names[index] for index in taken]}}, {"name": 1, "id": 1})
+        }
+        for index in taken:
+            ids[index] = current[names[index]]
+    return {"inserted": inserted, "updated": updated, "ids": ids}
+
+
+async def _retry_name_conflicts(collection, operations, details):
+    """Upsert the writes that lost an insert race once more; they now update.
+
+    Returns the combined inserted and updated counts and the indexes of the
+    operations that inserted.
+    """
+    retried = [write_error["index"] for write_error in details["writeErrors"]]
+    try:
+        result = await collection.bulk_write([operations[index] for index in retried], ordered=False)
+    except BulkWriteError as error:
+        # Report the failed writes at their position in the import
+        for write_error in error.details["writeErrors"]:
+            write_error["index"] = retried[write_error["index"]]
+        raise
+    upserted = {entry["index"] for entry in details["upserted"]}
+    upserted.update(retried[index] for index in result.upserted_ids)
+    return (
+        details["nUpserted"] + result.upserted_count,
+        details["nMatched"] + result.matched_count,
+        upserted,
+    )
+
+
+async def export_lines(db, batch_size=500):
+    """The whole catalog as NDJSON, read from cursors batch by batch"""
+    for kind, collection in (("paperType", db.paper_types), ("machine", db.machines)):
+        cursor = collection.find({}, {"_id": 0}).sort([("id", 1)]).batch_size(batch_size)
+        async for doc in cursor:
+            yield orjson.dumps({"kind": kind, "item": doc}) + b"\n"
@@ -0,0 +1,151 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+# Preferred first when a client accepts several with the same q-value
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def choose_encoding(accept_encoding):
+    """The supported content coding the client prefers, None for identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for entry in accept_encoding.split(","):
+        name, _, params = entry.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class Compressor:
+    """Streaming gzip or brotli compressor"""
+
+    def __init__(self, encoding, gzip_level=6, brotli_quality=4):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=brotli_quality)
+            self.process, self.finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            self.process, self.finish = compressor.compress, compressor.flush
+
+
+def compress(body, encoding, gzip_level=6, brotli_quality=4):
+    compressor = Compressor(encoding, gzip_level, brotli_quality)
+    return compressor.process(body) + compressor.finish()
+
+
+def weak_etag(etag):
+    """A compressed body is a different representation: its ETag can only be weak"""
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(
+        (candidate[2:] if candidate.startswith("W/") else candidate) == opaque
+        for candidate in (value.strip() for value in if_none_match.split(","))
+    )
+
+
+def encoded_headers(headers, encoding):
+    headers["Content-Encoding"] = encoding
+    if "accept-encoding" not in headers.get("vary", "").lower():
+        headers.add_vary_header("Accept-Encoding")
+    if "etag" in headers:
+        headers["ETag"] = weak_etag(headers["etag"])
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing JSON and text responses with brotli or gzip.
+
+    The coding is negotiated from Accept-Encoding (q-values honoured, br
+    preferred on ties). Bodies under `minimum_size` bytes, responses that
+    already carry a Content-Encoding (pre-compressed catalog listings) and
+    non-text media types are sent unchanged. Streaming responses are
+    compressed chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http":
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if (
+                    "content-encoding" in headers
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                compressor = Compressor(encoding, self.gzip_level, self.brotli_quality)
+                encoded_headers(headers, encoding)
+                if more_body:
+                    del headers["content-length"]
+                    body = compressor.process(body)
+                else:
+                    body = compressor.process(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            body = compressor.process(body)
+            if not more_body:
+                body += compressor.finish()
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
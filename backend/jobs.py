@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobContext:
+    """Handed to a job handler: its parameters, progress reporting and result rows"""
+
+    def __init__(self, queue, job, progress_interval=0.5):
+        self.queue = queue
+        self.job = job
+        self.id = job["id"]
+        self.params = job["params"]
+        self.input_count = job.get("inputCount", 0)
+        self.progress_interval = progress_interval
+        self.total = 0
+        self.processed = 0
+        self.rows_written = 0
+        self._last_report = 0.0
+
+    async def progress(self, processed, total=None, force=False):
+        """Record progress; written to the job document at most every progress_interval seconds"""
+        self.processed = processed
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if force or now - self._last_report >= self.progress_interval:
+            self._last_report = now
+            await self.queue.jobs.update_one(
+                {"id": self.id},
+                {"$set": {"processed": self.processed, "total": self.total, "progress": self.fraction}},
+            )
+
+    @property
+    def fraction(self):
+        return min(1.0, self.processed / self.total) if self.total else 0.0
+
+    async def inputs(self):
+        """The job's input items in submission order, one stored chunk (a list) at a time"""
+        cursor = self.queue.inputs.find({"jobId": self.id}, {"_id": 0, "items": 1}).sort([("chunk", 1)])
+        async for chunk in cursor:
+            yield chunk["items"]
+
+    async def write_results(self, rows):
+        """Append result rows, numbered in order, to the job results collection"""
+        if not rows:
+            return
+        await self.queue.results.insert_many([
+            {"jobId": self.id, "index": self.rows_written + offset, **row}
+            for offset, row in enumerate(rows)
+        ])
+        self.rows_written += len(rows)
+
+
+class JobQueue:
+    """Long running jobs persisted in MongoDB and run by bounded asyncio workers.
+
+    A job is one document in the `jobs` collection ({id, kind, params,
+    status, progress, summary, ...}). Bulk inputs go to `job_inputs` in
+    chunks of `input_chunk_size` items and result rows to `job_results`, so
+    a large analysis never hits the document size limit. `workers` tasks
+    take job ids from an in-process queue and run the handler registered
+    for the job kind. Only plain reads and updates are used, so a
+    standalone mongod is enough.
+
+    A claimed job holds a lease (owner and leaseUntil) that a heartbeat
+    renews every third of `lease_seconds` while it runs. Running jobs are
+    only taken over once their lease has expired, on start and by a reaper
+    every `lease_seconds`; so jobs other replicas are working on are left
+    alone, and those of a stopped or crashed process are run again from
+    scratch with their old result rows discarded. A runner that loses its
+    lease stops its handler and writes nothing more.
+    """
+
+    def __init__(self, db, workers=2, collection="jobs", results_collection="job_results",
+                 inputs_collection="job_inputs", lease_seconds=60, input_chunk_size=1000):
+        self.db = db
+        self.workers = max(1, workers)
+        self.collection = collection
+        self.results_collection = results_collection
+        self.inputs_collection = inputs_collection
+        self.lease_seconds = lease_seconds
+        self.input_chunk_size = input_chunk_size
+        self.owner = str(uuid.uuid4())
+        self.handlers = {}
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self._running = {}
+        self._cancel_requested = set()
+        self._lease_lost = set()
+
+    @property
+    def jobs(self):
+        return self.db[self.collection]
+
+    @property
+    def results(self):
+        return self.db[self.results_collection]
+
+    @property
+    def inputs(self):
+        return self.db[self.inputs_collection]
+
+    def _lease_until(self):
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    def register(self, kind, handler):
+        """`handler(context)` is a coroutine returning the job summary"""
+        self.handlers[kind] = handler
+
+    async def start(self):
+        await self.jobs.create_index("id", unique=True)
+        await self.jobs.create_index([("createdAt", -1)])
+        await self.results.create_index([("jobId", 1), ("index", 1)], unique=True)
+        await self.inputs.create_index([("jobId", 1), ("chunk", 1)], unique=True)
+        await self.jobs.create_index([("status", 1), ("leaseUntil", 1)])
+        await self._reclaim_expired()
+        async for job in self.jobs.find({"status": QUEUED}, {"id": 1}).sort([("createdAt", 1)]):
+            self._queue.put_nowait(job["id"])
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reap()))
+
+    async def _reclaim_expired(self):
+        """Queue again the running jobs whose lease has expired; returns their ids"""
+        # Jobs claimed before leases existed have none and count as expired
+        expired = {"status": RUNNING, "$or": [
+            {"leaseUntil": {"$lt": datetime.utcnow()}}, {"leaseUntil": {"$exists": False}},
+        ]}
+        reclaimed = []
+        async for job in self.jobs.find(expired, {"id": 1}):
+            # Conditional per job, so only one replica requeues it
+            job = await self.jobs.find_one_and_update(
+                {"id": job["id"], **expired},
+                {"$set": {"status": QUEUED, "owner": None, "leaseUntil": None}},
+                projection={"id": 1},
+            )
+            if job is not None:
+                reclaimed.append(job["id"])
+        return reclaimed
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds)
+            try:
+                for job_id in await self._reclaim_expired():
+                    self._queue.put_nowait(job_id)
+            except PyMongoError:
+                logger.exception("Expired job leases could not be reclaimed")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def submit(self, kind, params, inputs=None):
+        """Queue a job; `inputs` (a list) are stored next to it and read back with JobContext.inputs"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = str(uuid.uuid4())
+        inputs = inputs or []
+        if inputs:
+            # Written before the job, so a worker never claims a job without its inputs
+            await self.inputs.insert_many([
+                {"jobId": job_id, "chunk": chunk, "items": inputs[start:start + self.input_chunk_size]}
+                for chunk, start in enumerate(range(0, len(inputs), self.input_chunk_size))
+            ])
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "params": params,
+            "inputCount": len(inputs),
+            "status": QUEUED,
+            "progress": 0.0,
+            "processed": 0,
+            "total": 0,
+            "summary": None,
+            "error": None,
+            "createdAt": datetime.utcnow(),
+            "startedAt": None,
+            "finishedAt": None,
+            "owner": None,
+            "leaseUntil": None,
+        }
+        await self.jobs.insert_one(dict(job))
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def get(self, job_id):
+        return await self.jobs.find_one({"id": job_id}, {"_id": 0, "params": 0})
+
+    async def list(self, limit=50):
+        cursor = self.jobs.find({}, {"_id": 0, "params": 0}).sort([("createdAt", -1)]).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def result_rows(self, job_id, after=None, limit=1000):
+        """Result rows in order, after the `after` row index"""
+        query = {"jobId": job_id}
+        if after is not None:
+            query["index"] = {"$gt": after}
+        cursor = self.results.find(query, {"_id": 0, "jobId": 0}).sort([("index", 1)]).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job, or None when it does not exist"""
+        job = await self.jobs.find_one_and_update(
+            {"id": job_id, "status": QUEUED},
+            {"$set": {"status": CANCELLED, "finishedAt": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            await self.inputs.delete_many({"jobId": job_id})
+            return {key: value for key, value in job.items() if key not in ("_id", "params")}
+        running = self._running.get(job_id)
+        if running is not None:
+            task, finished = running
+            self._cancel_requested.add(job_id)
+            task.cancel()
+            await finished.wait()
+        return await self.get(job_id)
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("Job %s could not be updated", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id):
+        job = await self.jobs.find_one_and_update(
+            {"id": job_id, "status": QUEUED},
+            {"$set": {
+                "status": RUNNING, "startedAt": datetime.utcnow(),
+                "owner": self.owner, "leaseUntil": self._lease_until(),
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            # Cancelled while queued, or claimed by another replica
+            return
+        await self.results.delete_many({"jobId": job_id})
+
+        context = JobContext(self, job)
+        task = asyncio.create_task(self.handlers[job["kind"]](context))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, task))
+        finished = asyncio.Event()
+        self._running[job_id] = (task, finished)
+        try:
+            try:
+                summary = await task
+                update = {"status": COMPLETED, "summary": summary, "progress": 1.0}
+            except asyncio.CancelledError:
+                if job_id in self._lease_lost:
+                    # Another replica has taken the job over
+                    return
+                if job_id not in self._cancel_requested:
+                    # The worker itself is being stopped (which cancels the
+                    # handler as well): leave the job running, it is taken
+                    # over once its lease expires
+                    task.cancel()
+                    raise
+                update = {"status": CANCELLED, "progress": context.fraction}
+            except Exception as error:
+                logger.exception("Job %s failed", job_id)
+                update = {"status": FAILED, "error": str(error), "progress": context.fraction}
+            update.update(
+                processed=context.processed, total=context.total, finishedAt=datetime.utcnow(),
+                owner=None, leaseUntil=None,
+            )
+            result = await self.jobs.update_one({"id": job_id, "owner": self.owner}, {"$set": update})
+            if result.matched_count:
+                await self.inputs.delete_many({"jobId": job_id})
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job_id, None)
+            self._cancel_requested.discard(job_id)
+            self._lease_lost.discard(job_id)
+            finished.set()
+
+    async def _heartbeat(self, job_id, task):
+        """Renew the job's lease while it runs; cancel the handler once the lease is lost"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                result = await self.jobs.update_one(
+                    {"id": job_id, "status": RUNNING, "owner": self.owner},
+                    {"$set": {"leaseUntil": self._lease_until()}},
+                )
+            except PyMongoError:
+                logger.exception("Lease of job %s could not be renewed", job_id)
+                continue
+            if not result.matched_count:
+                self._lease_lost.add(job_id)
+                task.cancel()
+                return
@@ -0,0 +1,378 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+
+# Upper bounds in seconds; requests here range from sub-millisecond catalog
+# reads to multi-second batch quotes
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(self.labels, labels)} {value}"
+
+
+class Gauge:
+    """Current value per label combination, moved up and down"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(self.labels, labels)} {value}"
+
+
+class Histogram:
+    """Bucketed observations per label combination.
+
+    An observation is one bisect and three additions under a lock; the
+    cumulative bucket counts Prometheus expects are only built on scrape.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Bucket counts (the last one is +Inf), sum, count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_label_text(self.labels, labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_label_text(self.labels, labels)} {count}"
+
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text format"""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status code",
+    ("method", "route", "status"),
+)
+http_duration = registry.histogram(
+    "http_request_duration_seconds", "Time from receiving a request to sending the last response byte",
+    ("method", "route"),
+)
+http_validation = registry.histogram(
+    "http_request_validation_seconds", "Reading and validating the request before the endpoint runs",
+    ("route",),
+)
+http_serialization = registry.histogram(
+    "http_response_serialization_seconds",
+    "Validating the returned value against the response model and encoding it",
+    ("route",),
+)
+mongo_commands = registry.counter(
+    "mongodb_commands_total", "MongoDB commands by outcome",
+    ("command", "collection", "outcome"),
+)
+mongo_duration = registry.histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trips as reported by the driver",
+    ("command", "collection"),
+)
+mongo_connections = registry.gauge(
+    "mongodb_pool_connections", "Open MongoDB connections by state (idle or in_use)",
+    ("state",),
+)
+mongo_checkout_failures = registry.counter(
+    "mongodb_pool_checkout_failures_total", "Connection checkouts that failed, by reason",
+    ("reason",),
+)
+mongo_pool_clears = registry.counter(
+    "mongodb_pool_cleared_total", "Times the driver cleared the pool after a network error or failover",
+)
+quote_stages = registry.histogram(
+    "quote_engine_stage_seconds", "Quote engine stages run in this process",
+    ("stage",),
+)
+
+
+def observe_stage(stage, seconds):
+    """Observer for quote_engine.set_stage_observer"""
+    quote_stages.observe((stage,), seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts and latency per route template.
+
+    The route is labelled with its path template (/api/quotes/{quote_id}),
+    so ids in the URL do not create a series each; unmatched paths share
+    one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            http_duration.observe((scope["method"], route), time.perf_counter() - started)
+            http_requests.inc((scope["method"], route, str(status)))
+
+
+# Per request timestamps shared between a TimedRoute handler and its endpoint
+_endpoint_timings = contextvars.ContextVar("endpoint_timings", default=None)
+
+
+def _timed_endpoint(endpoint):
+    @functools.wraps(endpoint)
+    async def timed(*args, **kwargs):
+        timings = _endpoint_timings.get()
+        if timings is not None:
+            timings["started"] = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            if timings is not None:
+                timings["finished"] = time.perf_counter()
+
+    timed.timed_endpoint = True
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that splits handler time into validation, endpoint and serialization.
+
+    Everything before the endpoint starts (body parsing, dependency and
+    request model validation) is validation; everything after it returns
+    (response model validation and JSON encoding) is serialization. Only
+    async endpoints are timed.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        # include_router() builds the prefixed routes from the already wrapped endpoint
+        if not getattr(endpoint, "timed_endpoint", False) and asyncio.iscoroutinefunction(endpoint):
+            endpoint = _timed_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def timed_handler(request):
+            timings = {}
+            token = _endpoint_timings.set(timings)
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                finished = time.perf_counter()
+                _endpoint_timings.reset(token)
+                if "started" in timings:
+                    http_validation.observe((route,), timings["started"] - started)
+                if "finished" in timings:
+                    http_serialization.observe((route,), finished - timings["finished"])
+
+        return timed_handler
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts and times every command the driver sends.
+
+    Listeners run on the driver's threads; the started event is only needed
+    to remember which collection a request id was for.
+    """
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        self._collections[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else ""
+        )
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+    def _finish(self, event, outcome):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        mongo_commands.inc((event.command_name, collection, outcome))
+        mongo_duration.observe((event.command_name, collection), event.duration_micros / 1e6)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Tracks connection pool health for the metrics and the readiness probe.
+
+    A cleared pool (network error, primary stepdown) counts as unhealthy
+    until the driver has established a connection again.
+    """
+
+    def __init__(self):
+        self.healthy = True
+        self.cleared_at = None
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def state(self):
+        with self._lock:
+            states = list(self._states.values())
+        return {"open": len(states), "inUse": states.count("in_use")}
+
+    def _move(self, event, state):
+        key = (event.address, event.connection_id)
+        with self._lock:
+            previous = self._states.pop(key, None)
+            if state is not None:
+                self._states[key] = state
+        if previous is not None:
+            mongo_connections.dec((previous,))
+        if state is not None:
+            mongo_connections.inc((state,))
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        self.healthy = True
+
+    def pool_cleared(self, event):
+        self.healthy = False
+        self.cleared_at = time.time()
+        mongo_pool_clears.inc()
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        self.healthy = True
+        self._move(event, "idle")
+
+    def connection_closed(self, event):
+        self._move(event, None)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        mongo_checkout_failures.inc((event.reason,))
+
+    def connection_checked_out(self, event):
+        self._move(event, "in_use")
+
+    def connection_checked_in(self, event):
+        self._move(event, "idle")
@@ -0,0 +1,6 @@
+# MongoDB server error codes
+
+# An index that exists with other options (IndexOptionsConflict, IndexKeySpecsConflict)
+INDEX_CONFLICT_CODES = (85, 86)
+
+DUPLICATE_KEY = 11000
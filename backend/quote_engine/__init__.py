@@ -0,0 +1,65 @@
+"""Server side quoting engine for the printing cost calculator.
+
+The catalog (paper types and machines) is flattened into NumPy columns once and
+every quote is evaluated over the whole print sheet x stock sheet cross product
+at the same time instead of in nested loops.
+"""
+
+from .booklet import BookletPart, booklet_parts, optimize_booklet
+from .cache import QuoteCache
+from .catalog import CatalogArrays
+from .fit_index import SheetFitIndex
+from .engine import (
+    CandidateTable,
+    PartSpec,
+    candidates_to_dicts,
+    evaluate_part,
+    job_parts,
+    normalize_parts,
+    pareto_front,
+    print_sheet_yield,
+    quote_batch,
+    quote_job,
+    rank,
+    restrict,
+)
+from .feasibility import FeasibilityIndex, feasible_combinations
+from .gang import plan_gang_runs
+from .imposition import guillotine_count, guillotine_layout
+from .pool import QuotePool, SharedCatalog
+from .schedule import WorkingCalendar, naive_utc, schedule_jobs
+from .stages import set_stage_observer
+from .sweep import quantity_sweep
+
+__all__ = [
+    "BookletPart",
+    "CatalogArrays",
+    "CandidateTable",
+    "FeasibilityIndex",
+    "PartSpec",
+    "QuoteCache",
+    "QuotePool",
+    "SharedCatalog",
+    "SheetFitIndex",
+    "WorkingCalendar",
+    "booklet_parts",
+    "candidates_to_dicts",
+    "evaluate_part",
+    "feasible_combinations",
+    "guillotine_count",
+    "guillotine_layout",
+    "job_parts",
+    "naive_utc",
+    "normalize_parts",
+    "optimize_booklet",
+    "pareto_front",
+    "plan_gang_runs",
+    "print_sheet_yield",
+    "quantity_sweep",
+    "quote_batch",
+    "quote_job",
+    "rank",
+    "restrict",
+    "schedule_jobs",
+    "set_stage_observer",
+]
@@ -0,0 +1,238 @@
+import math
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import numpy as np
+
+from .engine import (
+    PartSpec,
+    candidates_to_dicts,
+    effective_dimensions,
+    evaluate_part,
+    job_margins,
+    restrict,
+)
+from .stages import stage
+
+
+@dataclass(frozen=True)
+class BookletPart:
+    """A booklet component, optionally pinned to a paper type and/or machine"""
+    spec: PartSpec
+    page_count: int
+    paper_type_id: Optional[int] = None
+    machine_id: Optional[int] = None
+
+
+def booklet_parts(job, inner_configs, cover_paper_type_id=None, cover_machine_id=None):
+    """The cover plus one part per inner configuration.
+
+    Each inner configuration is a dict with pageCount and optional paperTypeId
+    and machineId. Without configurations all inner pages form a single part.
+    As in the calculator, one doubled sheet carries four pages.
+    """
+    width, height = effective_dimensions(job)
+    margins = job_margins(job)
+    quantity = job["quantity"]
+    click_multiplier = 2 if job.get("isDoubleSided") else 1
+
+    parts = [
+        BookletPart(
+            spec=PartSpec(
+                name="cover",
+                width=width,
+                height=height,
+                units=quantity,
+                quantity=quantity,
+                click_multiplier=2,
+                setup_required=bool(job.get("coverSetupRequired")),
+                **margins,
+            ),
+            page_count=4,
+            paper_type_id=cover_paper_type_id,
+            machine_id=cover_machine_id,
+        )
+    ]
+
+    if not inner_configs:
+        inner_pages = max(0, (job.get("totalPages") or 0) - 4)
+        inner_configs = [{"pageCount": inner_pages}] if inner_pages else []
+
+    for number, config in enumerate(inner_configs, start=1):
+        page_count = config["pageCount"]
+        if page_count <= 0:
+            continue
+        parts.append(
+            BookletPart(
+                spec=PartSpec(
+                    name="innerPages" if len(inner_configs) == 1 else f"innerPages{number}",
+                    width=width,
+                    height=height,
+                    units=quantity * math.ceil(page_count / 4),
+                    quantity=quantity,
+                    click_multiplier=click_multiplier,
+                    setup_required=bool(job.get("setupRequired")),
+                    **margins,
+                ),
+                page_count=page_count,
+                paper_type_id=config.get("paperTypeId"),
+                machine_id=config.get("machineId"),
+            )
+        )
+    return parts
+
+
+def best_per_machine(catalog, part):
+    """Cheapest candidate of a part on each machine, ignoring setup cost"""
+    table = evaluate_part(catalog, replace(part.spec, setup_required=False))
+    table = restrict(catalog, table, part.paper_type_id, part.machine_id)
+    if len(table) == 0:
+        return table
+
+    # Candidates come out grouped by machine, as print sheets are laid out
+    # machine by machine, so each machine is one contiguous segment
+    machine = catalog.print_machine[table.print_index]
+    starts = np.flatnonzero(np.r_[True, machine[1:] != machine[:-1]])
+    segment_min = np.minimum.reduceat(table.total_cost, starts)
+    lengths = np.diff(np.r_[starts, len(machine)])
+    (rows,) = np.nonzero(table.total_cost == np.repeat(segment_min, lengths))
+
+    # Among equally cheap rows of a machine prefer the lowest waste
+    rows = rows[np.lexsort((table.waste_percentage[rows], machine[rows]))]
+    _, first = np.unique(machine[rows], return_index=True)
+    return table.take(rows[first])
+
+
+def optimize_booklet(catalog, job, inner_configs, cover_paper_type_id=None,
+                     cover_machine_id=None, max_nodes=200000):
+    """Choose the cover and every inner part assignment together.
+
+    A machine's setupCost is charged once when any part that requires setup
+    runs on it, so sharing a press between parts can beat pricing each part
+    on its own. The search is a depth first branch-and-bound over the
+    machine of each part:
+
+    * per part only the cheapest option per machine is kept, and machines
+      whose running cost exceeds the cheapest "running cost + setup" of the
+      part are dropped, since that option is never worse;
+    * the bound is the cost so far plus the cheapest running cost of every
+      part still to assign (setup costs are non-negative);
+    * the search starts from a greedy assignment and stops after `max_nodes`
+      nodes, in which case the best assignment found is returned with
+      optimal=False.
+
+    Raises ValueError when a part has no feasible option.
+    """
+    parts = booklet_parts(job, inner_configs, cover_paper_type_id, cover_machine_id)
+    setup_by_machine = {}
+    tables = []
+    options = []
+    for part in parts:
+        table = best_per_machine(catalog, part)
+        if len(table) == 0:
+            raise ValueError(
+                f"No suitable paper type, machine and sheet size combination for {part.spec.name}"
+            )
+        running = table.total_cost.tolist()
+        machines = catalog.print_machine[table.print_index].tolist()
+        for machine, setup in zip(machines, catalog.setup_cost[table.print_index].tolist()):
+            setup_by_machine[machine] = setup
+
+        requires_setup = part.spec.setup_required
+        threshold = min(
+            cost + (setup_by_machine[machine] if requires_setup else 0)
+            for cost, machine in zip(running, machines)
+        )
+        options.append(sorted(
+            (cost, machine, row)
+            for row, (cost, machine) in enumerate(zip(running, machines))
+            if cost <= threshold + 1e-9
+        ))
+        tables.append(table)
+
+    # Decide the most expensive parts first; they dominate the bound
+    order = sorted(range(len(parts)), key=lambda index: -options[index][0][0])
+    requires_setup = [parts[index].spec.setup_required for index in order]
+    ordered_options = [options[index] for index in order]
+    remaining_bound = [0.0] * (len(order) + 1)
+    for depth in range(len(order) - 1, -1, -1):
+        remaining_bound[depth] = remaining_bound[depth + 1] + ordered_options[depth][0][0]
+
+    def step_cost(depth, cost, machine, opened):
+        if requires_setup[depth] and machine not in opened:
+            return cost + setup_by_machine[machine]
+        return cost
+
+    # Greedy assignment as the initial upper bound
+    best_choice, best_cost, opened = [], 0.0, set()
+    for depth, part_options in enumerate(ordered_options):
+        cost, machine, row = min(
+            part_options, key=lambda option: step_cost(depth, option[0], option[1], opened)
+        )
+        best_cost += step_cost(depth, cost, machine, opened)
+        if requires_setup[depth]:
+            opened.add(machine)
+        best_choice.append(row)
+
+    nodes = 0
+    choice = []
+    opened_count = {}
+
+    def search(depth, cost_so_far):
+        nonlocal best_cost, best_choice, nodes
+        nodes += 1
+        if nodes > max_nodes or cost_so_far + remaining_bound[depth] >= best_cost - 1e-9:
+            return
+        if depth == len(ordered_options):
+            best_cost = cost_so_far
+            best_choice = list(choice)
+            return
+        for cost, machine, row in ordered_options[depth]:
+            added = step_cost(depth, cost, machine, opened_count)
+            choice.append(row)
+            if requires_setup[depth]:
+                opened_count[machine] = opened_count.get(machine, 0) + 1
+            search(depth + 1, cost_so_far + added)
+            if requires_setup[depth]:
+                opened_count[machine] -= 1
+                if not opened_count[machine]:
+                    del opened_count[machine]
+            choice.pop()
+
+    with stage("booklet_search"):
+        search(0, 0.0)
+
+    rows = [None] * len(parts)
+    for depth, index in enumerate(order):
+        rows[index] = best_choice[depth]
+
+    results = []
+    charged = set()
+    for part, table, row in zip(parts, tables, rows):
+        selected = table.take(np.array([row]))
+        machine = int(catalog.print_machine[selected.print_index[0]])
+        if part.spec.setup_required and machine not in charged:
+            charged.add(machine)
+            selected.setup_cost = np.array([setup_by_machine[machine]])
+            selected.total_cost = selected.total_cost + selected.setup_cost
+            selected.cost_per_unit = selected.total_cost / part.spec.quantity
+        selected.part = part.spec
+        results.append({
+            "part": part.spec.name,
+            "pageCount": part.page_count,
+            "candidate": candidates_to_dicts(catalog, selected)[0],
+        })
+
+    setup_cost = sum(setup_by_machine[machine] for machine in charged)
+    machines_used = sorted({
+        int(catalog.machine_ids[catalog.print_machine[table.print_index[row]]])
+        for table, row in zip(tables, rows)
+    })
+    return {
+        "parts": results,
+        "totalCost": sum(result["candidate"]["totalCost"] for result in results),
+        "setupCost": setup_cost,
+        "machinesUsed": machines_used,
+        "optimal": nodes <= max_nodes,
+        "nodesExplored": nodes,
+    }
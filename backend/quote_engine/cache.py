@@ -0,0 +1,75 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+class QuoteCache:
+    """Bounded LRU of quote results with a time to live.
+
+    Keys are a canonical hash of the request (job fields plus options) and
+    the catalog digest they were priced against. When a lookup arrives with
+    a different catalog digest every entry is dropped, so results computed
+    against an older catalog are never served.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._catalog_digest = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(kind, request):
+        """Canonical hash of a JSON-compatible request"""
+        payload = json.dumps([kind, request], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def _check_catalog(self, catalog_digest):
+        if catalog_digest != self._catalog_digest:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._catalog_digest = catalog_digest
+
+    def get(self, key, catalog_digest):
+        """Cached value or None"""
+        self._check_catalog(catalog_digest)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, value = entry
+        if expires < self.clock():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, catalog_digest, value):
+        self._check_catalog(catalog_digest)
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
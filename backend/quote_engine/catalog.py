@@ -0,0 +1,128 @@
+import numpy as np
+
+from .feasibility import FeasibilityIndex
+from .fit_index import SheetFitIndex
+
+
+class CatalogArrays:
+    """Columnar view of the paper type and machine catalog.
+
+    Every print sheet size of every machine becomes one row of the print
+    columns and every stock sheet size of every paper type one row of the
+    stock columns. The job independent part of the cost search (which print
+    sheets fit on which stock sheets, and how many) is computed once here and
+    shared by every quote priced against this catalog. Passing the same
+    `fit_index` to successive catalogs only computes sizes that are new.
+    """
+
+    # Numeric columns; everything a quote needs besides the item dicts
+    COLUMNS = (
+        "paper_type_ids", "machine_ids",
+        "print_machine", "print_width", "print_height", "click_cost", "duplex_support", "setup_cost",
+        "stock_paper", "stock_width", "stock_height", "gsm", "price_per_ton", "stock_area",
+        "pair_print", "pair_stock", "pair_sheets_per_stock_sheet",
+    )
+
+    def __init__(self, paper_types, machines, fit_index=None):
+        self.fit_index = fit_index if fit_index is not None else SheetFitIndex()
+        self.paper_types = list(paper_types)
+        self.machines = list(machines)
+        self.paper_type_ids = np.array([p["id"] for p in self.paper_types], dtype=np.int64)
+        self.machine_ids = np.array([m["id"] for m in self.machines], dtype=np.int64)
+
+        print_entries = [
+            (machine_index, sheet)
+            for machine_index, machine in enumerate(self.machines)
+            for sheet in machine["printSheetSizes"]
+        ]
+        stock_entries = [
+            (paper_index, sheet)
+            for paper_index, paper_type in enumerate(self.paper_types)
+            for sheet in paper_type["stockSheetSizes"]
+        ]
+        self.print_sheets = [sheet for _, sheet in print_entries]
+        self.stock_sheets = [sheet for _, sheet in stock_entries]
+
+        # Print sheet columns
+        self.print_machine = np.array([m for m, _ in print_entries], dtype=np.intp)
+        self.print_width = np.array([s["width"] for _, s in print_entries], dtype=np.float64)
+        self.print_height = np.array([s["height"] for _, s in print_entries], dtype=np.float64)
+        self.click_cost = np.array([s["clickCost"] for _, s in print_entries], dtype=np.float64)
+        self.duplex_support = np.array([s["duplexSupport"] for _, s in print_entries], dtype=bool)
+        self.setup_cost = np.array(
+            [m["setupCost"] for m in self.machines], dtype=np.float64
+        )[self.print_machine]
+
+        # Stock sheet columns
+        self.stock_paper = np.array([p for p, _ in stock_entries], dtype=np.intp)
+        self.stock_width = np.array([s["width"] for _, s in stock_entries], dtype=np.float64)
+        self.stock_height = np.array([s["height"] for _, s in stock_entries], dtype=np.float64)
+        self.gsm = np.array(
+            [p["gsm"] for p in self.paper_types], dtype=np.float64
+        )[self.stock_paper]
+        self.price_per_ton = np.array(
+            [p["pricePerTon"] for p in self.paper_types], dtype=np.float64
+        )[self.stock_paper]
+        self.stock_area = (self.stock_width * self.stock_height) / 1000000  # m²
+
+        self._build_fit_table()
+
+    @classmethod
+    def from_columns(cls, paper_types, machines, columns, fit_index=None):
+        """Rebuild a catalog from its COLUMNS without repeating the fit search.
+
+        Used by quote worker processes, which receive the columns through
+        shared memory. Only the print sizes are registered with the fit index
+        (for the products per print sheet memo); `stock_cols` stays empty.
+        """
+        catalog = cls.__new__(cls)
+        catalog.fit_index = fit_index if fit_index is not None else SheetFitIndex()
+        catalog.paper_types = list(paper_types)
+        catalog.machines = list(machines)
+        catalog.print_sheets = [
+            sheet for machine in catalog.machines for sheet in machine["printSheetSizes"]
+        ]
+        catalog.stock_sheets = [
+            sheet for paper_type in catalog.paper_types for sheet in paper_type["stockSheetSizes"]
+        ]
+        for name in cls.COLUMNS:
+            setattr(catalog, name, columns[name])
+        catalog.print_rows, catalog.stock_cols = catalog.fit_index.register(
+            list(zip(catalog.print_width.tolist(), catalog.print_height.tolist())), []
+        )
+        catalog._build_lookups()
+        return catalog
+
+    def _build_fit_table(self):
+        """Look up printSheetsPerStockSheet for every compatible print/stock pair"""
+        self.print_rows, self.stock_cols = self.fit_index.register(
+            list(zip(self.print_width.tolist(), self.print_height.tolist())),
+            list(zip(self.stock_width.tolist(), self.stock_height.tolist())),
+        )
+        per_stock_sheet = self.fit_index.sheets_per_stock_sheet(self.print_rows, self.stock_cols)
+
+        pair_print, pair_stock = np.nonzero(per_stock_sheet > 0)
+        self.pair_print = pair_print
+        self.pair_stock = pair_stock
+        self.pair_sheets_per_stock_sheet = per_stock_sheet[pair_print, pair_stock]
+        self._build_lookups()
+
+    def _build_lookups(self):
+        """Feasibility index over the print sheets and where each print sheet's pairs start.
+
+        Pairs are ordered by print sheet row, so the pairs of one print sheet
+        are the slice pair_offsets[row]:pair_offsets[row + 1].
+        """
+        self.feasibility = FeasibilityIndex(self.print_width, self.print_height)
+        self.pair_offsets = np.searchsorted(self.pair_print, np.arange(len(self.print_width) + 1))
+
+    def pairs_of(self, print_rows):
+        """Pair indexes of the given print sheet rows; ascending rows keep the pair order"""
+        starts = self.pair_offsets[print_rows]
+        counts = self.pair_offsets[np.asarray(print_rows) + 1] - starts
+        ends = np.cumsum(counts)
+        return np.repeat(starts - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+
+    @property
+    def pair_count(self):
+        return len(self.pair_print)
@@ -0,0 +1,404 @@
+import math
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+from .imposition import PRODUCT_LAYOUT_DEPTH, guillotine_count
+from .stages import stage
+
+
+@dataclass(frozen=True)
+class PartSpec:
+    """One separately priced component of a print job"""
+    name: str
+    width: float
+    height: float
+    margin_top: float
+    margin_right: float
+    margin_bottom: float
+    margin_left: float
+    units: int  # pieces of width x height that have to be printed
+    quantity: int  # ordered quantity, used for costPerUnit
+    click_multiplier: int
+    setup_required: bool
+
+    @property
+    def area(self):
+        return (self.width * self.height) / 1000000  # m²
+
+
+@dataclass
+class CandidateTable:
+    """Feasible (print sheet, stock sheet) combinations for one part, as columns"""
+    part: PartSpec
+    print_index: np.ndarray
+    stock_index: np.ndarray
+    products_per_print_sheet: np.ndarray
+    print_sheets_needed: np.ndarray
+    print_sheets_per_stock_sheet: np.ndarray
+    stock_sheets_needed: np.ndarray
+    paper_weight: np.ndarray
+    paper_cost: np.ndarray
+    click_cost: np.ndarray
+    setup_cost: np.ndarray
+    total_cost: np.ndarray
+    cost_per_unit: np.ndarray
+    waste_percentage: np.ndarray
+
+    def __len__(self):
+        return len(self.print_index)
+
+    def take(self, order):
+        """Return the rows selected by an index array, in that order"""
+        columns = {
+            f.name: getattr(self, f.name)[order]
+            for f in fields(self)
+            if f.name != "part"
+        }
+        return CandidateTable(part=self.part, **columns)
+
+
+def effective_dimensions(job):
+    """Flat size of a booklet sheet: the binding edge dimension is doubled"""
+    if job.get("bindingEdge", "short") == "short":
+        return job["finalWidth"], job["finalHeight"] * 2
+    return job["finalHeight"], job["finalWidth"] * 2
+
+
+def job_margins(job):
+    """PartSpec margin fields of a job"""
+    return dict(
+        margin_top=job.get("marginTop", 0),
+        margin_right=job.get("marginRight", 0),
+        margin_bottom=job.get("marginBottom", 0),
+        margin_left=job.get("marginLeft", 0),
+    )
+
+
+def job_parts(job):
+    """Split a job into the parts that are priced independently.
+
+    A flat job is a single "product" part. A booklet is priced as a "cover"
+    part (one wrap-around cover per booklet, always printed on both sides) and
+    an "innerPages" part where one doubled sheet carries four pages.
+    """
+    margins = job_margins(job)
+    quantity = job["quantity"]
+    click_multiplier = 2 if job.get("isDoubleSided") else 1
+
+    if not job.get("isBookletMode"):
+        return [
+            PartSpec(
+                name="product",
+                width=job["finalWidth"],
+                height=job["finalHeight"],
+                units=quantity,
+                quantity=quantity,
+                click_multiplier=click_multiplier,
+                setup_required=bool(job.get("setupRequired")),
+                **margins,
+            )
+        ]
+
+    width, height = effective_dimensions(job)
+    parts = [
+        PartSpec(
+            name="cover",
+            width=width,
+            height=height,
+            units=quantity,
+            quantity=quantity,
+            click_multiplier=2,
+            setup_required=bool(job.get("coverSetupRequired")),
+            **margins,
+        )
+    ]
+
+    inner_pages_per_booklet = max(0, (job.get("totalPages") or 0) - 4)
+    inner_sheets_per_booklet = math.ceil(inner_pages_per_booklet / 4)
+    if inner_sheets_per_booklet > 0:
+        parts.append(
+            PartSpec(
+                name="innerPages",
+                width=width,
+                height=height,
+                units=quantity * inner_sheets_per_booklet,
+                quantity=quantity,
+                click_multiplier=click_multiplier,
+                setup_required=bool(job.get("setupRequired")),
+                **margins,
+            )
+        )
+    return parts
+
+
+def products_per_sheet(sheet_width, sheet_height, part):
+    """Vectorised calculateProductsPerSheet over arrays of sheet sizes.
+
+    Products are laid out on the usable area with the best guillotine block
+    layout, which may turn some or all of them by 90 degrees; the
+    calculator's unrotated grid is the depth 1 case.
+    """
+    usable_width = np.maximum(sheet_width - part.margin_left - part.margin_right, 0)
+    usable_height = np.maximum(sheet_height - part.margin_top - part.margin_bottom, 0)
+
+    return guillotine_count(usable_width, usable_height, part.width, part.height, PRODUCT_LAYOUT_DEPTH)
+
+
+def print_sheet_yield(catalog, part):
+    """Products per print sheet for every print sheet row of the catalog.
+
+    Parts no print sheet can hold (found with the catalog's feasibility
+    index) skip the layout search altogether.
+    """
+    if part.width > 0 and part.height > 0 and part.units > 0 and catalog.feasibility.part_fits_any(part):
+        return catalog.fit_index.products_per_sheet(part)[catalog.print_rows]
+    return np.zeros(len(catalog.print_width))
+
+
+def usable_pairs(catalog, per_print_sheet):
+    """Compatible pairs whose print sheet holds at least one product"""
+    (usable_print,) = np.nonzero(per_print_sheet > 0)
+    if len(usable_print) == len(per_print_sheet):
+        return catalog.pair_print, catalog.pair_stock, catalog.pair_sheets_per_stock_sheet
+    pairs = catalog.pairs_of(usable_print)
+    return (
+        catalog.pair_print[pairs],
+        catalog.pair_stock[pairs],
+        catalog.pair_sheets_per_stock_sheet[pairs],
+    )
+
+
+def cost_columns(catalog, part, per_print_sheet, print_index, stock_index,
+                 print_sheets_per_stock_sheet, units, quantity):
+    """Sheet counts and costs of the given pairs for `units` pieces.
+
+    `units` and `quantity` may be column vectors, in which case every column
+    gets one row per value (used to price many quantities in one pass).
+    """
+    # Quantities that only depend on the print sheet are computed per print
+    # sheet row and then spread over its pairs. Rows that yield nothing
+    # (0/0 when no units are needed) are never chosen, so inf/nan is fine there
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sheets_needed_by_print = np.ceil(units / per_print_sheet)
+        click_cost_by_print = sheets_needed_by_print * catalog.click_cost * part.click_multiplier
+
+    print_sheets_needed = sheets_needed_by_print[..., print_index]
+    stock_sheets_needed = np.ceil(print_sheets_needed / print_sheets_per_stock_sheet)
+
+    stock_area = catalog.stock_area[stock_index]
+    paper_weight = (stock_area * catalog.gsm[stock_index] * stock_sheets_needed) / 1000  # kg
+    paper_cost = (paper_weight / 1000) * catalog.price_per_ton[stock_index]
+
+    click_cost = click_cost_by_print[..., print_index]
+    if part.setup_required:
+        setup_cost = catalog.setup_cost[print_index]
+    else:
+        setup_cost = np.zeros(len(print_index))
+    total_cost = paper_cost + click_cost + setup_cost
+
+    return dict(
+        print_sheets_needed=print_sheets_needed,
+        stock_sheets_needed=stock_sheets_needed,
+        paper_weight=paper_weight,
+        paper_cost=paper_cost,
+        click_cost=click_cost,
+        setup_cost=np.broadcast_to(setup_cost, total_cost.shape),
+        total_cost=total_cost,
+        cost_per_unit=total_cost / quantity,
+    )
+
+
+def waste_percentage(catalog, part, stock_index, products_per_print_sheet,
+                     print_sheets_per_stock_sheet):
+    stock_area = catalog.stock_area[stock_index]
+    used_area = part.area * products_per_print_sheet * print_sheets_per_stock_sheet
+    return ((stock_area - used_area) / stock_area) * 100
+
+
+def evaluate_part(catalog, part, per_print_sheet=None):
+    """Cost every compatible print/stock sheet pair of the catalog for one part"""
+    if per_print_sheet is None:
+        with stage("fit"):
+            per_print_sheet = print_sheet_yield(catalog, part)
+    with stage("candidates"):
+        print_index, stock_index, print_sheets_per_stock_sheet = usable_pairs(catalog, per_print_sheet)
+        products_per_print_sheet = per_print_sheet[print_index]
+
+    with stage("costing"):
+        return CandidateTable(
+            part=part,
+            print_index=print_index,
+            stock_index=stock_index,
+            products_per_print_sheet=products_per_print_sheet,
+            print_sheets_per_stock_sheet=print_sheets_per_stock_sheet,
+            waste_percentage=waste_percentage(
+                catalog, part, stock_index, products_per_print_sheet, print_sheets_per_stock_sheet
+            ),
+            **cost_columns(
+                catalog, part, per_print_sheet, print_index, stock_index,
+                print_sheets_per_stock_sheet, part.units, part.quantity,
+            ),
+        )
+
+
+def restrict(catalog, table, paper_type_id=None, machine_id=None):
+    """Keep only candidates on the given paper type and/or machine"""
+    if paper_type_id is None and machine_id is None:
+        return table
+    keep = np.ones(len(table), dtype=bool)
+    if paper_type_id is not None:
+        keep &= catalog.paper_type_ids[catalog.stock_paper[table.stock_index]] == paper_type_id
+    if machine_id is not None:
+        keep &= catalog.machine_ids[catalog.print_machine[table.print_index]] == machine_id
+    return table.take(np.nonzero(keep)[0])
+
+
+def rank(table, limit=None):
+    """Order candidates by total cost, then by waste percentage (lower is better).
+
+    With a limit only the top `limit` rows are sorted: a partial selection
+    finds the cost threshold in linear time and only the rows at or below it
+    are ordered.
+    """
+    if limit is not None and limit < len(table):
+        if limit <= 0:
+            return table.take(np.empty(0, dtype=np.intp))
+        threshold = np.partition(table.total_cost, limit - 1)[limit - 1]
+        (selected,) = np.nonzero(table.total_cost <= threshold)
+        order = selected[np.lexsort((table.waste_percentage[selected], table.total_cost[selected]))]
+        return table.take(order[:limit])
+
+    order = np.lexsort((table.waste_percentage, table.total_cost))
+    return table.take(order)
+
+
+def pareto_front(table, limit=None):
+    """Keep only candidates no other candidate beats on both cost and waste.
+
+    The result is ordered by total cost, so waste strictly decreases along it.
+    """
+    if len(table) == 0:
+        return table
+
+    # Nothing with at least the waste of the cheapest option can be on the front
+    cheapest = np.argmin(table.total_cost)
+    (contenders,) = np.nonzero(table.waste_percentage < table.waste_percentage[cheapest])
+    contenders = np.append(contenders, cheapest)
+
+    order = contenders[np.lexsort((table.waste_percentage[contenders], table.total_cost[contenders]))]
+    waste = table.waste_percentage[order]
+    best_so_far = np.minimum.accumulate(waste)
+    on_front = np.empty(len(order), dtype=bool)
+    on_front[0] = True
+    on_front[1:] = waste[1:] < best_so_far[:-1]
+
+    front = order[on_front]
+    if limit is not None:
+        front = front[:limit]
+    return table.take(front)
+
+
+SELECTIONS = {
+    "ranked": rank,
+    "pareto": pareto_front,
+}
+
+
+# Candidate keys holding whole catalog entities; see normalize_parts
+EMBEDDED_ENTITIES = ("machine", "printSheetSize", "paperType", "stockSheetSize")
+
+
+def candidates_to_dicts(catalog, table):
+    """Expand a candidate table into the result objects the calculator renders"""
+    machine_index = catalog.print_machine[table.print_index].tolist()
+    paper_index = catalog.stock_paper[table.stock_index].tolist()
+    columns = {
+        "productsPerPrintSheet": table.products_per_print_sheet.astype(int).tolist(),
+        "printSheetsNeeded": table.print_sheets_needed.astype(int).tolist(),
+        "printSheetsPerStockSheet": table.print_sheets_per_stock_sheet.astype(int).tolist(),
+        "stockSheetsNeeded": table.stock_sheets_needed.astype(int).tolist(),
+        "paperWeight": table.paper_weight.tolist(),
+        "paperCost": table.paper_cost.tolist(),
+        "clickCost": table.click_cost.tolist(),
+        "setupCost": table.setup_cost.tolist(),
+        "totalCost": table.total_cost.tolist(),
+        "costPerUnit": table.cost_per_unit.tolist(),
+        "wastePercentage": table.waste_percentage.tolist(),
+    }
+
+    candidates = []
+    for row, (print_index, stock_index) in enumerate(
+        zip(table.print_index.tolist(), table.stock_index.tolist())
+    ):
+        candidate = {
+            "machine": catalog.machines[machine_index[row]],
+            "printSheetSize": catalog.print_sheets[print_index],
+            "paperType": catalog.paper_types[paper_index[row]],
+            "stockSheetSize": catalog.stock_sheets[stock_index],
+            "clickMultiplier": table.part.click_multiplier,
+        }
+        for key, values in columns.items():
+            candidate[key] = values[row]
+        candidates.append(candidate)
+    return candidates
+
+
+def normalize_parts(parts, machines, paper_types):
+    """quote_job results with the embedded catalog entities replaced by their ids.
+
+    Each candidate keeps machineId, printSheetSizeId, paperTypeId and
+    stockSheetSizeId (sheet size ids are only unique within their machine or
+    paper type). The referenced machines and paper types are collected into
+    the `machines` and `paper_types` dicts (id -> item), so a response lists
+    each once however many candidates or jobs use it.
+    """
+    normalized = []
+    for part in parts:
+        candidates = []
+        for candidate in part["candidates"]:
+            machine, paper_type = candidate["machine"], candidate["paperType"]
+            machines[machine["id"]] = machine
+            paper_types[paper_type["id"]] = paper_type
+            row = {
+                "machineId": machine["id"],
+                "printSheetSizeId": candidate["printSheetSize"]["id"],
+                "paperTypeId": paper_type["id"],
+                "stockSheetSizeId": candidate["stockSheetSize"]["id"],
+            }
+            row.update((key, value) for key, value in candidate.items() if key not in EMBEDDED_ENTITIES)
+            candidates.append(row)
+        normalized.append({**part, "candidates": candidates})
+    return normalized
+
+
+def quote_job(catalog, job, limit=None, selection="ranked"):
+    """Price a job against the catalog and return the selected candidates per part.
+
+    `selection` is "ranked" (cheapest first, top `limit`) or "pareto" (the
+    cost versus waste trade-off front).
+    """
+    select = SELECTIONS[selection]
+    parts = []
+    for part in job_parts(job):
+        table = evaluate_part(catalog, part)
+        with stage("ranking"):
+            ranked = select(table, limit)
+        with stage("expansion"):
+            candidates = candidates_to_dicts(catalog, ranked)
+        parts.append({
+            "part": part.name,
+            "totalCandidates": len(table),
+            "candidates": candidates,
+        })
+    return parts
+
+
+def quote_batch(catalog, jobs, limit=1, selection="ranked"):
+    """Price many jobs against one catalog, keeping the results in input order.
+
+    Products per print sheet only depend on the part geometry, so jobs that
+    share a size and margins (a storefront drop is mostly A4/A5/DL) hit the
+    catalog's fit index memo instead of recomputing it.
+    """
+    return [quote_job(catalog, job, limit, selection) for job in jobs]
@@ -0,0 +1,157 @@
+import numpy as np
+
+# Sheets per block of the height maxima used to prune dominance queries
+FEASIBILITY_BLOCK = 64
+
+
+def holds_one(sheet_width, sheet_height, item_width, item_height,
+              margin_top=0, margin_right=0, margin_bottom=0, margin_left=0):
+    """Whether the usable area of each sheet fits at least one item, turned or not.
+
+    Computed exactly like products_per_sheet, so it is true wherever that
+    returns a positive count.
+    """
+    usable_width = np.maximum(sheet_width - margin_left - margin_right, 0)
+    usable_height = np.maximum(sheet_height - margin_top - margin_bottom, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        upright = (np.floor(usable_width / item_width) >= 1) & (np.floor(usable_height / item_height) >= 1)
+        turned = (np.floor(usable_width / item_height) >= 1) & (np.floor(usable_height / item_width) >= 1)
+    return (upright | turned) & (item_width > 0) & (item_height > 0)
+
+
+class FeasibilityIndex:
+    """Dominance index over sheet sizes: which sheets are at least w x h.
+
+    Sheets are sorted by width, so the ones wide enough are a suffix found
+    by binary search. Heights along that order are kept with their maximum
+    per block of FEASIBILITY_BLOCK sheets, and blocks whose tallest sheet is
+    too low are skipped without being looked at. The Pareto staircase of
+    sizes no other sheet dominates answers "is anything big enough" with a
+    single binary search.
+    """
+
+    def __init__(self, widths, heights):
+        self.row_widths = widths = np.asarray(widths, dtype=np.float64)
+        self.row_heights = heights = np.asarray(heights, dtype=np.float64)
+        self.order = np.argsort(widths, kind="stable")
+        self.widths = widths[self.order]
+        self.heights = heights[self.order]
+
+        padded = np.full(-(-len(self.heights) // FEASIBILITY_BLOCK) * FEASIBILITY_BLOCK, -np.inf)
+        padded[:len(self.heights)] = self.heights
+        self.block_max = padded.reshape(-1, FEASIBILITY_BLOCK).max(axis=1)
+
+        # Staircase: walking from the widest sheet down, keep each sheet
+        # taller than every wider one; widths ascend, heights descend
+        suffix_max = np.maximum.accumulate(self.heights[::-1])[::-1]
+        taller = np.empty(len(self.heights), dtype=bool)
+        taller[:-1] = self.heights[:-1] > suffix_max[1:]
+        taller[-1:] = True
+        self.frontier_widths = self.widths[taller]
+        self.frontier_heights = self.heights[taller]
+
+    def __len__(self):
+        return len(self.order)
+
+    def any_dominating(self, min_width, min_height):
+        """Whether some sheet is at least min_width wide and min_height high"""
+        position = np.searchsorted(self.frontier_widths, min_width, side="left")
+        return position < len(self.frontier_widths) and self.frontier_heights[position] >= min_height
+
+    def dominating(self, min_width, min_height):
+        """Rows (in input order, ascending) of the sheets at least min_width x min_height"""
+        if not self.any_dominating(min_width, min_height):
+            return np.empty(0, dtype=np.intp)
+        start = int(np.searchsorted(self.widths, min_width, side="left"))
+        (blocks,) = np.nonzero(self.block_max[start // FEASIBILITY_BLOCK:] >= min_height)
+        blocks += start // FEASIBILITY_BLOCK
+        positions = (blocks[:, None] * FEASIBILITY_BLOCK + np.arange(FEASIBILITY_BLOCK)).ravel()
+        positions = positions[(positions >= start) & (positions < len(self.heights))]
+        positions = positions[self.heights[positions] >= min_height]
+        return np.sort(self.order[positions])
+
+    def fits_any(self, item_width, item_height, margin_top=0, margin_right=0, margin_bottom=0, margin_left=0):
+        """Whether any sheet may hold one item; two binary searches on the staircase.
+
+        Sizes within rounding of the margins count as fitting, so a True can
+        still yield no products; a False is certain.
+        """
+        if item_width <= 0 or item_height <= 0:
+            return False
+        across, down, slack = _bounds(item_width, item_height, margin_top, margin_right, margin_bottom, margin_left)
+        return bool(
+            self.any_dominating(item_width + across - slack, item_height + down - slack)
+            or self.any_dominating(item_height + across - slack, item_width + down - slack)
+        )
+
+    def item_rows(self, item_width, item_height, margin_top=0, margin_right=0, margin_bottom=0, margin_left=0):
+        """Rows of the sheets whose usable area holds at least one item in either orientation"""
+        if item_width <= 0 or item_height <= 0:
+            return np.empty(0, dtype=np.intp)
+        across, down, slack = _bounds(item_width, item_height, margin_top, margin_right, margin_bottom, margin_left)
+        candidates = np.union1d(
+            self.dominating(item_width + across - slack, item_height + down - slack),
+            self.dominating(item_height + across - slack, item_width + down - slack),
+        )
+        if not len(candidates):
+            return candidates
+        # The margins are subtracted again exactly as when counting products
+        keep = holds_one(
+            self.row_widths[candidates], self.row_heights[candidates], item_width, item_height,
+            margin_top, margin_right, margin_bottom, margin_left,
+        )
+        return candidates[keep]
+
+    def part_rows(self, part):
+        """item_rows for a PartSpec"""
+        return self.item_rows(part.width, part.height, *_part_margins(part))
+
+    def part_fits_any(self, part):
+        """fits_any for a PartSpec"""
+        return self.fits_any(part.width, part.height, *_part_margins(part))
+
+
+def _part_margins(part):
+    return part.margin_top, part.margin_right, part.margin_bottom, part.margin_left
+
+
+def _bounds(item_width, item_height, margin_top, margin_right, margin_bottom, margin_left):
+    """Margins across and down, and the slack that keeps index lookups a superset.
+
+    Adding the margins to the item and subtracting them from the sheet can
+    round differently, so lookups are widened by a relative epsilon.
+    """
+    across = margin_left + margin_right
+    down = margin_top + margin_bottom
+    return across, down, 1e-9 * max(item_width, item_height, across, down, 1.0)
+
+
+def feasible_combinations(catalog, width, height, margins=(0, 0, 0, 0), limit=None):
+    """Every (machine, print sheet, paper type, stock sheet) that can produce one item.
+
+    A print sheet qualifies when its usable area holds the finished size
+    (turned or not) and a stock sheet when the print sheet fits on it, as in
+    the quote engine. Returns (total, combinations) with at most `limit`
+    combinations, ordered by machine and print sheet.
+    """
+    margin_top, margin_right, margin_bottom, margin_left = margins
+    rows = catalog.feasibility.item_rows(width, height, margin_top, margin_right, margin_bottom, margin_left)
+    pairs = catalog.pairs_of(rows)
+    total = len(pairs)
+    if limit is not None:
+        pairs = pairs[:limit]
+
+    combinations = []
+    for print_row, stock_row in zip(catalog.pair_print[pairs].tolist(), catalog.pair_stock[pairs].tolist()):
+        machine = catalog.machines[catalog.print_machine[print_row]]
+        paper_type = catalog.paper_types[catalog.stock_paper[stock_row]]
+        combinations.append({
+            "machineId": machine["id"],
+            "machineName": machine["name"],
+            "printSheetSize": catalog.print_sheets[print_row],
+            "paperTypeId": paper_type["id"],
+            "paperTypeName": paper_type["name"],
+            "gsm": paper_type["gsm"],
+            "stockSheetSize": catalog.stock_sheets[stock_row],
+        })
+    return total, combinations
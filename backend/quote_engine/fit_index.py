@@ -0,0 +1,132 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from .engine import products_per_sheet
+from .feasibility import holds_one
+from .imposition import SHEET_LAYOUT_DEPTH, guillotine_count
+
+
+def sheets_per_stock_sheet(print_sizes, stock_sizes):
+    """printSheetsPerStockSheet for every (print size, stock size) pair, 0 when it does not fit"""
+    pw = print_sizes[:, 0][:, None]
+    ph = print_sizes[:, 1][:, None]
+    sw = stock_sizes[:, 0][None, :]
+    sh = stock_sizes[:, 1][None, :]
+
+    # Print sheet size must fit within the stock sheet size
+    fits = (pw <= sw) & (ph <= sh) & (pw > 0) & (ph > 0)
+
+    # How many print sheets fit per stock sheet, mixing both orientations
+    return np.where(fits, guillotine_count(sw, sh, pw, ph, SHEET_LAYOUT_DEPTH), 0)
+
+
+class SheetFitIndex:
+    """Sheet fit results that outlive a single catalog snapshot.
+
+    Print and stock sheet sizes are interned by (width, height); the index
+    keeps printSheetsPerStockSheet for every interned pair and only computes
+    the rows and columns of sizes it has not seen before when a new catalog
+    is registered. Rows are only ever appended, so arrays built against an
+    older catalog stay valid.
+
+    Products per print sheet are memoised per product geometry (size and
+    margins) as a column over all interned print sizes, in an LRU bounded by
+    `yield_cache_size`.
+    """
+
+    def __init__(self, yield_cache_size=1024):
+        self.yield_cache_size = yield_cache_size
+        self._print_rows = {}
+        self._stock_cols = {}
+        self._print_sizes = np.empty((0, 2))
+        self._stock_sizes = np.empty((0, 2))
+        self._table = np.zeros((0, 0))
+        self._yields = OrderedDict()
+        self.yield_hits = 0
+        self.yield_misses = 0
+
+    @property
+    def shape(self):
+        return self._table.shape
+
+    def register(self, print_sizes, stock_sizes):
+        """Intern the given (width, height) sizes and return their rows and columns"""
+        new_print = _intern(self._print_rows, print_sizes)
+        new_stock = _intern(self._stock_cols, stock_sizes)
+        if new_print or new_stock:
+            self._grow(new_print, new_stock)
+        rows = np.array([self._print_rows[size] for size in print_sizes], dtype=np.intp)
+        cols = np.array([self._stock_cols[size] for size in stock_sizes], dtype=np.intp)
+        return rows, cols
+
+    def _grow(self, new_print, new_stock):
+        old_rows, old_cols = self._table.shape
+        print_sizes = np.vstack([self._print_sizes, np.array(new_print, dtype=np.float64).reshape(-1, 2)])
+        stock_sizes = np.vstack([self._stock_sizes, np.array(new_stock, dtype=np.float64).reshape(-1, 2)])
+
+        table = np.zeros((len(print_sizes), len(stock_sizes)))
+        table[:old_rows, :old_cols] = self._table
+        table[:old_rows, old_cols:] = sheets_per_stock_sheet(print_sizes[:old_rows], stock_sizes[old_cols:])
+        table[old_rows:, :] = sheets_per_stock_sheet(print_sizes[old_rows:], stock_sizes)
+
+        self._print_sizes = print_sizes
+        self._stock_sizes = stock_sizes
+        self._table = table
+
+    def sheets_per_stock_sheet(self, rows, cols):
+        """printSheetsPerStockSheet matrix for registered rows x columns"""
+        return self._table[np.ix_(rows, cols)]
+
+    def products_per_sheet(self, part):
+        """Products per print sheet of `part` for every interned print size"""
+        key = (
+            part.width, part.height, part.margin_top, part.margin_right,
+            part.margin_bottom, part.margin_left,
+        )
+        cached = self._yields.get(key)
+        row_count = len(self._print_sizes)
+        if cached is not None and len(cached) == row_count:
+            self.yield_hits += 1
+            self._yields.move_to_end(key)
+            return cached
+
+        self.yield_misses += 1
+        if cached is None:
+            cached = np.empty(0)
+        # Only print sizes interned since the entry was stored need computing,
+        # and only those that hold at least one product need a layout search
+        tail = self._print_sizes[len(cached):]
+        tail_values = np.zeros(len(tail))
+        (fitting,) = np.nonzero(holds_one(
+            tail[:, 0], tail[:, 1], part.width, part.height,
+            part.margin_top, part.margin_right, part.margin_bottom, part.margin_left,
+        ))
+        tail_values[fitting] = products_per_sheet(tail[fitting, 0], tail[fitting, 1], part)
+        values = np.concatenate([cached, tail_values])
+        values.flags.writeable = False
+
+        self._yields[key] = values
+        self._yields.move_to_end(key)
+        while len(self._yields) > self.yield_cache_size:
+            self._yields.popitem(last=False)
+        return values
+
+    def stats(self):
+        rows, cols = self._table.shape
+        return {
+            "printSizes": rows,
+            "stockSizes": cols,
+            "yieldEntries": len(self._yields),
+            "yieldHits": self.yield_hits,
+            "yieldMisses": self.yield_misses,
+        }
+
+
+def _intern(index, sizes):
+    new_sizes = []
+    for size in sizes:
+        if size not in index:
+            index[size] = len(index)
+            new_sizes.append(size)
+    return new_sizes
@@ -0,0 +1,610 @@
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from .engine import PartSpec, evaluate_part, job_parts, products_per_sheet, rank, restrict
+from .imposition import PRODUCT_LAYOUT_DEPTH, guillotine_count, guillotine_layout
+from .stages import stage
+
+# Print/stock sheet pairs of a group a plan is built for, cheapest per m² first
+GANG_PAIR_LIMIT = 4
+
+# Run lengths tried for the first job of a new run
+GANG_RUN_LENGTHS = 8
+
+# Absolute cost difference below which a move is not an improvement
+COST_EPSILON = 1e-9
+
+
+@dataclass
+class GangJob:
+    """A flat job of a planning run and its cheapest stand-alone option"""
+    index: int  # position in the request
+    job: dict
+    part: PartSpec
+    print_row: int
+    stock_row: int
+    products_per_print_sheet: int
+    print_sheets_per_stock_sheet: int
+    print_sheets: int
+    stock_sheets: int
+    paper_cost: float
+    click_cost: float
+    setup_cost: float
+    total_cost: float
+
+    @property
+    def quantity(self):
+        return self.part.units
+
+
+@dataclass(frozen=True)
+class SheetPair:
+    """A print sheet on a stock sheet that gang runs of one group are printed on"""
+    print_row: int
+    stock_row: int
+    width: float  # usable print sheet area, margins removed
+    height: float
+    margin_left: float
+    margin_top: float
+    click_cost: float  # per print sheet, both sides of a duplex job
+    print_sheets_per_stock_sheet: int
+    stock_sheet_cost: float
+    setup_cost: float
+
+
+class ShelfLayout:
+    """Items of several jobs on one print sheet, packed in shelves.
+
+    A shelf is a row as high as the items that opened it. Items go on the
+    existing shelf whose height they waste least, turned by 90 degrees if
+    that fits better, as many side by side as the shelf has room for; what
+    is left opens a new shelf above the last one. Each placement is a row
+    of items of one job: [job, x, y, item_width, item_height, columns].
+    """
+
+    __slots__ = ("width", "height", "top", "used_area", "shelves", "placements")
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.top = 0.0
+        self.used_area = 0.0
+        self.shelves = []  # [y, height, used width]
+        self.placements = []
+
+    def add(self, job, item_width, item_height, count):
+        """Place `count` items of a job; False, leaving the layout unchanged, when they do not fit"""
+        if self.used_area + count * item_width * item_height > self.width * self.height + COST_EPSILON:
+            return False
+        orientations = {(item_width, item_height), (item_height, item_width)}
+        shelves = [shelf[:] for shelf in self.shelves]
+        placements = []
+        top = self.top
+
+        while count:
+            best = None
+            for shelf in shelves:
+                for width, height in orientations:
+                    if height <= shelf[1] and shelf[2] + width <= self.width + COST_EPSILON:
+                        waste = shelf[1] - height
+                        if best is None or waste < best[0]:
+                            best = (waste, shelf, width, height)
+            if best is None:
+                fitting = [(height, width) for width, height in orientations if width <= self.width]
+                if not fitting:
+                    return False
+                height, width = min(fitting)
+                if top + height > self.height + COST_EPSILON:
+                    return False
+                shelves.append([top, height, 0.0])
+                top += height
+                continue
+
+            _, shelf, width, height = best
+            columns = min(count, math.floor((self.width - shelf[2]) / width + COST_EPSILON))
+            placements.append([job, shelf[2], shelf[0], width, height, columns])
+            shelf[2] += columns * width
+            count -= columns
+
+        self.shelves = shelves
+        self.top = top
+        self.placements.extend(placements)
+        self.used_area += sum(p[3] * p[4] * p[5] for p in placements)
+        return True
+
+
+def pack(width, height, items):
+    """ShelfLayout of (job, item_width, item_height, count) items, None when they do not fit.
+
+    Jobs are placed by decreasing short side, so shelves get lower towards
+    the top of the sheet.
+    """
+    layout = ShelfLayout(width, height)
+    for job, item_width, item_height, count in sorted(
+        items, key=lambda item: (-min(item[1], item[2]), -max(item[1], item[2]), item[0])
+    ):
+        if not layout.add(job, item_width, item_height, count):
+            return None
+    return layout
+
+
+class GangRun:
+    """Jobs printed together on one print sheet layout of a pair.
+
+    `slots` maps a job index to the items of that job per print sheet; the
+    run prints enough sheets for the job needing the most.
+    """
+
+    __slots__ = ("pair", "slots", "layout", "_cost")
+
+    def __init__(self, pair, slots, layout):
+        self.pair = pair
+        self.slots = slots
+        self.layout = layout
+        self._cost = None
+
+    def print_sheets(self, jobs):
+        return max(math.ceil(jobs[index].quantity / count) for index, count in self.slots.items())
+
+    def costs(self, jobs):
+        """(print sheets, stock sheets, paper cost, click cost, setup cost, total cost)"""
+        pair = self.pair
+        print_sheets = self.print_sheets(jobs)
+        stock_sheets = math.ceil(print_sheets / pair.print_sheets_per_stock_sheet)
+        paper_cost = stock_sheets * pair.stock_sheet_cost
+        click_cost = print_sheets * pair.click_cost
+        setup = any(jobs[index].part.setup_required for index in self.slots)
+        setup_cost = pair.setup_cost if setup else 0.0
+        return print_sheets, stock_sheets, paper_cost, click_cost, setup_cost, paper_cost + click_cost + setup_cost
+
+    def cost(self, jobs):
+        if self._cost is None:
+            self._cost = self.costs(jobs)[-1]
+        return self._cost
+
+
+def _with_run_length(pair, jobs, indexes, run_length):
+    """A run of the given jobs with enough slots each to finish in `run_length` sheets"""
+    slots = {index: math.ceil(jobs[index].quantity / run_length) for index in indexes}
+    layout = pack(pair.width, pair.height, [
+        (index, jobs[index].part.width, jobs[index].part.height, count) for index, count in slots.items()
+    ])
+    return GangRun(pair, slots, layout) if layout is not None else None
+
+
+def _run_lengths(job, yield_per_sheet):
+    """Run lengths from one slot per sheet up to the job's full sheet"""
+    per_sheet = np.unique(np.round(np.geomspace(1, yield_per_sheet, GANG_RUN_LENGTHS)).astype(int))
+    return sorted({math.ceil(job.quantity / count) for count in per_sheet.tolist()})
+
+
+def _standalone_cost(jobs, run):
+    return sum(jobs[index].total_cost for index in run.slots)
+
+
+def build_runs(pair, jobs, indexes, yields, deadline):
+    """Greedy runs on one pair; jobs that do not gain from sharing stay stand-alone.
+
+    The largest order left opens a run at each candidate run length, every
+    other job that still fits joins it with the slots it needs to finish in
+    that many sheets, and the run with the lowest cost relative to its jobs
+    printed alone is kept. Returns (runs, stand-alone job indexes).
+    """
+    remaining = sorted(indexes, key=lambda index: (-jobs[index].quantity, -jobs[index].part.area, index))
+    runs, alone = [], []
+    while remaining:
+        seed = remaining[0]
+        if time.perf_counter() > deadline:
+            alone.extend(remaining)
+            break
+
+        best, best_ratio = None, 1.0
+        for run_length in _run_lengths(jobs[seed], yields[seed]):
+            layout = ShelfLayout(pair.width, pair.height)
+            slots = {}
+            for index in remaining:
+                job = jobs[index]
+                count = math.ceil(job.quantity / run_length)
+                if count <= yields[index] and layout.add(index, job.part.width, job.part.height, count):
+                    slots[index] = count
+                elif index == seed:
+                    break
+            if seed not in slots or len(slots) < 2:
+                continue
+            run = GangRun(pair, slots, layout)
+            ratio = run.cost(jobs) / _standalone_cost(jobs, run)
+            if ratio < best_ratio - COST_EPSILON:
+                best, best_ratio = run, ratio
+
+        if best is None:
+            alone.append(seed)
+            remaining.pop(0)
+            continue
+        runs.append(best)
+        remaining = [index for index in remaining if index not in best.slots]
+    return runs, alone
+
+
+def improve_runs(pair, jobs, runs, alone, yields, deadline):
+    """Local search over the greedy runs until nothing improves or time is up.
+
+    Moves, each kept only if the total cost drops: merge two runs at either
+    run length, move one job (or a stand-alone job) into another run, take
+    a job out of its run to print alone, and shorten a run by giving one of
+    its jobs an extra slot per sheet. A run that gains a stand-alone job or
+    loses one is also tried at the run lengths of its largest order.
+    Returns whether the search finished before the deadline and the jobs
+    still printed alone.
+    """
+    alone = list(alone)
+
+    def cost(run):
+        return run.cost(jobs) if run.slots else 0.0
+
+    def shrink(run, index):
+        slots = {other: count for other, count in run.slots.items() if other != index}
+        if not slots:
+            return GangRun(pair, slots, None)
+        layout = ShelfLayout(pair.width, pair.height)
+        layout.placements = [p for p in run.layout.placements if p[0] != index]
+        return GangRun(pair, slots, layout)
+
+    def relaid(indexes, run):
+        """The cheapest of `run` and the jobs at the run lengths of their largest order"""
+        seed = max(indexes, key=lambda index: (jobs[index].quantity, jobs[index].part.area, -index))
+        best = run
+        for run_length in _run_lengths(jobs[seed], yields[seed]):
+            other = _with_run_length(pair, jobs, indexes, run_length)
+            if other is not None and (best is None or other.cost(jobs) < best.cost(jobs) - COST_EPSILON):
+                best = other
+        return best
+
+    improved = True
+    while improved:
+        improved = False
+
+        # Merge
+        for a in range(len(runs)):
+            for b in range(a + 1, len(runs)):
+                if time.perf_counter() > deadline:
+                    return False, alone
+                first, second = runs[a], runs[b]
+                if not first.slots or not second.slots:
+                    # Already merged into another run in this pass
+                    continue
+                indexes = list(first.slots) + list(second.slots)
+                for run_length in {first.print_sheets(jobs), second.print_sheets(jobs)}:
+                    merged = _with_run_length(pair, jobs, indexes, run_length)
+                    if merged is not None and merged.cost(jobs) < cost(first) + cost(second) - COST_EPSILON:
+                        runs[a], runs[b] = merged, GangRun(pair, {}, None)
+                        improved = True
+                        break
+        runs[:] = [run for run in runs if run.slots]
+
+        # Move a job into another run
+        for target in range(len(runs)):
+            for source in [None] + list(range(len(runs))):
+                if source == target:
+                    continue
+                movable = list(alone) if source is None else list(runs[source].slots)
+                for index in movable:
+                    if time.perf_counter() > deadline:
+                        return False, alone
+                    receiver = runs[target]
+                    if not receiver.slots:
+                        break
+                    if not yields[index]:
+                        # Does not fit this pair's print sheet
+                        continue
+                    indexes = list(receiver.slots) + [index]
+                    grown = _with_run_length(pair, jobs, indexes, receiver.print_sheets(jobs))
+                    if source is None:
+                        grown = relaid(indexes, grown)
+                    if grown is None:
+                        continue
+                    if source is None:
+                        before, after = jobs[index].total_cost, 0.0
+                    else:
+                        shrunk = shrink(runs[source], index)
+                        before, after = cost(runs[source]), cost(shrunk)
+                    if grown.cost(jobs) + after < receiver.cost(jobs) + before - COST_EPSILON:
+                        runs[target] = grown
+                        if source is None:
+                            alone.remove(index)
+                        else:
+                            runs[source] = shrunk
+                        improved = True
+        runs[:] = [run for run in runs if run.slots]
+
+        # Print a job alone again
+        for position, run in enumerate(runs):
+            for index in list(run.slots):
+                if time.perf_counter() > deadline:
+                    return False, alone
+                shrunk = shrink(runs[position], index)
+                if shrunk.slots:
+                    shrunk = relaid(list(shrunk.slots), shrunk)
+                if cost(shrunk) + jobs[index].total_cost < cost(runs[position]) - COST_EPSILON:
+                    runs[position] = shrunk
+                    alone.append(index)
+                    improved = True
+        runs[:] = [run for run in runs if run.slots]
+
+        # Shorter runs from spare room on the sheet
+        for position, run in enumerate(runs):
+            for index, count in run.slots.items():
+                if time.perf_counter() > deadline:
+                    return False, alone
+                run_length = math.ceil(jobs[index].quantity / (count + 1))
+                if run_length >= run.print_sheets(jobs):
+                    continue
+                shorter = _with_run_length(pair, jobs, list(run.slots), run_length)
+                if shorter is not None and shorter.cost(jobs) < run.cost(jobs) - COST_EPSILON:
+                    runs[position] = shorter
+                    improved = True
+                    break
+
+    return True, alone
+
+
+def group_pairs(catalog, paper_index, machine_index, click_multiplier, margins):
+    """The GANG_PAIR_LIMIT pairs of a group with the lowest print cost per m² of print sheet"""
+    (pairs,) = np.nonzero(
+        (catalog.print_machine[catalog.pair_print] == machine_index)
+        & (catalog.stock_paper[catalog.pair_stock] == paper_index)
+    )
+    print_rows, stock_rows = catalog.pair_print[pairs], catalog.pair_stock[pairs]
+    per_stock_sheet = catalog.pair_sheets_per_stock_sheet[pairs]
+    stock_sheet_cost = catalog.stock_area * catalog.gsm / 1000 / 1000 * catalog.price_per_ton
+
+    per_print_sheet = (
+        catalog.click_cost[print_rows] * click_multiplier + stock_sheet_cost[stock_rows] / per_stock_sheet
+    )
+    per_m2 = per_print_sheet / (catalog.print_width[print_rows] * catalog.print_height[print_rows])
+    margin_top, margin_right, margin_bottom, margin_left = margins
+
+    selected = []
+    for pair in np.argsort(per_m2, kind="stable")[:GANG_PAIR_LIMIT].tolist():
+        print_row, stock_row = int(print_rows[pair]), int(stock_rows[pair])
+        selected.append(SheetPair(
+            print_row=print_row,
+            stock_row=stock_row,
+            width=max(float(catalog.print_width[print_row]) - margin_left - margin_right, 0.0),
+            height=max(float(catalog.print_height[print_row]) - margin_top - margin_bottom, 0.0),
+            margin_left=margin_left,
+            margin_top=margin_top,
+            click_cost=float(catalog.click_cost[print_row]) * click_multiplier,
+            print_sheets_per_stock_sheet=int(per_stock_sheet[pair]),
+            stock_sheet_cost=float(stock_sheet_cost[stock_row]),
+            setup_cost=float(catalog.setup_cost[print_row]),
+        ))
+    return selected
+
+
+def standalone_jobs(catalog, jobs):
+    """Cheapest stand-alone option of every job, None where nothing is feasible.
+
+    A job's paperTypeId and machineId, when set, restrict its options.
+
+    Products per print sheet are computed here rather than through the
+    catalog's fit index memo, so a plan can be built in a worker thread.
+    """
+    yields = {}
+    standalone = []
+    for index, job in enumerate(jobs):
+        part = job_parts(job)[0]
+        if not catalog.feasibility.part_fits_any(part):
+            standalone.append(None)
+            continue
+        key = (part.width, part.height, part.margin_top, part.margin_right, part.margin_bottom, part.margin_left)
+        if key not in yields:
+            yields[key] = products_per_sheet(catalog.print_width, catalog.print_height, part)
+        table = evaluate_part(catalog, part, yields[key])
+        table = rank(restrict(catalog, table, job.get("paperTypeId"), job.get("machineId")), 1)
+        if len(table) == 0:
+            standalone.append(None)
+            continue
+        standalone.append(GangJob(
+            index=index,
+            job=job,
+            part=part,
+            print_row=int(table.print_index[0]),
+            stock_row=int(table.stock_index[0]),
+            products_per_print_sheet=int(table.products_per_print_sheet[0]),
+            print_sheets_per_stock_sheet=int(table.print_sheets_per_stock_sheet[0]),
+            print_sheets=int(table.print_sheets_needed[0]),
+            stock_sheets=int(table.stock_sheets_needed[0]),
+            paper_cost=float(table.paper_cost[0]),
+            click_cost=float(table.click_cost[0]),
+            setup_cost=float(table.setup_cost[0]),
+            total_cost=float(table.total_cost[0]),
+        ))
+    return standalone
+
+
+def plan_group(catalog, jobs, indexes, click_multiplier, deadline):
+    """Cheapest plan for the jobs of one group over its candidate pairs.
+
+    Greedy runs are built on every pair, and the local search improves the
+    cheapest of them. Returns (runs, stand-alone job indexes, finished).
+    """
+    first = jobs[indexes[0]]
+    paper_index = int(catalog.stock_paper[first.stock_row])
+    machine_index = int(catalog.print_machine[first.print_row])
+    margins = tuple(
+        max(getattr(jobs[index].part, side) for index in indexes)
+        for side in ("margin_top", "margin_right", "margin_bottom", "margin_left")
+    )
+
+    best = None
+    for pair in group_pairs(catalog, paper_index, machine_index, click_multiplier, margins):
+        yields = {
+            index: int(guillotine_count(
+                pair.width, pair.height, jobs[index].part.width, jobs[index].part.height, PRODUCT_LAYOUT_DEPTH
+            ))
+            for index in indexes
+        }
+        fitting = [index for index in indexes if yields[index] > 0]
+        runs, alone = build_runs(pair, jobs, fitting, yields, deadline)
+        alone += [index for index in indexes if yields[index] == 0]
+        total = sum(run.cost(jobs) for run in runs) + sum(jobs[index].total_cost for index in alone)
+        if best is None or total < best[0] - COST_EPSILON:
+            best = (total, pair, runs, alone, yields)
+        if time.perf_counter() > deadline:
+            break
+
+    if best is None:
+        return [], list(indexes), True
+    _, pair, runs, alone, yields = best
+    finished, alone = improve_runs(pair, jobs, runs, alone, yields, deadline)
+    return runs, alone, finished
+
+
+def plan_gang_runs(catalog, jobs, time_budget=2.0):
+    """Gang flat jobs of the same paper type, machine and sidedness onto shared print sheets.
+
+    Every job is first priced on its own; its cheapest option (on the job's
+    paperTypeId and/or machineId when given) decides its group. Within a
+    group, jobs share print sheet layouts (runs) packed in shelves, each job
+    with enough items per sheet to reach its quantity in the run's number of
+    sheets, so one setup and one stock sheet order cover several jobs. The
+    plan minimises total cost (paper, clicks and setup, as priced by the
+    quote engine) and is never worse than printing every job alone. Search
+    time is shared out over the groups by job count; past `time_budget`
+    seconds the best plan found so far is returned.
+    """
+    started = time.perf_counter()
+    deadline = started + time_budget
+    with stage("gang_standalone"):
+        standalone = standalone_jobs(catalog, jobs)
+
+    groups = {}
+    for job in standalone:
+        if job is not None:
+            key = (
+                int(catalog.stock_paper[job.stock_row]),
+                int(catalog.print_machine[job.print_row]),
+                job.part.click_multiplier,
+            )
+            groups.setdefault(key, []).append(job.index)
+    jobs_by_index = {job.index: job for job in standalone if job is not None}
+
+    runs, alone = [], []
+    timed_out = False
+    planned = 0
+    with stage("gang_packing"):
+        for (_, _, click_multiplier), indexes in sorted(groups.items(), key=lambda item: -len(item[1])):
+            now = time.perf_counter()
+            share = (deadline - now) * len(indexes) / max(len(jobs_by_index) - planned, 1)
+            group_runs, group_alone, finished = plan_group(
+                catalog, jobs_by_index, indexes, click_multiplier, now + max(share, 0.0)
+            )
+            timed_out |= not finished
+            planned += len(indexes)
+            runs.extend(group_runs)
+            alone.extend(group_alone)
+
+    runs = [gang_run_dict(catalog, jobs_by_index, run) for run in runs] + [
+        standalone_run_dict(catalog, jobs_by_index[index]) for index in sorted(alone)
+    ]
+    total_cost = sum(run["totalCost"] for run in runs)
+    standalone_cost = sum(job.total_cost for job in jobs_by_index.values())
+    return {
+        "runs": runs,
+        "unplanned": [index for index, job in enumerate(standalone) if job is None],
+        "totalCost": total_cost,
+        "standaloneCost": standalone_cost,
+        "savings": standalone_cost - total_cost,
+        "stockSheetsNeeded": sum(run["stockSheetsNeeded"] for run in runs),
+        "standaloneStockSheets": sum(job.stock_sheets for job in jobs_by_index.values()),
+        "timedOut": timed_out,
+    }
+
+
+def _run_dict(catalog, print_row, stock_row, click_multiplier, costs, print_sheets_per_stock_sheet,
+              run_jobs, placements, used_area):
+    print_sheets, stock_sheets, paper_cost, click_cost, setup_cost, total_cost = costs
+    sheet_area = float(catalog.print_width[print_row] * catalog.print_height[print_row])
+    return {
+        "machine": catalog.machines[catalog.print_machine[print_row]],
+        "printSheetSize": catalog.print_sheets[print_row],
+        "paperType": catalog.paper_types[catalog.stock_paper[stock_row]],
+        "stockSheetSize": catalog.stock_sheets[stock_row],
+        "clickMultiplier": click_multiplier,
+        "printSheets": print_sheets,
+        "printSheetsPerStockSheet": print_sheets_per_stock_sheet,
+        "stockSheetsNeeded": stock_sheets,
+        "paperCost": paper_cost,
+        "clickCost": click_cost,
+        "setupCost": setup_cost,
+        "totalCost": total_cost,
+        "utilization": used_area / sheet_area if sheet_area > 0 else 0.0,
+        "jobs": run_jobs,
+        "placements": placements,
+    }
+
+
+def _run_job(job, slots, print_sheets):
+    return {
+        "job": job.index,
+        "productName": job.job.get("productName"),
+        "quantity": job.quantity,
+        "slots": slots,
+        "produced": slots * print_sheets,
+        "standaloneCost": job.total_cost,
+    }
+
+
+def gang_run_dict(catalog, jobs, run):
+    costs = run.costs(jobs)
+    pair = run.pair
+    placements = [
+        {
+            "job": index,
+            "x": pair.margin_left + x,
+            "y": pair.margin_top + y,
+            "width": columns * width,
+            "height": height,
+            "columns": columns,
+            "rows": 1,
+            "rotated": (width, height) != (jobs[index].part.width, jobs[index].part.height),
+        }
+        for index, x, y, width, height, columns in run.layout.placements
+    ]
+    return _run_dict(
+        catalog, pair.print_row, pair.stock_row, jobs[next(iter(run.slots))].part.click_multiplier, costs,
+        pair.print_sheets_per_stock_sheet,
+        [_run_job(jobs[index], count, costs[0]) for index, count in sorted(run.slots.items())],
+        placements,
+        sum(jobs[index].part.width * jobs[index].part.height * count for index, count in run.slots.items()),
+    )
+
+
+def standalone_run_dict(catalog, job):
+    """A job printed alone on its cheapest option, laid out like /api/imposition"""
+    part = job.part
+    width = float(catalog.print_width[job.print_row]) - part.margin_left - part.margin_right
+    height = float(catalog.print_height[job.print_row]) - part.margin_top - part.margin_bottom
+    _, blocks = guillotine_layout(width, height, part.width, part.height, PRODUCT_LAYOUT_DEPTH)
+    placements = [
+        {
+            "job": job.index,
+            "x": part.margin_left + x,
+            "y": part.margin_top + y,
+            "width": columns * (part.height if rotated else part.width),
+            "height": rows * (part.width if rotated else part.height),
+            "columns": columns,
+            "rows": rows,
+            "rotated": rotated,
+        }
+        for x, y, columns, rows, rotated in blocks
+    ]
+    costs = (job.print_sheets, job.stock_sheets, job.paper_cost, job.click_cost, job.setup_cost, job.total_cost)
+    return _run_dict(
+        catalog, job.print_row, job.stock_row, part.click_multiplier, costs, job.print_sheets_per_stock_sheet,
+        [_run_job(job, job.products_per_print_sheet, job.print_sheets)], placements,
+        part.width * part.height * job.products_per_print_sheet,
+    )
@@ -0,0 +1,133 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+# Recursion depth of the block layouts. Three levels found the optimal
+# guillotine layout for every product/sheet combination we compared against
+# an exhaustive search; print sheets on stock sheets are few per sheet, so
+# two levels already find the mixed layouts there and keep the catalog wide
+# table cheap to build.
+PRODUCT_LAYOUT_DEPTH = 3
+SHEET_LAYOUT_DEPTH = 2
+
+
+def guillotine_count(width, height, item_width, item_height, depth=PRODUCT_LAYOUT_DEPTH):
+    """Items per sheet of the best block layout, vectorised over broadcast arrays.
+
+    A layout of depth 1 is a uniform grid in whichever orientation holds
+    more. A layout of depth d cuts the sheet straight across (guillotine
+    cut) after k full columns or rows of items in one orientation and fills
+    the remaining strip with a layout of depth d - 1, so rotated and
+    unrotated blocks can share a sheet. Every k and both cut directions and
+    orientations are tried.
+    """
+    arrays = np.broadcast_arrays(*(
+        np.asarray(value, dtype=np.float64) for value in (width, height, item_width, item_height)
+    ))
+    shape = arrays[0].shape
+    width, height, item_width, item_height = (array.ravel() for array in arrays)
+
+    valid = (width > 0) & (height > 0) & (item_width > 0) & (item_height > 0)
+    counts = np.zeros(len(width))
+    (rows,) = np.nonzero(valid)
+    counts[rows] = _block_count(width[rows], height[rows], item_width[rows], item_height[rows], depth)
+    return counts.reshape(shape)
+
+
+# Upper bound on sheets x cut positions evaluated at once
+LAYOUT_CHUNK_CELLS = 2000000
+
+
+def _grid(width, height, item_width, item_height):
+    return np.floor(width / item_width) * np.floor(height / item_height)
+
+
+def _block_count(width, height, a, b, depth):
+    best = np.maximum(_grid(width, height, a, b), _grid(width, height, b, a))
+    if depth <= 1 or not len(width):
+        return best
+
+    # Square items gain nothing from rotation, and no layout holds more than
+    # the sheet area allows; only the other sheets are searched
+    area_bound = np.floor(width * height / (a * b))
+    (search,) = np.nonzero((a != b) & (best < area_bound))
+    if not len(search):
+        return best
+    width, height, a, b = width[search], height[search], a[search], b[search]
+    found = best[search]
+
+    for x, y in ((a, b), (b, a)):
+        # Cut after k columns of x-wide items, or after k rows of y-high items
+        for most, per_line, strip in (
+            (np.floor(width / x), np.floor(height / y), lambda k, rows: (width[rows] - k * x[rows], height[rows])),
+            (np.floor(height / y), np.floor(width / x), lambda k, rows: (width[rows], height[rows] - k * y[rows])),
+        ):
+            most = np.where(per_line > 0, most, 0)
+            if depth == 2:
+                found = np.maximum(found, _two_block(most, per_line, strip, a, b))
+                continue
+            for k in range(1, int(most.max(initial=0)) + 1):
+                (rows,) = np.nonzero(most >= k)
+                rest = _block_count(*strip(k, rows), a[rows], b[rows], depth - 1)
+                found[rows] = np.maximum(found[rows], k * per_line[rows] + rest)
+
+    best[search] = found
+    return best
+
+
+def _two_block(most, per_line, strip, a, b):
+    """Best block + uniform strip layout for one cut direction, all k at once"""
+    best = np.zeros(len(most))
+    largest = int(most.max(initial=0))
+    step = max(1, LAYOUT_CHUNK_CELLS // len(most))
+    rows = np.arange(len(most))[:, None]
+    for start in range(1, largest + 1, step):
+        k = np.arange(start, min(start + step, largest + 1), dtype=np.float64)[None, :]
+        width, height = strip(k, rows)
+        rest = np.maximum(
+            _grid(width, height, a[:, None], b[:, None]), _grid(width, height, b[:, None], a[:, None])
+        )
+        totals = np.where(k <= most[:, None], k * per_line[:, None] + rest, 0)
+        best = np.maximum(best, totals.max(axis=1))
+    return best
+
+
+@lru_cache(maxsize=4096)
+def guillotine_layout(width, height, item_width, item_height, depth=PRODUCT_LAYOUT_DEPTH):
+    """The layout behind guillotine_count for one sheet, memoised per size key.
+
+    Returns (count, blocks); each block is (x, y, columns, rows, rotated)
+    relative to the sheet corner, a rotated block holding items turned by
+    90 degrees (item_height wide).
+    """
+    if min(width, height, item_width, item_height) <= 0:
+        return 0, ()
+
+    def grid(rotated):
+        x, y = (item_height, item_width) if rotated else (item_width, item_height)
+        columns, rows = math.floor(width / x), math.floor(height / y)
+        return columns * rows, ((0.0, 0.0, columns, rows, rotated),) if columns * rows else ()
+
+    best = max(grid(False), grid(True), key=lambda layout: layout[0])
+    if depth <= 1:
+        return best
+
+    for rotated in (False, True):
+        x, y = (item_height, item_width) if rotated else (item_width, item_height)
+        per_column, per_row = math.floor(height / y), math.floor(width / x)
+        for k in range(1, per_row + 1 if per_column else 1):
+            rest, blocks = guillotine_layout(width - k * x, height, item_width, item_height, depth - 1)
+            if k * per_column + rest > best[0]:
+                best = (k * per_column + rest, ((0.0, 0.0, k, per_column, rotated),) + tuple(
+                    (bx + k * x, by, columns, rows, block_rotated)
+                    for bx, by, columns, rows, block_rotated in blocks
+                ))
+        for k in range(1, per_column + 1 if per_row else 1):
+            rest, blocks = guillotine_layout(width, height - k * y, item_width, item_height, depth - 1)
+            if k * per_row + rest > best[0]:
+                best = (k * per_row + rest, ((0.0, 0.0, per_row, k, rotated),) + tuple(
+                    (bx, by + k * y, columns, rows, block_rotated)
+                    for bx, by, columns, rows, block_rotated in blocks
+                ))
+    return best
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+from .catalog import CatalogArrays
+from .engine import quote_batch
+from .fit_index import SheetFitIndex
+
+ALIGNMENT = 64
+
+
+class CatalogHandle(NamedTuple):
+    """What a worker needs to attach to a shared catalog; pickled with every task"""
+    key: str
+    name: str
+    layout: Tuple[Tuple[str, str, Tuple[int, ...], int], ...]
+    items_offset: int
+    items_size: int
+
+
+class SharedCatalog:
+    """The columns and item dicts of a catalog in one shared memory block.
+
+    The block holds every CatalogArrays column at an aligned offset followed
+    by the paper types and machines as JSON. Tasks only carry the small
+    CatalogHandle; each worker attaches once per catalog and keeps read-only
+    views over the block, so the catalog is never pickled per task.
+    """
+
+    def __init__(self, catalog, key):
+        columns = {name: np.ascontiguousarray(getattr(catalog, name)) for name in CatalogArrays.COLUMNS}
+        items = json.dumps(
+            {"paperTypes": catalog.paper_types, "machines": catalog.machines},
+            separators=(",", ":"),
+        ).encode()
+
+        layout = []
+        offset = 0
+        for name, values in columns.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            layout.append((name, values.dtype.str, values.shape, offset))
+            offset += values.nbytes
+
+        self.shm = SharedMemory(create=True, size=offset + len(items))
+        for (name, dtype, shape, start), values in zip(layout, columns.values()):
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=start)[...] = values
+        self.shm.buf[offset:offset + len(items)] = items
+
+        self.handle = CatalogHandle(key, self.shm.name, tuple(layout), offset, len(items))
+
+    @property
+    def size(self):
+        return self.shm.size
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+# Worker process state: the attached catalog and a fit index that outlives it
+_attached = None
+_fit_index = None
+
+
+def attach(handle):
+    """The catalog behind `handle`, attaching to its block on first use"""
+    global _attached, _fit_index
+    if _attached is not None and _attached[0] == handle.key:
+        return _attached[2]
+    if _fit_index is None:
+        _fit_index = SheetFitIndex()
+
+    shm = SharedMemory(name=handle.name)
+    columns = {}
+    for name, dtype, shape, offset in handle.layout:
+        values = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        values.flags.writeable = False
+        columns[name] = values
+    items = json.loads(bytes(shm.buf[handle.items_offset:handle.items_offset + handle.items_size]))
+    catalog = CatalogArrays.from_columns(items["paperTypes"], items["machines"], columns, _fit_index)
+
+    previous, _attached = _attached, (handle.key, shm, catalog)
+    if previous is not None:
+        previous_shm = previous[1]
+        del previous
+        try:
+            previous_shm.close()
+        except BufferError:
+            # A view is still referenced; the mapping goes with the last one
+            pass
+    return catalog
+
+
+def quote_chunk(handle, jobs, limit, selection):
+    return quote_batch(attach(handle), jobs, limit, selection)
+
+
+class QuotePool:
+    """Prices large batches in worker processes, off the event loop.
+
+    Batches of at least `min_jobs` jobs are split into chunks of `chunk_size`
+    and priced by a ProcessPoolExecutor of `workers` processes against a
+    SharedCatalog of the snapshot; smaller batches, or every batch when
+    `workers` is 0, are priced inline. The block of a catalog is released
+    once it is no longer the latest one and no batch is using it.
+    """
+
+    def __init__(self, workers=None, chunk_size=256, min_jobs=512):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.chunk_size = max(1, chunk_size)
+        self.min_jobs = min_jobs
+        self._executor = None
+        self._shared = {}
+        self._latest = None
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Spawned rather than forked: the server process runs an event
+            # loop and the MongoDB client's threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def quote_batch(self, catalog, key, jobs, limit=1, selection="ranked"):
+        """Same results as quote_engine.quote_batch; `key` identifies the catalog (its digest)"""
+        if not self.enabled or len(jobs) < self.min_jobs:
+            return quote_batch(catalog, jobs, limit, selection)
+
+        shared = self._acquire(catalog, key)
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            chunks = await asyncio.gather(*(
+                loop.run_in_executor(
+                    executor, quote_chunk, shared.handle,
+                    jobs[start:start + self.chunk_size], limit, selection,
+                )
+                for start in range(0, len(jobs), self.chunk_size)
+            ))
+        finally:
+            self._release(key)
+        return [quote for chunk in chunks for quote in chunk]
+
+    def _acquire(self, catalog, key):
+        entry = self._shared.get(key)
+        if entry is None:
+            entry = self._shared[key] = [SharedCatalog(catalog, key), 0]
+        entry[1] += 1
+        self._latest = key
+        for stale in [k for k, (_, users) in self._shared.items() if k != key and not users]:
+            self._shared.pop(stale)[0].close()
+        return entry[0]
+
+    def _release(self, key):
+        entry = self._shared[key]
+        entry[1] -= 1
+        if not entry[1] and key != self._latest:
+            self._shared.pop(key)[0].close()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "chunkSize": self.chunk_size,
+            "minJobs": self.min_jobs,
+            "started": self._executor is not None,
+            "sharedCatalogs": len(self._shared),
+            "sharedBytes": sum(shared.size for shared, _ in self._shared.values()),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        for shared, _ in self._shared.values():
+            shared.close()
+        self._shared.clear()
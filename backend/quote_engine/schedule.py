@@ -0,0 +1,197 @@
+import heapq
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from .engine import evaluate_part, job_parts
+from .stages import stage
+
+# Machines without a capacity model: one shift on weekdays
+DEFAULT_CALENDAR = {"days": [0, 1, 2, 3, 4], "startHour": 8.0, "endHour": 17.0}
+DEFAULT_SHEETS_PER_HOUR = 2000.0
+DEFAULT_SETUP_MINUTES = 15.0
+
+
+class WorkingCalendar:
+    """The hours a machine runs: the same window on each working weekday.
+
+    `days` are weekdays (0 = Monday); the window runs from start_hour to
+    end_hour, 0 to 24 being round the clock. Work that does not finish in
+    one window carries over to the next.
+    """
+
+    def __init__(self, days, start_hour, end_hour):
+        if not days or not 0 <= start_hour < end_hour <= 24:
+            raise ValueError("A working calendar needs at least one day and startHour < endHour <= 24")
+        self.days = frozenset(days)
+        self.start = timedelta(hours=start_hour)
+        self.end = timedelta(hours=end_hour)
+
+    @classmethod
+    def from_dict(cls, calendar):
+        calendar = calendar or DEFAULT_CALENDAR
+        return cls(calendar["days"], calendar["startHour"], calendar["endHour"])
+
+    def next_working(self, moment):
+        """The first working instant at or after `moment`"""
+        day = datetime(moment.year, moment.month, moment.day)
+        for _ in range(8):
+            if day.weekday() in self.days:
+                if moment < day + self.start:
+                    return day + self.start
+                if moment < day + self.end:
+                    return moment
+            day += timedelta(days=1)
+        raise ValueError("Calendar has no working time")
+
+    def book(self, moment, hours):
+        """(start, end) of `hours` of work begun at the first working instant from `moment`"""
+        start = current = self.next_working(moment)
+        remaining = timedelta(hours=hours)
+        while True:
+            window_end = datetime(current.year, current.month, current.day) + self.end
+            if remaining <= window_end - current:
+                return start, current + remaining
+            remaining -= window_end - current
+            current = self.next_working(window_end)
+
+
+def machine_options(catalog, job):
+    """Cheapest way to print a job on each machine that can print all its parts.
+
+    Returns {machine index: (total cost, [(print sheets, click multiplier) per part])}.
+    """
+    options = None
+    for part in job_parts(job):
+        table = evaluate_part(catalog, part)
+        if len(table) == 0:
+            return {}
+        machine = catalog.print_machine[table.print_index]
+        # Cheapest row per machine, lowest waste among equal costs
+        order = np.lexsort((table.waste_percentage, table.total_cost, machine))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = machine[order][1:] != machine[order][:-1]
+        rows = order[first]
+
+        part_options = {
+            int(machine[row]): (float(table.total_cost[row]), (int(table.print_sheets_needed[row]), part.click_multiplier))
+            for row in rows.tolist()
+        }
+        if options is None:
+            options = {index: (cost, [run]) for index, (cost, run) in part_options.items()}
+        else:
+            options = {
+                index: (cost + part_options[index][0], runs + [part_options[index][1]])
+                for index, (cost, runs) in options.items()
+                if index in part_options
+            }
+    return options or {}
+
+
+def run_hours(machine, runs):
+    """Machine time of a job: a setup per part plus every sheet pass (duplex sheets pass twice)"""
+    sheets_per_hour = machine.get("sheetsPerHour") or DEFAULT_SHEETS_PER_HOUR
+    setup_minutes = machine.get("setupMinutes", DEFAULT_SETUP_MINUTES)
+    return sum(setup_minutes / 60 + sheets * passes / sheets_per_hour for sheets, passes in runs)
+
+
+def naive_utc(moment):
+    """Timezone-aware datetimes as the naive UTC the rest of the backend stores"""
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def _hours(delta):
+    return delta.total_seconds() / 3600
+
+
+def schedule_jobs(catalog, jobs, start, hour_cost=50.0, due_dates=None):
+    """Assign jobs to machines with a priority-queue list scheduler.
+
+    Jobs leave a heap by earliest due date, then longest machine time. Each
+    goes to the machine minimising its print cost plus `hour_cost` for every
+    hour it pushes out the makespan and every hour it would finish late,
+    booked in that machine's working calendar after the work already queued
+    there. So the cheapest press takes work until queueing on it costs more
+    than printing elsewhere.
+    """
+    due_dates = due_dates or [None] * len(jobs)
+    calendars = [WorkingCalendar.from_dict(machine.get("workingCalendar")) for machine in catalog.machines]
+    available = [start] * len(catalog.machines)
+
+    with stage("schedule_options"):
+        options = [machine_options(catalog, job) for job in jobs]
+
+    queue = []
+    for index, job_options in enumerate(options):
+        if job_options:
+            work = min(run_hours(catalog.machines[machine], runs) for machine, (_, runs) in job_options.items())
+            heapq.heappush(queue, (due_dates[index] or datetime.max, -work, index))
+
+    makespan_end = start
+    assignments = [None] * len(jobs)
+    with stage("schedule_dispatch"):
+        while queue:
+            _, _, index = heapq.heappop(queue)
+            best = None
+            for machine, (cost, runs) in sorted(options[index].items()):
+                hours = run_hours(catalog.machines[machine], runs)
+                job_start, job_end = calendars[machine].book(available[machine], hours)
+                delay = max(_hours(job_end - makespan_end), 0.0)
+                lateness = max(_hours(job_end - due_dates[index]), 0.0) if due_dates[index] else 0.0
+                score = cost + hour_cost * (delay + lateness)
+                if best is None or (score, job_end) < (best[0], best[3]):
+                    best = (score, machine, job_start, job_end, cost, hours, runs, lateness)
+
+            _, machine, job_start, job_end, cost, hours, runs, lateness = best
+            available[machine] = job_end
+            makespan_end = max(makespan_end, job_end)
+            assignments[index] = {
+                "job": index,
+                "productName": jobs[index].get("productName"),
+                "machineId": catalog.machines[machine]["id"],
+                "start": job_start,
+                "end": job_end,
+                "hours": hours,
+                "printSheets": sum(sheets for sheets, _ in runs),
+                "cost": cost,
+                "dueDate": due_dates[index],
+                "onTime": lateness == 0.0,
+                "latenessHours": lateness,
+            }
+    return summarize(catalog, options, assignments, start, makespan_end)
+
+
+def summarize(catalog, options, assignments, start, makespan_end):
+    makespan = _hours(makespan_end - start)
+    timelines = {}
+    for assignment in assignments:
+        if assignment is not None:
+            timelines.setdefault(assignment["machineId"], []).append(assignment)
+
+    machines = []
+    for machine in catalog.machines:
+        timeline = sorted(timelines.get(machine["id"], []), key=lambda item: item["start"])
+        busy = sum(item["hours"] for item in timeline)
+        machines.append({
+            "machineId": machine["id"],
+            "machineName": machine["name"],
+            "busyHours": busy,
+            "utilization": busy / makespan if makespan > 0 else 0.0,
+            "timeline": timeline,
+        })
+
+    scheduled = [assignment for assignment in assignments if assignment is not None]
+    return {
+        "start": start,
+        "end": makespan_end,
+        "makespanHours": makespan,
+        "totalCost": sum(item["cost"] for item in scheduled),
+        # What the same jobs cost if every one got its cheapest machine regardless of load
+        "unconstrainedCost": sum(min(cost for cost, _ in job_options.values()) for job_options in options if job_options),
+        "lateJobs": sum(not item["onTime"] for item in scheduled),
+        "jobs": scheduled,
+        "unscheduled": [index for index, assignment in enumerate(assignments) if assignment is None],
+        "machines": machines,
+    }
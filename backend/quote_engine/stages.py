@@ -0,0 +1,32 @@
+import time
+
+_observer = None
+
+
+def set_stage_observer(observer):
+    """Report the duration of every engine stage to `observer(stage, seconds)`.
+
+    None (the default) turns timing off. The observer is per process, so
+    stages run by QuotePool workers are not reported, and it may be called
+    from worker threads.
+    """
+    global _observer
+    _observer = observer
+
+
+class stage:
+    """Context manager timing one engine stage when an observer is set"""
+
+    __slots__ = ("name", "observer", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.observer = _observer
+        if self.observer is not None:
+            self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.observer is not None:
+            self.observer(self.name, time.perf_counter() - self.started)
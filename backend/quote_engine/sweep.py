@@ -0,0 +1,127 @@
+import numpy as np
+
+from .engine import (
+    CandidateTable,
+    candidates_to_dicts,
+    cost_columns,
+    job_parts,
+    print_sheet_yield,
+    usable_pairs,
+    waste_percentage,
+)
+from .stages import stage
+
+# Upper bound on quantities x pairs evaluated at once
+SWEEP_CHUNK_CELLS = 2000000
+
+
+def stock_front(catalog, print_index, stock_index, per_stock_sheet):
+    """Pairs that can be the cheapest stock sheet of their print sheet at some quantity.
+
+    For a given print sheet only the paper cost depends on the stock sheet:
+    ceil(printSheets / printSheetsPerStockSheet) x cost of one stock sheet.
+    A stock sheet that costs no less and holds no more print sheets than
+    another one is never cheaper, whatever the quantity, so per print sheet
+    only the front of (more print sheets per stock sheet, cheaper stock
+    sheet) is kept. Returns a boolean mask over the pairs.
+    """
+    sheet_cost = catalog.stock_area * catalog.gsm / 1000 / 1000 * catalog.price_per_ton
+    # One integer sort key (print sheet, most print sheets per stock sheet
+    # first, cheapest stock sheet first) sorts much faster than a lexsort
+    cost_rank = np.empty(len(sheet_cost), dtype=np.int64)
+    cost_rank[np.argsort(sheet_cost, kind="stable")] = np.arange(len(sheet_cost))
+    per_stock_sheet = per_stock_sheet.astype(np.int64)
+    most = int(per_stock_sheet.max())
+    key = print_index.astype(np.int64) * (most + 1) + (most - per_stock_sheet)
+    order = np.argsort(key * len(sheet_cost) + cost_rank[stock_index])
+    sheet_cost = sheet_cost[stock_index]
+
+    # Running minimum of the sheet cost within each print sheet: shifting
+    # every later print sheet down by more than the cost range keeps the
+    # minimum from leaking across print sheets
+    shift = 2 * (sheet_cost.max() + 1)
+    shifted = sheet_cost[order] - print_index[order] * shift
+    previous_min = np.minimum.accumulate(shifted)
+    on_front = np.empty(len(order), dtype=bool)
+    on_front[0] = True
+    on_front[1:] = shifted[1:] < previous_min[:-1]
+
+    keep = np.zeros(len(order), dtype=bool)
+    keep[order[on_front]] = True
+    return keep
+
+
+def sweep_part(catalog, part, quantities):
+    """Cheapest candidate of one part at each ordered quantity.
+
+    `part` is the part of a single unit (quantity 1); its units scale
+    linearly with the quantity. The fit results (products per print sheet,
+    usable pairs, waste) are computed once, pairs that cannot win at any
+    quantity are dropped, and only the ceil() of sheets needed and the costs
+    are evaluated per quantity, as one array per chunk of quantities.
+    """
+    with stage("fit"):
+        per_print_sheet = print_sheet_yield(catalog, part)
+    with stage("candidates"):
+        print_index, stock_index, per_stock_sheet = usable_pairs(catalog, per_print_sheet)
+        if len(print_index) == 0:
+            return [None] * len(quantities)
+        keep = stock_front(catalog, print_index, stock_index, per_stock_sheet)
+        print_index, stock_index, per_stock_sheet = print_index[keep], stock_index[keep], per_stock_sheet[keep]
+
+    products_per_print_sheet = per_print_sheet[print_index]
+    waste = waste_percentage(catalog, part, stock_index, products_per_print_sheet, per_stock_sheet)
+
+    quantities = np.asarray(quantities, dtype=np.float64)
+    chunk = max(1, SWEEP_CHUNK_CELLS // len(print_index))
+    best = []
+    for start in range(0, len(quantities), chunk):
+        chunk_quantities = quantities[start:start + chunk, None]
+        with stage("costing"):
+            columns = cost_columns(
+                catalog, part, per_print_sheet, print_index, stock_index, per_stock_sheet,
+                chunk_quantities * part.units, chunk_quantities,
+            )
+        with stage("ranking"):
+            total = columns["total_cost"]
+            # Cheapest pair per quantity, lowest waste among equal costs
+            cheapest = total.min(axis=1, keepdims=True)
+            winners = np.argmin(np.where(total == cheapest, waste, np.inf), axis=1)
+
+        for row, winner in enumerate(winners.tolist()):
+            selected = np.array([winner])
+            table = CandidateTable(
+                part=part,
+                print_index=print_index[selected],
+                stock_index=stock_index[selected],
+                products_per_print_sheet=products_per_print_sheet[selected],
+                print_sheets_per_stock_sheet=per_stock_sheet[selected],
+                waste_percentage=waste[selected],
+                **{name: values[row, selected] for name, values in columns.items()},
+            )
+            best.append(candidates_to_dicts(catalog, table)[0])
+    return best
+
+
+def quantity_sweep(catalog, job, quantities):
+    """Optimal option and cost per unit of a job at every quantity break"""
+    unit_parts = job_parts({**job, "quantity": 1})
+    per_part = [(part.name, sweep_part(catalog, part, quantities)) for part in unit_parts]
+
+    breaks = []
+    for index, quantity in enumerate(quantities):
+        parts = [
+            {"part": name, "candidate": candidates[index]}
+            for name, candidates in per_part
+            if candidates[index] is not None
+        ]
+        feasible = len(parts) == len(per_part)
+        total_cost = sum(part["candidate"]["totalCost"] for part in parts) if feasible else None
+        breaks.append({
+            "quantity": quantity,
+            "feasible": feasible,
+            "totalCost": total_cost,
+            "costPerUnit": total_cost / quantity if feasible else None,
+            "parts": parts,
+        })
+    return breaks
@@ -0,0 +1,275 @@
+import uuid
+from datetime import datetime
+
+import numpy as np
+from pymongo import ASCENDING, DESCENDING
+
+from quote_engine import candidates_to_dicts, evaluate_part, job_parts, rank, restrict
+
+# Cost breakdown fields copied from the chosen candidate
+BREAKDOWN_FIELDS = (
+    "productsPerPrintSheet", "printSheetsNeeded", "printSheetsPerStockSheet", "stockSheetsNeeded",
+    "paperWeight", "paperCost", "clickCost", "setupCost", "totalCost", "costPerUnit",
+    "wastePercentage", "clickMultiplier",
+)
+
+
+def allowed_change(gap, usage):
+    """Largest parameter change that keeps the chosen row cheapest, None when unbounded.
+
+    `gap` is how much more each competing row costs and `usage` how much
+    faster the chosen row's cost grows with the parameter than that row's.
+    """
+    gap = gap[usage > 0]
+    if not len(gap):
+        return None
+    return float((gap / usage[usage > 0]).min())
+
+
+def part_sensitivity(catalog, table, chosen):
+    """How far the prices the `chosen` candidate (a one row table) depends on can move before it stops being cheapest.
+
+    Costs are linear in pricePerTon, clickCost and setupCost, so the range
+    follows from the cost gap to every other row of the table and the rate
+    at which each cost moves:
+
+    * pricePerTon of the chosen paper moves its candidates by their paper
+      weight, so lighter candidates on that paper and every other paper cap
+      an increase, heavier ones on that paper cap a decrease;
+    * clickCost of the chosen print sheet and setupCost of the chosen machine
+      move every candidate sharing them equally, so only candidates on other
+      print sheets / machines cap an increase and a decrease never changes
+      the choice.
+    """
+    gap = table.total_cost - chosen.total_cost[0]
+    weight = table.paper_weight / 1000  # t
+    chosen_weight = chosen.paper_weight[0] / 1000
+    same_paper = catalog.stock_paper[table.stock_index] == catalog.stock_paper[chosen.stock_index[0]]
+    other_machine = (
+        catalog.print_machine[table.print_index] != catalog.print_machine[chosen.print_index[0]]
+    )
+
+    increase_usage = np.where(same_paper, chosen_weight - weight, chosen_weight)
+    decrease_usage = np.where(same_paper, weight - chosen_weight, 0)
+    click_usage = np.where(
+        table.print_index != chosen.print_index[0],
+        chosen.print_sheets_needed[0] * table.part.click_multiplier, 0,
+    )
+    setup_usage = np.where(other_machine, 1.0 if table.part.setup_required else 0.0, 0)
+    return {
+        "pricePerTonUp": allowed_change(gap, increase_usage),
+        "pricePerTonDown": allowed_change(gap, decrease_usage),
+        "clickCostUp": allowed_change(gap, click_usage),
+        "setupCostUp": allowed_change(gap, setup_usage),
+    }
+
+
+def choose_candidates(catalog, job, selections=None):
+    """Best candidate per part of a job, optionally pinned to a machine/sheet/paper.
+
+    `selections` maps a part name to any of machineId, printSheetSizeId,
+    paperTypeId and stockSheetSizeId. Sheet size ids are only unique within
+    their machine or paper type. Returns (part name, candidate, sensitivity)
+    triples; candidate and sensitivity are None when nothing fits.
+    """
+    selections = selections or {}
+    chosen = []
+    for part in job_parts(job):
+        selection = selections.get(part.name) or {}
+        table = restrict(
+            catalog, evaluate_part(catalog, part),
+            selection.get("paperTypeId"), selection.get("machineId"),
+        )
+        for key, sheets, index in (
+            ("printSheetSizeId", catalog.print_sheets, "print_index"),
+            ("stockSheetSizeId", catalog.stock_sheets, "stock_index"),
+        ):
+            if selection.get(key) is not None and len(table):
+                sheet_ids = np.array([sheet["id"] for sheet in sheets])
+                table = table.take(np.nonzero(sheet_ids[getattr(table, index)] == selection[key])[0])
+        best = rank(table, 1)
+        if len(best):
+            chosen.append((
+                part.name, candidates_to_dicts(catalog, best)[0], part_sensitivity(catalog, table, best),
+            ))
+        else:
+            chosen.append((part.name, None, None))
+    return chosen
+
+
+def quote_record(job, chosen, snapshot, selections=None):
+    """The quotes collection document for a priced job.
+
+    Catalog entities are referenced by id, with the names at the time of
+    the quote; machineIds/paperTypeIds repeat the ids of every part for the
+    multikey indexes.
+    """
+    return {
+        "id": str(uuid.uuid4()),
+        "timestamp": utc_now(),
+        "job": job,
+        "selections": selections or {},
+        **priced_fields(job, chosen, snapshot),
+    }
+
+
+def priced_fields(job, chosen, snapshot):
+    """The fields of a quote record that depend on the chosen candidates"""
+    parts = []
+    for name, candidate, sensitivity in chosen:
+        part = {
+            "part": name,
+            "machineId": candidate["machine"]["id"],
+            "machineName": candidate["machine"]["name"],
+            "printSheetSizeId": candidate["printSheetSize"]["id"],
+            "printSheetSizeName": candidate["printSheetSize"]["name"],
+            "paperTypeId": candidate["paperType"]["id"],
+            "paperTypeName": candidate["paperType"]["name"],
+            "stockSheetSizeId": candidate["stockSheetSize"]["id"],
+            "stockSheetSizeName": candidate["stockSheetSize"]["name"],
+        }
+        part.update((field, candidate[field]) for field in BREAKDOWN_FIELDS)
+        part["sensitivity"] = sensitivity
+        parts.append(part)
+
+    return {**totals(job, parts), "catalogVersion": snapshot.version, "catalogDigest": snapshot.digest}
+
+
+def totals(job, parts):
+    total_cost = sum(part["totalCost"] for part in parts)
+    return {
+        "parts": parts,
+        "machineIds": sorted({part["machineId"] for part in parts}),
+        "paperTypeIds": sorted({part["paperTypeId"] for part in parts}),
+        "quantity": job["quantity"],
+        "totalCost": total_cost,
+        "costPerUnit": total_cost / job["quantity"],
+    }
+
+
+def utc_now():
+    # BSON dates have millisecond precision; keep returned records equal to stored ones
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def time_range(start=None, end=None):
+    query = {}
+    if start is not None:
+        query["$gte"] = start
+    if end is not None:
+        query["$lt"] = end
+    return query
+
+
+class QuoteHistory:
+    """Saved quotes in the quotes collection.
+
+    Listings are newest first with a (timestamp, id) keyset cursor, so a page
+    is one index range scan whatever its depth. Statistics are computed by
+    aggregation pipelines inside MongoDB.
+    """
+
+    def __init__(self, db, collection="quotes"):
+        self.db = db
+        self.collection = collection
+
+    @property
+    def quotes(self):
+        return self.db[self.collection]
+
+    async def ensure_indexes(self):
+        await self.quotes.create_index("id", unique=True)
+        await self.quotes.create_index([("timestamp", DESCENDING), ("id", DESCENDING)])
+        await self.quotes.create_index([("machineIds", ASCENDING), ("timestamp", DESCENDING)])
+        await self.quotes.create_index([("paperTypeIds", ASCENDING), ("timestamp", DESCENDING)])
+        # Reverse index from a print sheet size to the quotes printed on it
+        await self.quotes.create_index([("parts.machineId", ASCENDING), ("parts.printSheetSizeId", ASCENDING)])
+
+    async def save(self, record):
+        await self.quotes.insert_one(dict(record))
+        return record
+
+    async def get(self, quote_id):
+        return await self.quotes.find_one({"id": quote_id}, {"_id": 0})
+
+    async def get_many(self, quote_ids):
+        """Saved quotes by id, as {id: quote}; unknown ids are left out"""
+        cursor = self.quotes.find({"id": {"$in": list(quote_ids)}}, {"_id": 0})
+        return {quote["id"]: quote async for quote in cursor}
+
+    async def delete(self, quote_id):
+        result = await self.quotes.delete_one({"id": quote_id})
+        return result.deleted_count > 0
+
+    async def search(self, machine_id=None, paper_type_id=None, start=None, end=None,
+                     before=None, limit=50):
+        """One page of quotes, newest first.
+
+        `before` is the (timestamp, id) of the last quote of the previous
+        page. Returns the quotes and the cursor of the next page, or None
+        at the end.
+        """
+        query = {}
+        if machine_id is not None:
+            query["machineIds"] = machine_id
+        if paper_type_id is not None:
+            query["paperTypeIds"] = paper_type_id
+        if start is not None or end is not None:
+            query["timestamp"] = time_range(start, end)
+        if before is not None:
+            timestamp, quote_id = before
+            query = {"$and": [query, {"$or": [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "id": {"$lt": quote_id}},
+            ]}]}
+
+        cursor = self.quotes.find(query, {"_id": 0}).sort(
+            [("timestamp", DESCENDING), ("id", DESCENDING)]
+        ).limit(limit + 1)
+        quotes = await cursor.to_list(limit + 1)
+        next_cursor = None
+        if len(quotes) > limit:
+            quotes = quotes[:limit]
+            next_cursor = (quotes[-1]["timestamp"], quotes[-1]["id"])
+        return quotes, next_cursor
+
+    async def volume_by_machine(self, start=None, end=None):
+        """Per machine: quotes, units, print sheets and cost of the parts it prints"""
+        return await self._aggregate(start, end, "machineId", {
+            "units": {"$first": "$quantity"},
+            "printSheets": {"$sum": "$parts.printSheetsNeeded"},
+            "totalCost": {"$sum": "$parts.totalCost"},
+        }, {
+            "quotes": {"$sum": 1},
+            "units": {"$sum": "$units"},
+            "printSheets": {"$sum": "$printSheets"},
+            "totalCost": {"$sum": "$totalCost"},
+        })
+
+    async def cost_by_paper(self, start=None, end=None):
+        """Per paper type: average cost per unit of the parts printed on it, stock sheets and paper cost"""
+        return await self._aggregate(start, end, "paperTypeId", {
+            "costPerUnit": {"$sum": "$parts.costPerUnit"},
+            "stockSheets": {"$sum": "$parts.stockSheetsNeeded"},
+            "paperCost": {"$sum": "$parts.paperCost"},
+        }, {
+            "quotes": {"$sum": 1},
+            "averageCostPerUnit": {"$avg": "$costPerUnit"},
+            "stockSheets": {"$sum": "$stockSheets"},
+            "paperCost": {"$sum": "$paperCost"},
+        })
+
+    async def _aggregate(self, start, end, key, per_quote, per_key):
+        """Group the parts by `key` once per quote, then across quotes"""
+        pipeline = []
+        if start is not None or end is not None:
+            pipeline.append({"$match": {"timestamp": time_range(start, end)}})
+        pipeline += [
+            {"$unwind": "$parts"},
+            {"$group": {"_id": {"quote": "$id", key: f"$parts.{key}"}, **per_quote}},
+            {"$group": {"_id": f"$_id.{key}", **per_key}},
+            {"$project": {"_id": 0, key: "$_id", **{field: 1 for field in per_key}}},
+            {"$sort": {key: 1}},
+        ]
+        return await self.quotes.aggregate(pipeline).to_list(None)
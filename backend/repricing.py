@@ -0,0 +1,217 @@
+import asyncio
+import math
+
+from pymongo import UpdateOne
+
+from quote_engine import CatalogArrays, SheetFitIndex, job_parts
+from quote_history import choose_candidates, priced_fields, totals, utc_now
+
+BATCH_SIZE = 200
+
+
+def price_changes(target, old, new):
+    """What changed between two versions of a paper type or machine.
+
+    Price fields give {"field", "old", "new"} (clickCost also "sheetId");
+    anything that changes which sheets fit or how much paper is used
+    (gsm, sheet sizes, duplex support, removed or unknown items) is a
+    "structure" change, for which saved quotes always need a full search.
+    """
+    if old is None or new is None:
+        return [{"field": "structure"}]
+    changes = []
+    if target == "paperType":
+        if old["pricePerTon"] != new["pricePerTon"]:
+            changes.append({"field": "pricePerTon", "old": old["pricePerTon"], "new": new["pricePerTon"]})
+        if old["gsm"] != new["gsm"] or _sheets(old["stockSheetSizes"]) != _sheets(new["stockSheetSizes"]):
+            changes.append({"field": "structure"})
+    else:
+        if old["setupCost"] != new["setupCost"]:
+            changes.append({"field": "setupCost", "old": old["setupCost"], "new": new["setupCost"]})
+        new_sheets = {sheet["id"]: sheet for sheet in new["printSheetSizes"]}
+        for sheet in old["printSheetSizes"]:
+            changed = new_sheets.get(sheet["id"])
+            if changed is not None and changed["clickCost"] != sheet["clickCost"]:
+                changes.append({
+                    "field": "clickCost", "sheetId": sheet["id"],
+                    "old": sheet["clickCost"], "new": changed["clickCost"],
+                })
+        if _sheets(old["printSheetSizes"], "duplexSupport") != _sheets(new["printSheetSizes"], "duplexSupport"):
+            changes.append({"field": "structure"})
+    return changes
+
+
+def _sheets(sheets, *extra):
+    return {sheet["id"]: (sheet["width"], sheet["height"], *(sheet[key] for key in extra)) for sheet in sheets}
+
+
+def affected_query(target, entity_id, changes):
+    """Saved quotes that use the changed entity, through the multikey indexes"""
+    if target == "paperType":
+        return {"paperTypeIds": entity_id}
+    if all(change["field"] == "clickCost" for change in changes):
+        return {"parts": {"$elemMatch": {
+            "machineId": entity_id,
+            "printSheetSizeId": {"$in": [change["sheetId"] for change in changes]},
+        }}}
+    return {"machineIds": entity_id}
+
+
+def _same_price(stored, expected):
+    return math.isclose(stored, expected, rel_tol=1e-9, abs_tol=1e-12)
+
+
+def reprice_part(part, target, entity_id, changes, setup_required, quantity):
+    """Apply a price change to a saved part without searching.
+
+    Returns the part (unchanged when it does not use the changed price), or
+    None when the change may alter which option is cheapest (a price drop
+    elsewhere included), is not a pure price change, or the stored costs
+    were not priced at the old price; the quote then needs a full search.
+    """
+    if (part["paperTypeId"] if target == "paperType" else part["machineId"]) != entity_id:
+        # The changed entity's options got cheaper or different and may now beat this part's
+        if any(change["field"] == "structure" or change["new"] < change["old"] for change in changes):
+            return None
+        return part
+    relevant = [
+        change for change in changes
+        if change["field"] != "clickCost" or change["sheetId"] == part["printSheetSizeId"]
+    ]
+    if not relevant:
+        return part
+    # Cheaper print sheets of the machine the part is not on make its competitors cheaper
+    if any(change["new"] < change["old"] for change in changes if change not in relevant):
+        return None
+    if len(relevant) > 1 or relevant[0]["field"] == "structure" or not part.get("sensitivity"):
+        return None
+
+    change = relevant[0]
+    field, delta = change["field"], change["new"] - change["old"]
+    sensitivity = dict(part["sensitivity"])
+    repriced = dict(part)
+    if field == "pricePerTon":
+        tons = part["paperWeight"] / 1000
+        if not _same_price(part["paperCost"], tons * change["old"]):
+            return None
+        allowed = sensitivity["pricePerTonUp"] if delta > 0 else sensitivity["pricePerTonDown"]
+        if allowed is not None and abs(delta) > allowed:
+            return None
+        repriced["paperCost"] = tons * change["new"]
+        sensitivity["pricePerTonUp"] = _shift(sensitivity["pricePerTonUp"], -delta)
+        sensitivity["pricePerTonDown"] = _shift(sensitivity["pricePerTonDown"], delta)
+        stale = ("clickCostUp", "setupCostUp")
+    elif field == "clickCost":
+        clicks = part["printSheetsNeeded"] * part["clickMultiplier"]
+        if not _same_price(part["clickCost"], clicks * change["old"]):
+            return None
+        if delta > 0 and sensitivity["clickCostUp"] is not None and delta > sensitivity["clickCostUp"]:
+            return None
+        repriced["clickCost"] = clicks * change["new"]
+        sensitivity["clickCostUp"] = _shift(sensitivity["clickCostUp"], -delta)
+        stale = ("pricePerTonUp", "pricePerTonDown", "setupCostUp")
+    else:
+        if not setup_required:
+            return part
+        if not _same_price(part["setupCost"], change["old"]):
+            return None
+        if delta > 0 and sensitivity["setupCostUp"] is not None and delta > sensitivity["setupCostUp"]:
+            return None
+        repriced["setupCost"] = change["new"]
+        sensitivity["setupCostUp"] = _shift(sensitivity["setupCostUp"], -delta)
+        stale = ("pricePerTonUp", "pricePerTonDown", "clickCostUp")
+
+    # The cost gaps behind the other ranges moved by different amounts per
+    # competitor; zero them so the next change of those prices searches
+    for key in stale:
+        sensitivity[key] = 0.0
+    repriced["sensitivity"] = sensitivity
+    repriced["totalCost"] = repriced["paperCost"] + repriced["clickCost"] + repriced["setupCost"]
+    repriced["costPerUnit"] = repriced["totalCost"] / quantity
+    return repriced
+
+
+def _shift(allowed, amount):
+    return None if allowed is None else max(0.0, allowed + amount)
+
+
+def _options(parts):
+    return [
+        (part["part"], part["machineId"], part["printSheetSizeId"], part["paperTypeId"], part["stockSheetSizeId"])
+        for part in parts
+    ]
+
+
+async def run_reprice(context, catalog_cache, quote_history):
+    """Job handler: bring the saved quotes that use a changed paper type or machine up to date.
+
+    Parts whose price change stays within their stored sensitivity range
+    get the linear delta applied in place; every other affected quote is
+    searched again (with its saved selections) against the current catalog.
+    Quotes with no feasible option any more are left as they are.
+    """
+    target, entity_id, changes = (context.params[key] for key in ("target", "id", "changes"))
+    snapshot = catalog_cache.snapshot
+    # Ids first: a searched quote may move within the index being scanned
+    quote_ids = [
+        quote["id"]
+        async for quote in quote_history.quotes.find(affected_query(target, entity_id, changes), {"id": 1})
+    ]
+    await context.progress(0, len(quote_ids), force=True)
+
+    search_catalog = None
+    summary = {"catalogVersion": snapshot.version, "affected": len(quote_ids),
+               "delta": 0, "search": 0, "unavailable": 0, "optionsChanged": 0}
+    for start in range(0, len(quote_ids), BATCH_SIZE):
+        quotes = await quote_history.quotes.find(
+            {"id": {"$in": quote_ids[start:start + BATCH_SIZE]}}, {"_id": 0}
+        ).to_list(None)
+
+        updates, rows, searches = [], [], []
+        for quote in quotes:
+            setup_required = {part.name: part.setup_required for part in job_parts(quote["job"])}
+            parts = [
+                reprice_part(part, target, entity_id, changes, setup_required.get(part["part"]), quote["quantity"])
+                for part in quote["parts"]
+            ]
+            if any(part is None for part in parts):
+                searches.append(quote)
+                continue
+            fields = {**totals(quote["job"], parts), "catalogVersion": snapshot.version,
+                      "catalogDigest": snapshot.digest, "repricedAt": utc_now()}
+            updates.append(UpdateOne({"id": quote["id"]}, {"$set": fields}))
+            rows.append(_row(quote, "delta", fields))
+
+        if searches:
+            if search_catalog is None:
+                # Private fit index: the search runs in a worker thread
+                search_catalog = CatalogArrays(snapshot.paper_types, snapshot.machines, SheetFitIndex())
+            chosen = await asyncio.to_thread(lambda: [
+                choose_candidates(search_catalog, quote["job"], quote.get("selections")) for quote in searches
+            ])
+            for quote, candidates in zip(searches, chosen):
+                if any(candidate is None for _, candidate, _ in candidates):
+                    rows.append(_row(quote, "unavailable"))
+                    continue
+                fields = {**priced_fields(quote["job"], candidates, snapshot), "repricedAt": utc_now()}
+                updates.append(UpdateOne({"id": quote["id"]}, {"$set": fields}))
+                rows.append(_row(quote, "search", fields))
+
+        if updates:
+            await quote_history.quotes.bulk_write(updates, ordered=False)
+        for row in rows:
+            summary[row["method"]] += 1
+            summary["optionsChanged"] += row["optionChanged"]
+        await context.write_results(rows)
+        await context.progress(start + len(quotes))
+    return summary
+
+
+def _row(quote, method, fields=None):
+    return {
+        "quoteId": quote["id"],
+        "method": method,
+        "optionChanged": fields is not None and _options(fields["parts"]) != _options(quote["parts"]),
+        "previousTotalCost": quote["totalCost"],
+        "totalCost": fields["totalCost"] if fields is not None else None,
+    }
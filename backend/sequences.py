@@ -0,0 +1,43 @@
+from pymongo import ReturnDocument
+
+
+class SequenceAllocator:
+    """Integer id sequences kept in a counters collection.
+
+    Each sequence is one document {_id: name, seq: last allocated id}. Ids are
+    handed out with a single atomic find_one_and_update/$inc, so concurrent
+    creates never see the same value, and a block of ids for a bulk import
+    costs one round trip.
+    """
+
+    def __init__(self, db, collection="counters"):
+        self.db = db
+        self.collection = collection
+
+    @property
+    def counters(self):
+        return self.db[self.collection]
+
+    async def reserve(self, name, count):
+        """Reserve `count` consecutive ids and return them as a range"""
+        if count <= 0:
+            return range(0)
+        counter = await self.counters.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        last = counter["seq"]
+        return range(last - count + 1, last + 1)
+
+    async def next_id(self, name):
+        return (await self.reserve(name, 1))[0]
+
+    async def sync(self, name, collection):
+        """Move the sequence past the highest id already stored in `collection`"""
+        highest = await collection.find({}, {"id": 1}).sort([("id", -1)]).limit(1).to_list(1)
+        if highest:
+            await self.counters.update_one(
+                {"_id": name}, {"$max": {"seq": highest[0]["id"]}}, upsert=True
+            )
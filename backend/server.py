@@ -1,36 +1,80 @@
-from fastapi import FastAPI, APIRouter, HTTPException, HTTPException
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, conint, model_validator
+from typing import Dict, List, Literal, Optional, Union
 import uuid
+import bisect
+import math
+import time
 from datetime import datetime
+from functools import partial
+
+from catalog_cache import CatalogCache, catalog_page, encode_items, ndjson_lines
+from compression import CompressionMiddleware, choose_encoding, etag_matches, weak_etag
+from catalog_io import (
+    MACHINE_CSV, PAPER_TYPE_CSV, bulk_upsert, csv_to_items, ensure_name_index, export_lines, validate_items,
+)
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from sequences import SequenceAllocator
+from status_log import StatusLog
+from jobs import FINISHED, JobQueue
+from metrics import MetricsMiddleware, MongoCommandListener, MongoPoolListener, TimedRoute, observe_stage, registry
+from quote_history import QuoteHistory, choose_candidates, quote_record, utc_now
+from repricing import price_changes, run_reprice
+from what_if import price_change_errors, run_what_if
+from quote_engine import (
+    QuoteCache, QuotePool, feasible_combinations, guillotine_layout, normalize_parts, optimize_booklet,
+    naive_utc, plan_gang_runs, quantity_sweep, quote_job, schedule_jobs, set_stage_observer,
+)
+from quote_engine.imposition import PRODUCT_LAYOUT_DEPTH, SHEET_LAYOUT_DEPTH
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection; pool sizing, timeouts and read preference come from .env
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+mongo_pool = MongoPoolListener()
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', 10)),
+    maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000)),
+    waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    socketTimeoutMS=int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 60000)) or None,
+    readPreference=os.environ.get('MONGO_READ_PREFERENCE', 'primary'),
+    event_listeners=[MongoCommandListener(), mongo_pool],
+)
 db = client[os.environ['DB_NAME']]
+# Connections opened at startup, and the time a readiness ping may take
+MONGO_WARM_CONNECTIONS = int(os.environ.get('MONGO_WARM_CONNECTIONS', os.environ.get('MONGO_MIN_POOL_SIZE', 10)))
+MONGO_READY_TIMEOUT = float(os.environ.get('MONGO_READY_TIMEOUT', 2))
 
-# Create the main app without a prefix
-app = FastAPI()
+# Create the main app without a prefix; responses are rendered with orjson
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TimedRoute)
+
+# Quote engine stage timings go to the /api/metrics histograms
+set_stage_observer(observe_stage)
 
 
 # Define Models
 class StatusCheck(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     client_name: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=utc_now)
 
 class StatusCheckCreate(BaseModel):
     client_name: str
@@ -49,6 +93,8 @@ class PaperType(BaseModel):
     gsm: int
     pricePerTon: float
     stockSheetSizes: List[StockSheetSize]
+    # Bumped by every write; the ETag used for If-Match
+    version: int = 0
 
 class PaperTypeCreate(BaseModel):
     name: str
@@ -62,6 +108,11 @@ class PaperTypeUpdate(BaseModel):
     pricePerTon: Optional[float] = None
     stockSheetSizes: Optional[List[StockSheetSize]] = None
 
+# PATCH body: sheet sizes to append, or ids of sheet sizes to remove
+class StockSheetSizesPatch(BaseModel):
+    add: List[StockSheetSize] = []
+    remove: List[int] = []
+
 # Machine Models
 class PrintSheetSize(BaseModel):
     id: int
@@ -72,21 +123,680 @@ class PrintSheetSize(BaseModel):
     duplexSupport: bool
     unit: str = "mm"
 
+# Hours a machine runs on each working weekday (0 = Monday); 0-24 is round the clock
+class WorkingCalendar(BaseModel):
+    days: List[conint(ge=0, le=6)] = Field(default_factory=lambda: [0, 1, 2, 3, 4], min_length=1)
+    startHour: float = Field(8, ge=0, le=24)
+    endHour: float = Field(17, ge=0, le=24)
+
+    @model_validator(mode="after")
+    def check_hours(self):
+        if self.startHour >= self.endHour:
+            raise ValueError("startHour must be before endHour")
+        return self
+
 class Machine(BaseModel):
     id: int
     name: str
     setupCost: float
     printSheetSizes: List[PrintSheetSize]
+    # Capacity model used by /api/schedule
+    sheetsPerHour: float = Field(2000, gt=0)
+    setupMinutes: float = Field(15, ge=0)
+    workingCalendar: WorkingCalendar = Field(default_factory=WorkingCalendar)
+    version: int = 0
 
 class MachineCreate(BaseModel):
     name: str
     setupCost: float
     printSheetSizes: List[PrintSheetSize]
+    sheetsPerHour: float = Field(2000, gt=0)
+    setupMinutes: float = Field(15, ge=0)
+    workingCalendar: WorkingCalendar = Field(default_factory=WorkingCalendar)
 
 class MachineUpdate(BaseModel):
     name: Optional[str] = None
     setupCost: Optional[float] = None
     printSheetSizes: Optional[List[PrintSheetSize]] = None
+    sheetsPerHour: Optional[float] = Field(None, gt=0)
+    setupMinutes: Optional[float] = Field(None, ge=0)
+    workingCalendar: Optional[WorkingCalendar] = None
+
+class PrintSheetSizesPatch(BaseModel):
+    add: List[PrintSheetSize] = []
+    remove: List[int] = []
+
+# Quote Models
+class PrintJob(BaseModel):
+    productName: Optional[str] = None
+    finalWidth: float = Field(..., gt=0)
+    finalHeight: float = Field(..., gt=0)
+    marginTop: float = Field(3, ge=0)
+    marginRight: float = Field(3, ge=0)
+    marginBottom: float = Field(3, ge=0)
+    marginLeft: float = Field(3, ge=0)
+    quantity: int = Field(..., gt=0)
+    isDoubleSided: bool = False
+    setupRequired: bool = False
+    isBookletMode: bool = False
+    coverSetupRequired: bool = False
+    totalPages: int = 0
+    bindingEdge: str = "short"
+
+class QuoteCandidate(BaseModel):
+    machine: Machine
+    printSheetSize: PrintSheetSize
+    paperType: PaperType
+    stockSheetSize: StockSheetSize
+    productsPerPrintSheet: int
+    printSheetsNeeded: int
+    printSheetsPerStockSheet: int
+    stockSheetsNeeded: int
+    paperWeight: float
+    paperCost: float
+    clickCost: float
+    setupCost: float
+    totalCost: float
+    costPerUnit: float
+    wastePercentage: float
+    clickMultiplier: int
+
+class QuotePart(BaseModel):
+    part: str
+    totalCandidates: int
+    candidates: List[QuoteCandidate]
+
+class QuoteResponse(BaseModel):
+    parts: List[QuotePart]
+    catalogVersion: int
+    cacheHit: bool = False
+    elapsedMs: float
+
+# ?shape=normalized: candidates reference the catalog by id and every
+# machine / paper type used is listed once
+class NormalizedCandidate(BaseModel):
+    machineId: int
+    printSheetSizeId: int
+    paperTypeId: int
+    stockSheetSizeId: int
+    productsPerPrintSheet: int
+    printSheetsNeeded: int
+    printSheetsPerStockSheet: int
+    stockSheetsNeeded: int
+    paperWeight: float
+    paperCost: float
+    clickCost: float
+    setupCost: float
+    totalCost: float
+    costPerUnit: float
+    wastePercentage: float
+    clickMultiplier: int
+
+class NormalizedQuotePart(BaseModel):
+    part: str
+    totalCandidates: int
+    candidates: List[NormalizedCandidate]
+
+class NormalizedQuoteResponse(BaseModel):
+    parts: List[NormalizedQuotePart]
+    machines: List[Machine]
+    paperTypes: List[PaperType]
+    catalogVersion: int
+    cacheHit: bool = False
+    elapsedMs: float
+
+class BatchQuoteResult(BaseModel):
+    index: int
+    parts: List[QuotePart]
+
+class NormalizedBatchQuoteResult(BaseModel):
+    index: int
+    parts: List[NormalizedQuotePart]
+
+class BatchQuoteResponse(BaseModel):
+    results: List[BatchQuoteResult]
+    jobCount: int
+    catalogVersion: int
+    elapsedMs: float
+
+class NormalizedBatchQuoteResponse(BaseModel):
+    results: List[NormalizedBatchQuoteResult]
+    machines: List[Machine]
+    paperTypes: List[PaperType]
+    jobCount: int
+    catalogVersion: int
+    elapsedMs: float
+
+class BookletPartConfig(BaseModel):
+    pageCount: int
+    paperTypeId: Optional[int] = None
+    machineId: Optional[int] = None
+
+class BookletQuoteRequest(BaseModel):
+    job: PrintJob
+    coverPaperTypeId: Optional[int] = None
+    coverMachineId: Optional[int] = None
+    innerParts: List[BookletPartConfig] = []
+
+class BookletPartResult(BaseModel):
+    part: str
+    pageCount: int
+    candidate: QuoteCandidate
+
+class BookletQuoteResponse(BaseModel):
+    parts: List[BookletPartResult]
+    totalCost: float
+    setupCost: float
+    machinesUsed: List[int]
+    optimal: bool
+    nodesExplored: int
+    catalogVersion: int
+    cacheHit: bool = False
+    elapsedMs: float
+
+class QuantitySweepRequest(BaseModel):
+    job: PrintJob
+    quantities: List[int] = []
+    start: Optional[int] = None
+    stop: Optional[int] = None
+    step: Optional[int] = None
+
+class SweepPartResult(BaseModel):
+    part: str
+    candidate: QuoteCandidate
+
+class QuantityBreak(BaseModel):
+    quantity: int
+    feasible: bool
+    totalCost: Optional[float] = None
+    costPerUnit: Optional[float] = None
+    parts: List[SweepPartResult]
+
+class QuantitySweepResponse(BaseModel):
+    breaks: List[QuantityBreak]
+    catalogVersion: int
+    elapsedMs: float
+
+class ImpositionRequest(BaseModel):
+    sheetWidth: float
+    sheetHeight: float
+    itemWidth: float
+    itemHeight: float
+    marginTop: float = 0
+    marginRight: float = 0
+    marginBottom: float = 0
+    marginLeft: float = 0
+    # "product" lays out products on a print sheet, "printSheet" print sheets on a stock sheet
+    item: Literal["product", "printSheet"] = "product"
+
+class ImpositionBlock(BaseModel):
+    x: float
+    y: float
+    width: float
+    height: float
+    columns: int
+    rows: int
+    rotated: bool
+
+class ImpositionResponse(BaseModel):
+    count: int
+    gridCount: int
+    blocks: List[ImpositionBlock]
+    utilization: float
+
+class GangPlanJob(PrintJob):
+    # Optional pins; otherwise the job's cheapest paper type and machine decide its group
+    paperTypeId: Optional[int] = None
+    machineId: Optional[int] = None
+
+class GangPlanRequest(BaseModel):
+    jobs: List[GangPlanJob]
+    timeBudgetMs: int = 2000
+
+class GangPlacement(ImpositionBlock):
+    job: int
+
+class GangRunJob(BaseModel):
+    job: int
+    productName: Optional[str] = None
+    quantity: int
+    slots: int
+    produced: int
+    standaloneCost: float
+
+class GangRun(BaseModel):
+    machine: Machine
+    printSheetSize: PrintSheetSize
+    paperType: PaperType
+    stockSheetSize: StockSheetSize
+    clickMultiplier: int
+    printSheets: int
+    printSheetsPerStockSheet: int
+    stockSheetsNeeded: int
+    paperCost: float
+    clickCost: float
+    setupCost: float
+    totalCost: float
+    utilization: float
+    jobs: List[GangRunJob]
+    placements: List[GangPlacement]
+
+class GangPlanResponse(BaseModel):
+    runs: List[GangRun]
+    unplanned: List[int]
+    totalCost: float
+    standaloneCost: float
+    savings: float
+    stockSheetsNeeded: int
+    standaloneStockSheets: int
+    timedOut: bool
+    catalogVersion: int
+    elapsedMs: float
+
+class FeasibleCombination(BaseModel):
+    machineId: int
+    machineName: str
+    printSheetSize: PrintSheetSize
+    paperTypeId: int
+    paperTypeName: str
+    gsm: float
+    stockSheetSize: StockSheetSize
+
+class FeasibilityResponse(BaseModel):
+    feasible: bool
+    total: int
+    combinations: List[FeasibleCombination]
+    catalogVersion: int
+    elapsedMs: float
+
+class ScheduleJob(BaseModel):
+    # A job, or the id of a saved quote whose job is scheduled
+    job: Optional[PrintJob] = None
+    quoteId: Optional[str] = None
+    dueDate: Optional[datetime] = None
+
+class ScheduleRequest(BaseModel):
+    jobs: List[ScheduleJob]
+    start: Optional[datetime] = None
+    # Value of one hour of makespan or lateness, in the currency of the costs
+    hourCost: float = Field(50, ge=0)
+
+class ScheduledJob(BaseModel):
+    job: int
+    productName: Optional[str] = None
+    machineId: int
+    start: datetime
+    end: datetime
+    hours: float
+    printSheets: int
+    cost: float
+    dueDate: Optional[datetime] = None
+    onTime: bool
+    latenessHours: float
+
+class MachineTimeline(BaseModel):
+    machineId: int
+    machineName: str
+    busyHours: float
+    utilization: float
+    timeline: List[ScheduledJob]
+
+class ScheduleResponse(BaseModel):
+    start: datetime
+    end: datetime
+    makespanHours: float
+    totalCost: float
+    unconstrainedCost: float
+    lateJobs: int
+    jobs: List[ScheduledJob]
+    unscheduled: List[int]
+    machines: List[MachineTimeline]
+    catalogVersion: int
+    elapsedMs: float
+
+class PriceChange(BaseModel):
+    target: Literal["paperType", "machine"]
+    id: int
+    field: Literal["pricePerTon", "setupCost", "clickCost"]
+    factor: Optional[float] = None  # e.g. 1.08 for +8%
+    value: Optional[float] = None
+    sheetId: Optional[int] = None  # clickCost of one print sheet size only
+
+class WhatIfRequest(BaseModel):
+    changes: List[PriceChange]
+    jobs: List[PrintJob]
+
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: str
+    progress: float
+    processed: int
+    total: int
+    summary: Optional[dict] = None
+    error: Optional[str] = None
+    createdAt: datetime
+    startedAt: Optional[datetime] = None
+    finishedAt: Optional[datetime] = None
+
+class JobResultsPage(BaseModel):
+    jobId: str
+    status: str
+    rows: List[dict]
+    nextCursor: Optional[int] = None
+
+class QuoteSelection(BaseModel):
+    machineId: Optional[int] = None
+    printSheetSizeId: Optional[int] = None
+    paperTypeId: Optional[int] = None
+    stockSheetSizeId: Optional[int] = None
+
+class SaveQuoteRequest(BaseModel):
+    job: PrintJob
+    # Pin a part ("product", "cover", "innerPages") to a machine/sheet/paper
+    selections: Dict[str, QuoteSelection] = {}
+
+class SavedQuotePart(BaseModel):
+    part: str
+    machineId: int
+    machineName: str
+    printSheetSizeId: int
+    printSheetSizeName: str
+    paperTypeId: int
+    paperTypeName: str
+    stockSheetSizeId: int
+    stockSheetSizeName: str
+    productsPerPrintSheet: int
+    printSheetsNeeded: int
+    printSheetsPerStockSheet: int
+    stockSheetsNeeded: int
+    paperWeight: float
+    paperCost: float
+    clickCost: float
+    setupCost: float
+    totalCost: float
+    costPerUnit: float
+    wastePercentage: float
+    clickMultiplier: int
+    # Allowed price moves before the option may stop being cheapest (None = unbounded)
+    sensitivity: Optional[Dict[str, Optional[float]]] = None
+
+class SavedQuote(BaseModel):
+    id: str
+    timestamp: datetime
+    job: PrintJob
+    selections: Dict[str, QuoteSelection] = {}
+    parts: List[SavedQuotePart]
+    machineIds: List[int]
+    paperTypeIds: List[int]
+    quantity: int
+    totalCost: float
+    costPerUnit: float
+    catalogVersion: int
+    catalogDigest: str
+    repricedAt: Optional[datetime] = None
+
+class SavedQuotePage(BaseModel):
+    quotes: List[SavedQuote]
+    nextCursor: Optional[str] = None
+
+class MachineVolume(BaseModel):
+    machineId: int
+    machineName: Optional[str] = None
+    quotes: int
+    units: int
+    printSheets: int
+    totalCost: float
+
+class PaperCostStats(BaseModel):
+    paperTypeId: int
+    paperTypeName: Optional[str] = None
+    quotes: int
+    averageCostPerUnit: float
+    stockSheets: int
+    paperCost: float
+
+class BulkImportResult(BaseModel):
+    inserted: int
+    updated: int
+    ids: List[int]
+
+# Atomic id allocation for paper types and machines (counters collection)
+sequences = SequenceAllocator(db)
+
+# Response compression, for CompressionMiddleware and the precompressed catalog listings
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+
+# In-memory catalog snapshot, kept in sync by the write endpoints and by a
+# change stream (or polling) for writes made by other replicas
+catalog_cache = CatalogCache(
+    db, PaperType, Machine,
+    poll_interval=float(os.environ.get('CATALOG_POLL_INTERVAL', 30)),
+    debounce=float(os.environ.get('CATALOG_DEBOUNCE', 0.2)),
+    gzip_level=GZIP_LEVEL,
+    brotli_quality=BROTLI_QUALITY,
+)
+
+def catalog_response(request: Request, snapshot, body: bytes, next_cursor: Optional[int] = None,
+                     body_name: Optional[str] = None, etag: Optional[str] = None):
+    """Listing response with the snapshot ETag, or `etag` for a page.
+
+    Full listings (`body_name` given) are served from the snapshot's
+    compressed copies when the client accepts gzip or brotli; pages are left
+    to CompressionMiddleware. Every variant carries Vary: Accept-Encoding.
+    """
+    headers = snapshot.headers()
+    headers["Vary"] = "Accept-Encoding"
+    if etag is not None:
+        headers["ETag"] = etag
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    encoding = choose_encoding(request.headers.get("accept-encoding")) if body_name else None
+    if encoding is not None:
+        body = snapshot.compressed(body_name, encoding)
+        headers.update({"Content-Encoding": encoding, "ETag": weak_etag(headers["ETag"])})
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def parse_fields(fields: Optional[str], model) -> Optional[List[str]]:
+    """Validate a comma separated ?fields= projection against a model"""
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in model.__fields__]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+def catalog_listing(request: Request, snapshot, items, ids, body_name, model, fields, after, limit):
+    """Full cached body, or a projected page when fields/after/limit are given"""
+    if fields is None and after is None and limit is None:
+        return catalog_response(request, snapshot, getattr(snapshot, body_name), body_name=body_name)
+    names = parse_fields(fields, model)
+    page, next_cursor = catalog_page(items, ids, after, limit, names)
+    return catalog_response(request, snapshot, encode_items(page), next_cursor,
+                            etag=snapshot.variant_etag(names, after, limit))
+
+async def bulk_import(request: Request, model, csv_layout, collection, sequence_name):
+    """Validate a CSV or JSON array import in one pass, then upsert it by name"""
+    if request.headers.get("content-type", "").startswith("text/csv"):
+        try:
+            text = (await request.body()).decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=422, detail="CSV body must be UTF-8")
+        items = csv_to_items(text, **csv_layout)
+    else:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Body is not valid JSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=422, detail="Expected a JSON array or text/csv body")
+
+    valid, errors = validate_items(items, model)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    if not valid:
+        return {"inserted": 0, "updated": 0, "ids": []}
+
+    try:
+        result = await bulk_upsert(collection, valid, sequences, sequence_name, model.construct().dict())
+    except BulkWriteError as error:
+        await catalog_cache.reload()
+        raise HTTPException(status_code=409, detail=[
+            {"index": write_error["index"], "message": write_error["errmsg"]}
+            for write_error in error.details.get("writeErrors", [])
+        ])
+    await catalog_cache.reload()
+    return result
+
+def item_etag(item) -> str:
+    return f'"v{item["version"]}"'
+
+def if_match_versions(if_match: Optional[str]) -> Optional[List[int]]:
+    """Item versions an If-Match header accepts; None when any version will do.
+
+    Weak tags are accepted as well: they only differ from the strong one by
+    the content encoding CompressionMiddleware applied.
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in (value.strip() for value in if_match.split(",")):
+        tag = tag[2:] if tag.startswith("W/") else tag
+        if tag.startswith('"v') and tag.endswith('"') and tag[2:-1].isdigit():
+            versions.append(int(tag[2:-1]))
+    return versions
+
+def name_taken(error: DuplicateKeyError) -> bool:
+    """Whether a duplicate key error comes from the unique name index"""
+    return "name" in (error.details or {}).get("keyPattern", {})
+
+async def versioned_update(collection, item_id: int, if_match: Optional[str], update: dict,
+                           label: str, conditions: Optional[dict] = None, conflict: str = ""):
+    """Apply `update` and bump the item version in one find_one_and_update.
+
+    The filter carries the If-Match versions and any `conditions`, so a
+    concurrent write can never be lost. Returns the document after the
+    update; only when nothing matched is the item read again, to answer 404,
+    412 (stale If-Match) or 409 (`conditions` not met, `conflict` detail).
+    """
+    versions = if_match_versions(if_match)
+    query = {"id": item_id, **(conditions or {})}
+    if versions is not None:
+        # Items written before versioning count as version 0
+        query["version"] = {"$in": versions + [None] if 0 in versions else versions}
+    if update:
+        try:
+            doc = await collection.find_one_and_update(
+                query, {**update, "$inc": {"version": 1}}, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError as error:
+            if not name_taken(error):
+                raise
+            raise HTTPException(status_code=409, detail=f"Another {label.lower()} has that name")
+    else:
+        doc = await collection.find_one(query)
+    if doc is not None:
+        return doc
+
+    current = await collection.find_one({"id": item_id}, {"_id": 0, "version": 1})
+    if current is None:
+        raise HTTPException(status_code=404, detail=f"{label} not found")
+    if versions is not None and current.get("version", 0) not in versions:
+        raise HTTPException(status_code=412, detail=f"{label} was modified; current ETag is \"v{current.get('version', 0)}\"")
+    raise HTTPException(status_code=409, detail=conflict)
+
+def sheet_sizes_update(field: str, patch) -> tuple:
+    """$push/$pull update and filter conditions for a sheet size PATCH"""
+    if patch.add and patch.remove:
+        # MongoDB rejects $push and $pull on the same array in one update
+        raise HTTPException(status_code=422, detail="Add and remove sheet sizes in separate requests")
+    if patch.add:
+        ids = [sheet.id for sheet in patch.add]
+        if len(set(ids)) != len(ids):
+            raise HTTPException(status_code=422, detail="Duplicate sheet size id")
+        update = {"$push": {field: {"$each": [sheet.dict() for sheet in patch.add]}}}
+        return update, {f"{field}.id": {"$nin": ids}}, f"Sheet size id already exists: {', '.join(map(str, ids))}"
+    if patch.remove:
+        update = {"$pull": {field: {"id": {"$in": patch.remove}}}}
+        return update, {f"{field}.id": {"$all": patch.remove}}, f"Sheet size not found: {', '.join(map(str, patch.remove))}"
+    return {}, {}, ""
+
+def snapshot_item(items, ids, item_id: int):
+    """An item of the current catalog snapshot by id, or None"""
+    index = bisect.bisect_left(ids, item_id)
+    return items[index] if index < len(ids) and ids[index] == item_id else None
+
+def normalized_response(build):
+    """`build(machines, paper_types)` fills both id -> item dicts; adds them as sorted lists"""
+    machines, paper_types = {}, {}
+    response = build(machines, paper_types)
+    response["machines"] = [machines[key] for key in sorted(machines)]
+    response["paperTypes"] = [paper_types[key] for key in sorted(paper_types)]
+    return response
+
+# Results of /calculate and /calculate/booklet keyed by request and catalog digest
+quote_cache = QuoteCache(
+    maxsize=int(os.environ.get('QUOTE_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('QUOTE_CACHE_TTL', 300)),
+)
+
+# Worker processes for large /calculate/batch requests; QUOTE_POOL_WORKERS=0 prices everything inline
+quote_pool = QuotePool(
+    workers=int(os.environ['QUOTE_POOL_WORKERS']) if os.environ.get('QUOTE_POOL_WORKERS') else None,
+    chunk_size=int(os.environ.get('QUOTE_POOL_CHUNK_SIZE', 256)),
+    min_jobs=int(os.environ.get('QUOTE_POOL_MIN_JOBS', 512)),
+)
+
+# Saved quotes (quotes collection)
+quote_history = QuoteHistory(db)
+
+# Status checks, expired by a TTL index and written in coalesced batches
+status_log = StatusLog(
+    db,
+    ttl_seconds=int(os.environ.get('STATUS_CHECK_TTL_SECONDS', 7 * 24 * 3600)),
+    batch_size=int(os.environ.get('STATUS_CHECK_BATCH_SIZE', 500)),
+    flush_interval=float(os.environ.get('STATUS_CHECK_FLUSH_INTERVAL', 0.5)),
+    max_buffered=int(os.environ.get('STATUS_CHECK_MAX_BUFFERED', 10000)),
+)
+
+# (timestamp, id) keyset cursors of saved quotes and status checks
+def encode_time_cursor(cursor) -> Optional[str]:
+    if cursor is None:
+        return None
+    timestamp, record_id = cursor
+    return f"{timestamp.isoformat()},{record_id}"
+
+def decode_time_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    try:
+        timestamp, record_id = cursor.split(",", 1)
+        return datetime.fromisoformat(timestamp), record_id
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+# Background jobs (what-if analyses) persisted in the jobs collection
+job_queue = JobQueue(
+    db,
+    workers=int(os.environ.get('JOB_WORKERS', 2)),
+    lease_seconds=float(os.environ.get('JOB_LEASE_SECONDS', 60)),
+)
+job_queue.register("what-if", partial(run_what_if, catalog_cache=catalog_cache))
+job_queue.register("reprice", partial(run_reprice, catalog_cache=catalog_cache, quote_history=quote_history))
+
+async def reprice_saved_quotes(target: str, entity_id: int, old, new, response: Optional[Response] = None):
+    """Queue re-pricing of the saved quotes that use a changed paper type or machine"""
+    changes = price_changes(target, old, new)
+    if not changes:
+        return None
+    job = await job_queue.submit("reprice", {"target": target, "id": entity_id, "changes": changes})
+    if response is not None:
+        response.headers["X-Reprice-Job"] = job["id"]
+    return job
 
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
@@ -95,94 +805,672 @@ async def root():
 
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
+    """Record a status check; it is written with the next batch, within STATUS_CHECK_FLUSH_INTERVAL"""
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    await status_log.add(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(
+    response: Response,
+    start: Optional[datetime] = Query(None, alias="from"),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Status checks newest first; X-Next-Cursor is the `cursor` of the next page"""
+    status_checks, next_cursor = await status_log.page(decode_time_cursor(cursor), limit, start)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = encode_time_cursor(next_cursor)
+    return status_checks
+
+@api_router.get("/status/stream")
+async def stream_status_checks(
+    start: Optional[datetime] = Query(None, alias="from"),
+    cursor: Optional[str] = None,
+):
+    """Every status check (after `cursor`, since `from`) as newline delimited JSON, newest first"""
+    return StreamingResponse(status_log.stream(decode_time_cursor(cursor), start), media_type="application/x-ndjson")
 
 # Paper Types API Endpoints
 @api_router.get("/paper-types", response_model=List[PaperType])
-async def get_paper_types():
-    paper_types = await db.paper_types.find().to_list(1000)
-    return [PaperType(**paper_type) for paper_type in paper_types]
+async def get_paper_types(
+    request: Request,
+    fields: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+):
+    """List paper types ordered by id.
+
+    ?fields=id,name projects each item, ?limit= pages the list and the
+    X-Next-Cursor response header is the ?after= value of the next page.
+    """
+    snapshot = catalog_cache.snapshot
+    return catalog_listing(
+        request, snapshot, snapshot.paper_types, snapshot.paper_type_ids,
+        "paper_types_json", PaperType, fields, after, limit,
+    )
+
+@api_router.get("/paper-types/stream")
+async def stream_paper_types(fields: Optional[str] = None):
+    """All paper types as newline delimited JSON"""
+    snapshot = catalog_cache.snapshot
+    names = parse_fields(fields, PaperType)
+    return StreamingResponse(
+        ndjson_lines(snapshot.paper_types, names),
+        media_type="application/x-ndjson",
+        headers={**snapshot.headers(), "ETag": snapshot.variant_etag("ndjson", names), "Vary": "Accept-Encoding"},
+    )
 
 @api_router.post("/paper-types", response_model=PaperType)
-async def create_paper_type(paper_type: PaperTypeCreate):
-    # Get the next available ID
-    last_paper_type = await db.paper_types.find().sort([("id", -1)]).limit(1).to_list(1)
-    next_id = (last_paper_type[0]["id"] + 1) if last_paper_type else 1
+async def create_paper_type(paper_type: PaperTypeCreate, response: Response):
+    next_id = await sequences.next_id("paper_types")
     
     paper_type_dict = paper_type.dict()
     paper_type_dict["id"] = next_id
     
     paper_type_obj = PaperType(**paper_type_dict)
-    await db.paper_types.insert_one(paper_type_obj.dict())
+    try:
+        await db.paper_types.insert_one(paper_type_obj.dict())
+    except DuplicateKeyError as error:
+        if not name_taken(error):
+            raise
+        raise HTTPException(status_code=409, detail=f"A paper type named {paper_type_obj.name!r} already exists")
+    await catalog_cache.put_paper_type(paper_type_obj.dict())
+    response.headers.update(catalog_cache.snapshot.headers())
+    response.headers["ETag"] = item_etag(paper_type_obj.dict())
     return paper_type_obj
 
-@api_router.put("/paper-types/{paper_type_id}", response_model=PaperType)
-async def update_paper_type(paper_type_id: int, paper_type_update: PaperTypeUpdate):
-    existing_paper_type = await db.paper_types.find_one({"id": paper_type_id})
-    if not existing_paper_type:
+@api_router.post("/paper-types/bulk", response_model=BulkImportResult)
+async def bulk_import_paper_types(request: Request):
+    """Create or update paper types by name from a JSON array or CSV.
+
+    CSV columns: name,gsm,pricePerTon,sheetId,sheetName,width,height,unit with
+    one row per stock sheet size.
+    """
+    return await bulk_import(request, PaperTypeCreate, PAPER_TYPE_CSV, db.paper_types, "paper_types")
+
+@api_router.get("/paper-types/{paper_type_id}", response_model=PaperType)
+async def get_paper_type(paper_type_id: int, response: Response):
+    """One paper type with its ETag, for a later If-Match update"""
+    snapshot = catalog_cache.snapshot
+    paper_type = snapshot_item(snapshot.paper_types, snapshot.paper_type_ids, paper_type_id)
+    if paper_type is None:
         raise HTTPException(status_code=404, detail="Paper type not found")
-    
+    response.headers["ETag"] = item_etag(paper_type)
+    return paper_type
+
+async def save_paper_type(paper_type_id: int, if_match: Optional[str], update: dict, response: Response,
+                          conditions: Optional[dict] = None, conflict: str = ""):
+    # The snapshot holds the paper type saved quotes were last priced against
+    snapshot = catalog_cache.snapshot
+    existing_paper_type = snapshot_item(snapshot.paper_types, snapshot.paper_type_ids, paper_type_id)
+    doc = await versioned_update(db.paper_types, paper_type_id, if_match, update, "Paper type", conditions, conflict)
+
+    updated_paper_type = PaperType(**doc)
+    await catalog_cache.put_paper_type(updated_paper_type.dict())
+    response.headers.update(catalog_cache.snapshot.headers())
+    response.headers["ETag"] = item_etag(updated_paper_type.dict())
+    await reprice_saved_quotes(
+        "paperType", paper_type_id, existing_paper_type, updated_paper_type.dict(), response
+    )
+    return updated_paper_type
+
+@api_router.put("/paper-types/{paper_type_id}", response_model=PaperType)
+async def update_paper_type(paper_type_id: int, paper_type_update: PaperTypeUpdate, response: Response,
+                            if_match: Optional[str] = Header(None)):
+    """Update the given fields in one round trip; a stale If-Match answers 412"""
     update_data = paper_type_update.dict(exclude_unset=True)
-    if update_data:
-        await db.paper_types.update_one({"id": paper_type_id}, {"$set": update_data})
-    
-    updated_paper_type = await db.paper_types.find_one({"id": paper_type_id})
-    return PaperType(**updated_paper_type)
+    return await save_paper_type(paper_type_id, if_match, {"$set": update_data} if update_data else {}, response)
+
+@api_router.patch("/paper-types/{paper_type_id}/stock-sheet-sizes", response_model=PaperType)
+async def patch_stock_sheet_sizes(paper_type_id: int, patch: StockSheetSizesPatch, response: Response,
+                                  if_match: Optional[str] = Header(None)):
+    """Add or remove stock sheet sizes without rewriting the others.
+
+    New ids must not exist yet and removed ids must exist (409 otherwise).
+    """
+    update, conditions, conflict = sheet_sizes_update("stockSheetSizes", patch)
+    return await save_paper_type(paper_type_id, if_match, update, response, conditions, conflict)
 
 @api_router.delete("/paper-types/{paper_type_id}")
 async def delete_paper_type(paper_type_id: int):
     result = await db.paper_types.delete_one({"id": paper_type_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Paper type not found")
+    await catalog_cache.remove_paper_type(paper_type_id)
+    await reprice_saved_quotes("paperType", paper_type_id, None, None)
     return {"message": "Paper type deleted successfully"}
 
 # Machines API Endpoints
 @api_router.get("/machines", response_model=List[Machine])
-async def get_machines():
-    machines = await db.machines.find().to_list(1000)
-    return [Machine(**machine) for machine in machines]
+async def get_machines(
+    request: Request,
+    fields: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+):
+    """List machines ordered by id, with the same paging and projection as paper types"""
+    snapshot = catalog_cache.snapshot
+    return catalog_listing(
+        request, snapshot, snapshot.machines, snapshot.machine_ids,
+        "machines_json", Machine, fields, after, limit,
+    )
+
+@api_router.get("/machines/stream")
+async def stream_machines(fields: Optional[str] = None):
+    """All machines as newline delimited JSON"""
+    snapshot = catalog_cache.snapshot
+    names = parse_fields(fields, Machine)
+    return StreamingResponse(
+        ndjson_lines(snapshot.machines, names),
+        media_type="application/x-ndjson",
+        headers={**snapshot.headers(), "ETag": snapshot.variant_etag("ndjson", names), "Vary": "Accept-Encoding"},
+    )
 
 @api_router.post("/machines", response_model=Machine)
-async def create_machine(machine: MachineCreate):
-    # Get the next available ID
-    last_machine = await db.machines.find().sort([("id", -1)]).limit(1).to_list(1)
-    next_id = (last_machine[0]["id"] + 1) if last_machine else 1
+async def create_machine(machine: MachineCreate, response: Response):
+    next_id = await sequences.next_id("machines")
     
     machine_dict = machine.dict()
     machine_dict["id"] = next_id
     
     machine_obj = Machine(**machine_dict)
-    await db.machines.insert_one(machine_obj.dict())
+    try:
+        await db.machines.insert_one(machine_obj.dict())
+    except DuplicateKeyError as error:
+        if not name_taken(error):
+            raise
+        raise HTTPException(status_code=409, detail=f"A machine named {machine_obj.name!r} already exists")
+    await catalog_cache.put_machine(machine_obj.dict())
+    response.headers.update(catalog_cache.snapshot.headers())
+    response.headers["ETag"] = item_etag(machine_obj.dict())
     return machine_obj
 
-@api_router.put("/machines/{machine_id}", response_model=Machine)
-async def update_machine(machine_id: int, machine_update: MachineUpdate):
-    existing_machine = await db.machines.find_one({"id": machine_id})
-    if not existing_machine:
+@api_router.post("/machines/bulk", response_model=BulkImportResult)
+async def bulk_import_machines(request: Request):
+    """Create or update machines by name from a JSON array or CSV.
+
+    CSV columns: name,setupCost,sheetsPerHour,setupMinutes,sheetId,sheetName,
+    width,height,clickCost,duplexSupport,unit with one row per print sheet size.
+    """
+    return await bulk_import(request, MachineCreate, MACHINE_CSV, db.machines, "machines")
+
+@api_router.get("/machines/{machine_id}", response_model=Machine)
+async def get_machine(machine_id: int, response: Response):
+    """One machine with its ETag, for a later If-Match update"""
+    snapshot = catalog_cache.snapshot
+    machine = snapshot_item(snapshot.machines, snapshot.machine_ids, machine_id)
+    if machine is None:
         raise HTTPException(status_code=404, detail="Machine not found")
-    
+    response.headers["ETag"] = item_etag(machine)
+    return machine
+
+async def save_machine(machine_id: int, if_match: Optional[str], update: dict, response: Response,
+                       conditions: Optional[dict] = None, conflict: str = ""):
+    # The snapshot holds the machine saved quotes were last priced against
+    snapshot = catalog_cache.snapshot
+    existing_machine = snapshot_item(snapshot.machines, snapshot.machine_ids, machine_id)
+    doc = await versioned_update(db.machines, machine_id, if_match, update, "Machine", conditions, conflict)
+
+    updated_machine = Machine(**doc)
+    await catalog_cache.put_machine(updated_machine.dict())
+    response.headers.update(catalog_cache.snapshot.headers())
+    response.headers["ETag"] = item_etag(updated_machine.dict())
+    await reprice_saved_quotes(
+        "machine", machine_id, existing_machine, updated_machine.dict(), response
+    )
+    return updated_machine
+
+@api_router.put("/machines/{machine_id}", response_model=Machine)
+async def update_machine(machine_id: int, machine_update: MachineUpdate, response: Response,
+                         if_match: Optional[str] = Header(None)):
+    """Update the given fields in one round trip; a stale If-Match answers 412"""
     update_data = machine_update.dict(exclude_unset=True)
-    if update_data:
-        await db.machines.update_one({"id": machine_id}, {"$set": update_data})
-    
-    updated_machine = await db.machines.find_one({"id": machine_id})
-    return Machine(**updated_machine)
+    return await save_machine(machine_id, if_match, {"$set": update_data} if update_data else {}, response)
+
+@api_router.patch("/machines/{machine_id}/print-sheet-sizes", response_model=Machine)
+async def patch_print_sheet_sizes(machine_id: int, patch: PrintSheetSizesPatch, response: Response,
+                                  if_match: Optional[str] = Header(None)):
+    """Add or remove print sheet sizes without rewriting the others.
+
+    New ids must not exist yet and removed ids must exist (409 otherwise).
+    """
+    update, conditions, conflict = sheet_sizes_update("printSheetSizes", patch)
+    return await save_machine(machine_id, if_match, update, response, conditions, conflict)
 
 @api_router.delete("/machines/{machine_id}")
 async def delete_machine(machine_id: int):
     result = await db.machines.delete_one({"id": machine_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Machine not found")
+    await catalog_cache.remove_machine(machine_id)
+    await reprice_saved_quotes("machine", machine_id, None, None)
     return {"message": "Machine deleted successfully"}
 
+@api_router.get("/catalog/export")
+async def export_catalog():
+    """Stream every paper type and machine as NDJSON ({"kind", "item"} per line)"""
+    return StreamingResponse(export_lines(db), media_type="application/x-ndjson")
+
+# Quote calculation endpoints
+@api_router.post("/calculate", response_model=Union[QuoteResponse, NormalizedQuoteResponse])
+async def calculate_quote(
+    job: PrintJob,
+    limit: Optional[int] = Query(50, ge=1),
+    selection: Literal["ranked", "pareto"] = "ranked",
+    shape: Literal["embedded", "normalized"] = "embedded",
+):
+    """Rank every machine, print sheet, paper type and stock sheet combination for a job.
+
+    selection=ranked returns the `limit` cheapest candidates, selection=pareto
+    only the candidates not beaten on both total cost and waste percentage.
+    shape=normalized references the catalog by id in each candidate and lists
+    the machines and paper types used once.
+    """
+    snapshot = catalog_cache.snapshot
+    job_spec = job.dict(exclude={"productName"})
+    cache_key = QuoteCache.key("calculate", [job_spec, limit, selection])
+
+    started = time.perf_counter()
+    parts = quote_cache.get(cache_key, snapshot.digest)
+    cache_hit = parts is not None
+    if not cache_hit:
+        parts = quote_job(snapshot.arrays, job_spec, limit=limit, selection=selection)
+        quote_cache.put(cache_key, snapshot.digest, parts)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    response = {
+        "parts": parts,
+        "catalogVersion": snapshot.version,
+        "cacheHit": cache_hit,
+        "elapsedMs": elapsed_ms,
+    }
+    if shape == "normalized":
+        response.update(normalized_response(lambda machines, paper_types: {
+            "parts": normalize_parts(parts, machines, paper_types),
+        }))
+    return response
+
+@api_router.post("/calculate/batch", response_model=Union[BatchQuoteResponse, NormalizedBatchQuoteResponse])
+async def calculate_quote_batch(
+    jobs: List[PrintJob],
+    limit: Optional[int] = Query(1, ge=1),
+    selection: Literal["ranked", "pareto"] = "ranked",
+    shape: Literal["embedded", "normalized"] = "embedded",
+):
+    """Price a batch of jobs against a single catalog snapshot, results in input order.
+
+    Batches of QUOTE_POOL_MIN_JOBS jobs or more are priced in worker processes.
+    shape=normalized lists each machine and paper type once for the whole batch.
+    """
+    snapshot = catalog_cache.snapshot
+
+    started = time.perf_counter()
+    batch = await quote_pool.quote_batch(
+        snapshot.arrays, snapshot.digest, [job.dict() for job in jobs], limit=limit, selection=selection
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if shape == "normalized":
+        return {
+            **normalized_response(lambda machines, paper_types: {"results": [
+                {"index": index, "parts": normalize_parts(parts, machines, paper_types)}
+                for index, parts in enumerate(batch)
+            ]}),
+            "jobCount": len(jobs),
+            "catalogVersion": snapshot.version,
+            "elapsedMs": elapsed_ms,
+        }
+    return {
+        "results": [{"index": index, "parts": parts} for index, parts in enumerate(batch)],
+        "jobCount": len(jobs),
+        "catalogVersion": snapshot.version,
+        "elapsedMs": elapsed_ms,
+    }
+
+@api_router.post("/calculate/booklet", response_model=BookletQuoteResponse)
+async def calculate_booklet_quote(request: BookletQuoteRequest):
+    """Jointly choose the cover and inner part assignments of a booklet, sharing machine setup"""
+    snapshot = catalog_cache.snapshot
+    cache_key = QuoteCache.key("booklet", request.dict(exclude={"job": {"productName"}}))
+
+    started = time.perf_counter()
+    result = quote_cache.get(cache_key, snapshot.digest)
+    cache_hit = result is not None
+    if not cache_hit:
+        try:
+            result = optimize_booklet(
+                snapshot.arrays,
+                request.job.dict(),
+                [config.dict() for config in request.innerParts],
+                cover_paper_type_id=request.coverPaperTypeId,
+                cover_machine_id=request.coverMachineId,
+            )
+        except ValueError as error:
+            raise HTTPException(status_code=422, detail=str(error))
+        quote_cache.put(cache_key, snapshot.digest, result)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    return {
+        **result,
+        "catalogVersion": snapshot.version,
+        "cacheHit": cache_hit,
+        "elapsedMs": elapsed_ms,
+    }
+
+@api_router.post("/calculate/quantity-sweep", response_model=QuantitySweepResponse)
+async def calculate_quantity_sweep(request: QuantitySweepRequest):
+    """Optimal option and cost per unit at each quantity break.
+
+    Quantities come from `quantities` and/or the inclusive range
+    start..stop by step; job.quantity is not used.
+    """
+    quantities = list(request.quantities)
+    if request.start is not None and request.stop is not None:
+        step = request.step or request.start
+        if step <= 0:
+            raise HTTPException(status_code=422, detail="step must be positive")
+        quantities.extend(range(request.start, request.stop + 1, step))
+    quantities = sorted(set(quantities))
+    if not quantities:
+        raise HTTPException(status_code=422, detail="Provide quantities or a start/stop range")
+    if quantities[0] <= 0:
+        raise HTTPException(status_code=422, detail="Quantities must be positive")
+    if len(quantities) > 1000:
+        raise HTTPException(status_code=422, detail="At most 1000 quantity breaks per request")
+
+    snapshot = catalog_cache.snapshot
+
+    started = time.perf_counter()
+    breaks = quantity_sweep(snapshot.arrays, request.job.dict(), quantities)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    return {"breaks": breaks, "catalogVersion": snapshot.version, "elapsedMs": elapsed_ms}
+
+@api_router.post("/calculate/gang-run", response_model=GangPlanResponse)
+async def calculate_gang_run(request: GangPlanRequest):
+    """Plan shared print runs for a set of pending flat jobs.
+
+    Jobs on the same paper type, machine and sidedness are packed onto
+    common print sheets to cut stock sheets and setups; jobs that do not
+    gain from sharing are printed alone. `unplanned` lists the positions of
+    jobs with no feasible option. The search stops after timeBudgetMs and
+    returns the best plan found (timedOut is then true).
+    """
+    if not request.jobs:
+        raise HTTPException(status_code=422, detail="Provide at least one job")
+    if len(request.jobs) > 1000:
+        raise HTTPException(status_code=422, detail="At most 1000 jobs per planning run")
+    if any(job.isBookletMode for job in request.jobs):
+        raise HTTPException(status_code=422, detail="Gang runs take flat jobs only")
+    if not 10 <= request.timeBudgetMs <= 30000:
+        raise HTTPException(status_code=422, detail="timeBudgetMs must be between 10 and 30000")
+
+    snapshot = catalog_cache.snapshot
+
+    started = time.perf_counter()
+    plan = await asyncio.to_thread(
+        plan_gang_runs, snapshot.arrays, [job.dict() for job in request.jobs], request.timeBudgetMs / 1000
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    return {**plan, "catalogVersion": snapshot.version, "elapsedMs": elapsed_ms}
+
+@api_router.get("/feasibility", response_model=FeasibilityResponse)
+async def get_feasibility(
+    width: float = Query(..., gt=0),
+    height: float = Query(..., gt=0),
+    marginTop: float = 0,
+    marginRight: float = 0,
+    marginBottom: float = 0,
+    marginLeft: float = 0,
+    limit: int = Query(100, ge=0, le=10000),
+):
+    """Which machine, print sheet, paper type and stock sheet combinations can produce a finished size.
+
+    Answered from the catalog's sheet size index without costing anything;
+    `total` counts every combination, `combinations` lists the first `limit`.
+    """
+    snapshot = catalog_cache.snapshot
+
+    started = time.perf_counter()
+    total, combinations = feasible_combinations(
+        snapshot.arrays, width, height, (marginTop, marginRight, marginBottom, marginLeft), limit
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    return {
+        "feasible": total > 0,
+        "total": total,
+        "combinations": combinations,
+        "catalogVersion": snapshot.version,
+        "elapsedMs": elapsed_ms,
+    }
+
+@api_router.post("/schedule", response_model=ScheduleResponse)
+async def schedule_machines(request: ScheduleRequest):
+    """Assign a batch of jobs to machines within their capacity and working hours.
+
+    Jobs are given inline or as saved quote ids. The list scheduler weighs
+    each job's print cost on a machine against hourCost per hour of extra
+    makespan or lateness, and returns every machine's timeline and whether
+    each job meets its dueDate. Times are UTC; start defaults to now.
+    """
+    if not request.jobs:
+        raise HTTPException(status_code=422, detail="Provide at least one job")
+    if len(request.jobs) > 2000:
+        raise HTTPException(status_code=422, detail="At most 2000 jobs per schedule")
+    if any(item.job is None and not item.quoteId for item in request.jobs):
+        raise HTTPException(status_code=422, detail="Each entry needs a job or a quoteId")
+
+    quote_ids = {item.quoteId for item in request.jobs if item.job is None}
+    saved = await quote_history.get_many(quote_ids) if quote_ids else {}
+    missing = sorted(quote_ids - saved.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Quotes not found: {', '.join(missing)}")
+    jobs = [item.job.dict() if item.job is not None else saved[item.quoteId]["job"] for item in request.jobs]
+
+    snapshot = catalog_cache.snapshot
+
+    started = time.perf_counter()
+    try:
+        schedule = schedule_jobs(
+            snapshot.arrays, jobs, naive_utc(request.start) or utc_now(), request.hourCost,
+            [naive_utc(item.dueDate) for item in request.jobs],
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    return {**schedule, "catalogVersion": snapshot.version, "elapsedMs": elapsed_ms}
+
+@api_router.post("/imposition", response_model=ImpositionResponse)
+async def calculate_imposition(request: ImpositionRequest):
+    """Best guillotine layout of items on a sheet, mixing rotated and unrotated blocks.
+
+    Block positions are measured from the sheet corner, margins included;
+    gridCount is what the unrotated grid alone holds.
+    """
+    usable_width = max(request.sheetWidth - request.marginLeft - request.marginRight, 0)
+    usable_height = max(request.sheetHeight - request.marginTop - request.marginBottom, 0)
+    depth = PRODUCT_LAYOUT_DEPTH if request.item == "product" else SHEET_LAYOUT_DEPTH
+    count, blocks = guillotine_layout(
+        usable_width, usable_height, request.itemWidth, request.itemHeight, depth
+    )
+
+    grid_count = 0
+    if request.itemWidth > 0 and request.itemHeight > 0:
+        grid_count = math.floor(usable_width / request.itemWidth) * math.floor(usable_height / request.itemHeight)
+    sheet_area = request.sheetWidth * request.sheetHeight
+    utilization = count * request.itemWidth * request.itemHeight / sheet_area if sheet_area > 0 else 0.0
+
+    return {
+        "count": count,
+        "gridCount": grid_count,
+        "blocks": [
+            {
+                "x": request.marginLeft + x,
+                "y": request.marginTop + y,
+                "width": columns * (request.itemHeight if rotated else request.itemWidth),
+                "height": rows * (request.itemWidth if rotated else request.itemHeight),
+                "columns": columns,
+                "rows": rows,
+                "rotated": rotated,
+            }
+            for x, y, columns, rows, rotated in blocks
+        ],
+        "utilization": utilization,
+    }
+
+@api_router.get("/calculate/pool-stats")
+async def get_quote_pool_stats():
+    """Worker pool settings and shared catalog memory"""
+    return quote_pool.stats()
+
+@api_router.get("/calculate/cache-stats")
+async def get_quote_cache_stats():
+    """Hit/miss counters and size of the quote result cache"""
+    return quote_cache.stats()
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Request, MongoDB and quote engine timings in the Prometheus text format"""
+    return Response(content=registry.render(), media_type=registry.content_type)
+
+@api_router.get("/health/live")
+async def liveness():
+    """The process serves requests; MongoDB is not contacted, so an outage does not restart it"""
+    return {"status": "alive", "pool": {**mongo_pool.state(), "healthy": mongo_pool.healthy}}
+
+@api_router.get("/health/ready")
+async def readiness():
+    """Whether to route traffic here: MongoDB answers a ping in time and the pool is not cleared"""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), MONGO_READY_TIMEOUT)
+        ping_ms = (time.perf_counter() - started) * 1000
+        error = None
+    except Exception as exc:
+        ping_ms = None
+        error = str(exc) or type(exc).__name__
+    ready = error is None and mongo_pool.healthy
+    body = {
+        "status": "ready" if ready else "unavailable",
+        "mongo": {"pingMs": ping_ms, "error": error},
+        "pool": {**mongo_pool.state(), "healthy": mongo_pool.healthy, "clearedAt": mongo_pool.cleared_at},
+        "catalogVersion": catalog_cache.snapshot.version,
+    }
+    return ORJSONResponse(body, status_code=200 if ready else 503)
+
+# Quote history
+@api_router.post("/quotes", response_model=SavedQuote)
+async def save_quote(request: SaveQuoteRequest):
+    """Price a job (optionally pinned per part) and store the chosen option with its cost breakdown"""
+    snapshot = catalog_cache.snapshot
+    job = request.job.dict()
+    selections = {name: selection.dict() for name, selection in request.selections.items()}
+    chosen = choose_candidates(snapshot.arrays, job, selections)
+    missing = [name for name, candidate, _ in chosen if candidate is None]
+    if missing:
+        raise HTTPException(
+            status_code=422,
+            detail=f"No suitable paper type, machine and sheet size combination for {', '.join(missing)}",
+        )
+    return await quote_history.save(quote_record(job, chosen, snapshot, selections))
+
+@api_router.get("/quotes", response_model=SavedQuotePage)
+async def search_quotes(
+    machineId: Optional[int] = None,
+    paperTypeId: Optional[int] = None,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Saved quotes newest first; pass nextCursor back as `cursor` for the next page"""
+    quotes, next_cursor = await quote_history.search(
+        machineId, paperTypeId, start, end, decode_time_cursor(cursor), limit
+    )
+    return {"quotes": quotes, "nextCursor": encode_time_cursor(next_cursor)}
+
+@api_router.get("/quotes/stats/by-machine", response_model=List[MachineVolume])
+async def get_volume_by_machine(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+):
+    names = {machine["id"]: machine["name"] for machine in catalog_cache.snapshot.machines}
+    rows = await quote_history.volume_by_machine(start, end)
+    return [{**row, "machineName": names.get(row["machineId"])} for row in rows]
+
+@api_router.get("/quotes/stats/by-paper", response_model=List[PaperCostStats])
+async def get_cost_by_paper(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+):
+    names = {paper_type["id"]: paper_type["name"] for paper_type in catalog_cache.snapshot.paper_types}
+    rows = await quote_history.cost_by_paper(start, end)
+    return [{**row, "paperTypeName": names.get(row["paperTypeId"])} for row in rows]
+
+@api_router.get("/quotes/{quote_id}", response_model=SavedQuote)
+async def get_saved_quote(quote_id: str):
+    quote = await quote_history.get(quote_id)
+    if not quote:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    return quote
+
+@api_router.delete("/quotes/{quote_id}")
+async def delete_saved_quote(quote_id: str):
+    if not await quote_history.delete(quote_id):
+        raise HTTPException(status_code=404, detail="Quote not found")
+    return {"message": "Quote deleted successfully"}
+
+# Background jobs
+@api_router.post("/analyses/what-if", response_model=JobStatus, status_code=202)
+async def submit_what_if(request: WhatIfRequest):
+    """Queue a what-if analysis: every job priced before and after the price changes"""
+    snapshot = catalog_cache.snapshot
+    changes = [change.dict() for change in request.changes]
+    errors = price_change_errors(snapshot.paper_types, snapshot.machines, changes)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    # The jobs are stored as job inputs, outside the job document
+    return await job_queue.submit("what-if", {"changes": changes}, [job.dict() for job in request.jobs])
+
+@api_router.get("/jobs", response_model=List[JobStatus])
+async def list_jobs(limit: int = Query(50, ge=1, le=500)):
+    return await job_queue.list(limit)
+
+@api_router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.get("/jobs/{job_id}/results", response_model=JobResultsPage)
+async def get_job_results(
+    job_id: str,
+    after: Optional[int] = None,
+    limit: int = Query(500, ge=1, le=5000),
+):
+    """Result rows of a job in order, `after` is the nextCursor of the previous page"""
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    rows = await job_queue.result_rows(job_id, after, limit)
+    next_cursor = rows[-1]["index"] if len(rows) == limit else None
+    return {"jobId": job_id, "status": job["status"], "rows": rows, "nextCursor": next_cursor}
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=JobStatus)
+async def cancel_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in FINISHED:
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    return await job_queue.cancel(job_id)
+
 # Initialize default data endpoint
 @api_router.post("/initialize-data")
 async def initialize_default_data():
@@ -242,6 +1530,7 @@ async def initialize_default_data():
         ]
         
         await db.paper_types.insert_many(default_paper_types)
+        await sequences.sync("paper_types", db.paper_types)
     
     if existing_machines == 0:
         # Initialize default machines
@@ -250,6 +1539,8 @@ async def initialize_default_data():
                 "id": 1,
                 "name": "Heidelberg SM 52",
                 "setupCost": 45,
+                "sheetsPerHour": 8000,
+                "setupMinutes": 30,
                 "printSheetSizes": [
                     {"id": 1, "name": "SRA3", "width": 320, "height": 450, "clickCost": 0.08, "duplexSupport": True, "unit": "mm"},
                     {"id": 2, "name": "A3+", "width": 330, "height": 483, "clickCost": 0.09, "duplexSupport": True, "unit": "mm"},
@@ -260,6 +1551,8 @@ async def initialize_default_data():
                 "id": 2,
                 "name": "Komori L528",
                 "setupCost": 50,
+                "sheetsPerHour": 10000,
+                "setupMinutes": 40,
                 "printSheetSizes": [
                     {"id": 4, "name": "SRA3", "width": 320, "height": 450, "clickCost": 0.07, "duplexSupport": True, "unit": "mm"},
                     {"id": 5, "name": "A3", "width": 297, "height": 420, "clickCost": 0.065, "duplexSupport": True, "unit": "mm"},
@@ -270,6 +1563,8 @@ async def initialize_default_data():
                 "id": 3,
                 "name": "Digital Press HP",
                 "setupCost": 25,
+                "sheetsPerHour": 3000,
+                "setupMinutes": 5,
                 "printSheetSizes": [
                     {"id": 7, "name": "A3", "width": 297, "height": 420, "clickCost": 0.12, "duplexSupport": True, "unit": "mm"},
                     {"id": 8, "name": "A4", "width": 210, "height": 297, "clickCost": 0.08, "duplexSupport": True, "unit": "mm"},
@@ -279,7 +1574,9 @@ async def initialize_default_data():
         ]
         
         await db.machines.insert_many(default_machines)
+        await sequences.sync("machines", db.machines)
     
+    await catalog_cache.reload()
     return {"message": "Default data initialized successfully"}
 
 # Include the router in the main app
@@ -293,6 +1590,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    gzip_level=GZIP_LEVEL,
+    brotli_quality=BROTLI_QUALITY,
+)
+
+# Outermost, so the recorded latency covers every other middleware
+app.add_middleware(MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -300,6 +1607,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def warm_mongo_pool():
+    """Open the pool's connections before the first request needs them"""
+    await asyncio.gather(*(db.command("ping") for _ in range(MONGO_WARM_CONNECTIONS)))
+
+@app.on_event("startup")
+async def ensure_indexes():
+    await db.paper_types.create_index("id", unique=True)
+    await db.machines.create_index("id", unique=True)
+    # Bulk imports upsert by name
+    await ensure_name_index(db.paper_types)
+    await ensure_name_index(db.machines)
+    await status_log.ensure_indexes()
+    # Catalogs created before the counters collection existed
+    await sequences.sync("paper_types", db.paper_types)
+    await sequences.sync("machines", db.machines)
+    await quote_history.ensure_indexes()
+
+@app.on_event("startup")
+async def start_catalog_cache():
+    await catalog_cache.start()
+
+@app.on_event("startup")
+async def start_job_queue():
+    await job_queue.start()
+
+@app.on_event("startup")
+async def start_status_log():
+    await status_log.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await job_queue.stop()
+    await catalog_cache.stop()
+    await status_log.stop()
+    quote_pool.shutdown()
     client.close()
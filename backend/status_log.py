@@ -0,0 +1,143 @@
+import asyncio
+import logging
+
+import orjson
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from mongo_errors import INDEX_CONFLICT_CODES
+
+logger = logging.getLogger(__name__)
+
+
+def before_cursor(before):
+    """Filter for the records after a (timestamp, id) cursor, newest first"""
+    if before is None:
+        return {}
+    timestamp, record_id = before
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "id": {"$lt": record_id}},
+    ]}
+
+
+class StatusLog:
+    """Status checks in the status_checks collection.
+
+    Records expire `ttl_seconds` after their timestamp through a TTL index
+    (0 keeps them forever). Writes are buffered and coalesced into one
+    insert_many per `flush_interval` seconds or per `batch_size` records, so
+    high-rate health pings cost a round trip per batch instead of per
+    record. Reads are newest first with a (timestamp, id) keyset cursor.
+    """
+
+    def __init__(self, db, ttl_seconds=0, batch_size=500, flush_interval=0.5,
+                 max_buffered=10000, collection="status_checks"):
+        self.db = db
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._buffer = []
+        self._full = asyncio.Event()
+        self._flusher = None
+
+    @property
+    def statuses(self):
+        return self.db[self.collection]
+
+    async def ensure_indexes(self):
+        """Create the paging index and apply the retention.
+
+        Connection errors propagate, so startup fails when MongoDB is down;
+        a retention change the server refuses (no collMod privilege, an
+        index built by hand) is logged and the existing index kept.
+        """
+        try:
+            await self._ensure_retention()
+        except OperationFailure:
+            logger.exception("Status check retention (TTL %ss) not applied", self.ttl_seconds)
+        await self.statuses.create_index([("timestamp", DESCENDING), ("id", DESCENDING)])
+
+    async def _ensure_retention(self):
+        options = {"expireAfterSeconds": self.ttl_seconds} if self.ttl_seconds > 0 else {}
+        try:
+            await self.statuses.create_index([("timestamp", ASCENDING)], **options)
+        except OperationFailure as error:
+            if error.code not in INDEX_CONFLICT_CODES:
+                raise
+            if options:
+                # Changes the expiry, or turns an existing plain index into a TTL index
+                await self.db.command({"collMod": self.collection, "index": {
+                    "keyPattern": {"timestamp": 1}, "expireAfterSeconds": self.ttl_seconds,
+                }})
+            else:
+                await self.statuses.drop_index([("timestamp", ASCENDING)])
+                await self.statuses.create_index([("timestamp", ASCENDING)])
+
+    async def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write what is still buffered"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def add(self, record):
+        """Buffer a record; written directly when the flusher is not running"""
+        if len(self._buffer) >= self.max_buffered:
+            # Writes outpace the database: wait for them instead of growing without bound
+            await self.flush()
+        self._buffer.append(record)
+        if self._flusher is None:
+            await self.flush()
+        elif len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self):
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        try:
+            await self.statuses.insert_many(batch, ordered=False)
+        except Exception:
+            # Status checks are best effort; a failed batch is not retried, as
+            # part of it may have been written
+            logger.exception("Could not write %d status checks", len(batch))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    def _find(self, before, start=None):
+        query = before_cursor(before)
+        if start is not None:
+            query = {"$and": [query, {"timestamp": {"$gte": start}}]}
+        return self.statuses.find(query, {"_id": 0}).sort([("timestamp", DESCENDING), ("id", DESCENDING)])
+
+    async def page(self, before=None, limit=100, start=None):
+        """One page of status checks, newest first, and the cursor of the next page (None at the end)"""
+        records = await self._find(before, start).limit(limit + 1).to_list(limit + 1)
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = (records[-1]["timestamp"], records[-1]["id"])
+        return records, next_cursor
+
+    async def stream(self, before=None, start=None, batch_size=1000):
+        """Every status check after the cursor as NDJSON, newest first, read batch by batch"""
+        async for record in self._find(before, start).batch_size(batch_size):
+            yield orjson.dumps(record) + b"\n"
@@ -0,0 +1,156 @@
+import asyncio
+import copy
+
+from quote_engine import CatalogArrays, SheetFitIndex, quote_job
+
+# Which fields a price change may touch, per catalog entity
+PRICE_FIELDS = {
+    "paperType": ("pricePerTon",),
+    "machine": ("setupCost", "clickCost"),
+}
+
+
+def price_change_errors(paper_types, machines, changes):
+    """Messages for changes that do not match the catalog, empty when all apply"""
+    items = {
+        "paperType": {item["id"]: item for item in paper_types},
+        "machine": {item["id"]: item for item in machines},
+    }
+    errors = []
+    for index, change in enumerate(changes):
+        if change["field"] not in PRICE_FIELDS[change["target"]]:
+            errors.append(f"changes[{index}]: {change['target']} has no price field {change['field']}")
+        elif change["id"] not in items[change["target"]]:
+            errors.append(f"changes[{index}]: {change['target']} {change['id']} not found")
+        elif change["field"] == "clickCost" and change.get("sheetId") is not None and not any(
+            sheet["id"] == change["sheetId"]
+            for sheet in items["machine"][change["id"]]["printSheetSizes"]
+        ):
+            errors.append(f"changes[{index}]: print sheet size {change['sheetId']} not found")
+        if (change.get("factor") is None) == (change.get("value") is None):
+            errors.append(f"changes[{index}]: give exactly one of factor and value")
+    return errors
+
+
+def apply_price_changes(paper_types, machines, changes):
+    """Copies of the catalog items with the price changes applied.
+
+    A change multiplies the field by `factor` or replaces it with `value`.
+    clickCost changes apply to every print sheet size of the machine, or
+    only to `sheetId` when given.
+    """
+    paper_types = copy.deepcopy(paper_types)
+    machines = copy.deepcopy(machines)
+    by_id = {
+        "paperType": {item["id"]: item for item in paper_types},
+        "machine": {item["id"]: item for item in machines},
+    }
+
+    def changed(current, change):
+        return current * change["factor"] if change.get("factor") is not None else change["value"]
+
+    for change in changes:
+        item = by_id[change["target"]][change["id"]]
+        if change["field"] == "clickCost":
+            for sheet in item["printSheetSizes"]:
+                if change.get("sheetId") is None or sheet["id"] == change["sheetId"]:
+                    sheet["clickCost"] = changed(sheet["clickCost"], change)
+        else:
+            item[change["field"]] = changed(item[change["field"]], change)
+    return paper_types, machines
+
+
+def best_option(quote):
+    """Total cost of a quote_job(limit=1) result and the chosen option per part"""
+    if any(not part["candidates"] for part in quote):
+        return None, None
+    option = [
+        {
+            "part": part["part"],
+            "machineId": candidate["machine"]["id"],
+            "printSheetSizeId": candidate["printSheetSize"]["id"],
+            "paperTypeId": candidate["paperType"]["id"],
+            "stockSheetSizeId": candidate["stockSheetSize"]["id"],
+            "totalCost": candidate["totalCost"],
+        }
+        for part in quote
+        for candidate in part["candidates"][:1]
+    ]
+    return sum(part["totalCost"] for part in option), option
+
+
+def choices(option):
+    return [{key: value for key, value in part.items() if key != "totalCost"} for part in option]
+
+
+def compare_jobs(baseline, scenario, jobs):
+    """One result row per job: cost and chosen option before and after the changes"""
+    rows = []
+    for job in jobs:
+        baseline_cost, baseline_option = best_option(quote_job(baseline, job, limit=1))
+        scenario_cost, scenario_option = best_option(quote_job(scenario, job, limit=1))
+        feasible = baseline_cost is not None and scenario_cost is not None
+        delta = scenario_cost - baseline_cost if feasible else None
+        rows.append({
+            "productName": job.get("productName"),
+            "quantity": job["quantity"],
+            "feasible": feasible,
+            "baselineCost": baseline_cost,
+            "scenarioCost": scenario_cost,
+            "delta": delta,
+            "deltaPercent": delta / baseline_cost * 100 if feasible and baseline_cost else None,
+            "optionChanged": feasible and choices(baseline_option) != choices(scenario_option),
+            "baselineOption": baseline_option,
+            "scenarioOption": scenario_option,
+        })
+    return rows
+
+
+async def run_what_if(context, catalog_cache, chunk_size=200):
+    """Job handler: price every job against the current catalog and the changed one.
+
+    The jobs are the job's stored inputs. Both catalogs get a private fit
+    index, since chunks are priced in a worker thread while requests keep
+    using the shared one. Result rows are written per chunk; the summary
+    totals the feasible jobs.
+    """
+    snapshot = catalog_cache.snapshot
+    changes = context.params["changes"]
+    errors = price_change_errors(snapshot.paper_types, snapshot.machines, changes)
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    fit_index = SheetFitIndex()
+    baseline = CatalogArrays(snapshot.paper_types, snapshot.machines, fit_index)
+    scenario = CatalogArrays(
+        *apply_price_changes(snapshot.paper_types, snapshot.machines, changes), fit_index
+    )
+
+    summary = {
+        "catalogVersion": snapshot.version,
+        "jobCount": context.input_count,
+        "feasibleJobs": 0,
+        "optionsChanged": 0,
+        "baselineTotal": 0.0,
+        "scenarioTotal": 0.0,
+    }
+    await context.progress(0, context.input_count, force=True)
+    processed = 0
+    async for jobs in context.inputs():
+        for start in range(0, len(jobs), chunk_size):
+            rows = await asyncio.to_thread(compare_jobs, baseline, scenario, jobs[start:start + chunk_size])
+            for row in rows:
+                if row["feasible"]:
+                    summary["feasibleJobs"] += 1
+                    summary["optionsChanged"] += row["optionChanged"]
+                    summary["baselineTotal"] += row["baselineCost"]
+                    summary["scenarioTotal"] += row["scenarioCost"]
+            await context.write_results(rows)
+            processed += len(rows)
+            await context.progress(processed)
+
+    summary["delta"] = summary["scenarioTotal"] - summary["baselineTotal"]
+    summary["deltaPercent"] = (
+        summary["delta"] / summary["baselineTotal"] * 100 if summary["baselineTotal"] else None
+    )
+    return summary
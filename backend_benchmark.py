@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for the Printing Cost Calculator API
+Runs the FastAPI app in-process (httpx ASGI transport) against mongomock or a
+local mongod, over synthetic catalogs scaled up from the initialize-data
+defaults, and reports p50/p95/p99 latency and requests per second per
+endpoint. Results can be saved as a JSON baseline and compared with a later run.
+
+    python backend_benchmark.py --scales 12,1000,10000 --output baseline.json
+    python backend_benchmark.py --compare baseline.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# The catalog cache would otherwise poll MongoDB every few seconds mid-run
+os.environ.setdefault("CATALOG_POLL_INTERVAL", "3600")
+# Batch requests stay inline so results do not depend on the core count
+os.environ.setdefault("QUOTE_POOL_WORKERS", "0")
+
+
+def load_app(mongo_url=None, db_name=None):
+    """Import server.py and point it at the benchmark database"""
+    import httpx
+    import server
+
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+        db = client[db_name]
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is not installed; pip install mongomock-motor or pass --mongo-url")
+        from pymongo.errors import OperationFailure
+
+        client = AsyncMongoMockClient()
+        db = client[db_name]
+
+        # mongomock has no change streams; fail like a standalone mongod so
+        # the catalog cache falls back to polling
+        def watch(*args, **kwargs):
+            raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+        object.__setattr__(db, "watch", watch)
+
+    server.db = db
+    for component in (server.sequences, server.catalog_cache, server.quote_history, server.job_queue,
+                      server.status_log):
+        component.db = db
+    transport = httpx.ASGITransport(app=server.app)
+    return server, client, db, httpx.AsyncClient(transport=transport, base_url="http://benchmark")
+
+
+# Synthetic catalogs
+
+def scaled_catalog(paper_types, machines, stock_sizes, print_sizes, seed=0):
+    """Paper types and machines cycled from the defaults until the catalog has
+    `stock_sizes` stock sheet sizes and `print_sizes` print sheet sizes.
+
+    Copies get their own name, a jittered price and sheet sizes stretched by a
+    few percent, so sizes stay distinct and the fit search has real work.
+    """
+    rng = random.Random(seed)
+
+    def sheets(base, count, price_field=None):
+        result = []
+        for index in range(count):
+            sheet = dict(base[index % len(base)])
+            stretch = 1 + rng.randint(0, 40) * 0.01
+            sheet.update(
+                id=index + 1,
+                name=f"{sheet['name']} {index + 1}",
+                width=round(sheet["width"] * stretch, 1),
+                height=round(sheet["height"] * stretch, 1),
+            )
+            if price_field:
+                sheet[price_field] = round(sheet[price_field] * rng.uniform(0.8, 1.2), 4)
+            result.append(sheet)
+        return result
+
+    new_paper_types = []
+    per_paper = len(paper_types[0]["stockSheetSizes"])
+    for index in range(math.ceil(stock_sizes / per_paper)):
+        base = paper_types[index % len(paper_types)]
+        count = min(per_paper, stock_sizes - index * per_paper)
+        new_paper_types.append({
+            "name": f"{base['name']} #{index + 1}",
+            "gsm": base["gsm"] + 10 * rng.randint(0, 10),
+            "pricePerTon": round(base["pricePerTon"] * rng.uniform(0.8, 1.2), 2),
+            "stockSheetSizes": sheets(base["stockSheetSizes"], count),
+        })
+
+    new_machines = []
+    per_machine = len(machines[0]["printSheetSizes"])
+    for index in range(math.ceil(print_sizes / per_machine)):
+        base = machines[index % len(machines)]
+        count = min(per_machine, print_sizes - index * per_machine)
+        new_machines.append({
+            "name": f"{base['name']} #{index + 1}",
+            "setupCost": round(base["setupCost"] * rng.uniform(0.8, 1.2), 2),
+            "printSheetSizes": sheets(base["printSheetSizes"], count, "clickCost"),
+        })
+    return new_paper_types, new_machines
+
+
+def random_job(rng):
+    job = {
+        "productName": "Benchmark job",
+        "finalWidth": rng.choice([85, 99, 148, 210]),
+        "finalHeight": rng.choice([55, 210, 297]),
+        "quantity": rng.choice([100, 250, 500, 1000, 2500, 5000, 10000]),
+        "isDoubleSided": rng.random() < 0.5,
+        "setupRequired": rng.random() < 0.5,
+    }
+    if rng.random() < 0.2:
+        job.update(isBookletMode=True, totalPages=rng.choice([8, 16, 32, 48]),
+                   finalWidth=148, finalHeight=210)
+    return job
+
+
+# Scenarios: name -> function(rng, state) returning (method, path, kwargs)
+
+def scenarios(batch_size):
+    def create_paper_type(rng, state):
+        state["created"] += 1
+        return "POST", "/api/paper-types", {"json": {
+            "name": f"Benchmark paper {state['created']}",
+            "gsm": 90,
+            "pricePerTon": 950,
+            "stockSheetSizes": [{"id": 1, "name": "SRA3", "width": 320, "height": 450}],
+        }}
+
+    def update_paper_type(rng, state):
+        paper_type_id = rng.choice(state["paper_type_ids"])
+        return "PUT", f"/api/paper-types/{paper_type_id}", {"json": {
+            "pricePerTon": round(rng.uniform(800, 1300), 2),
+        }}
+
+    return {
+        "GET /api/paper-types": lambda rng, state: ("GET", "/api/paper-types", {}),
+        "GET /api/paper-types (page)": lambda rng, state: (
+            "GET", "/api/paper-types", {"params": {"limit": 50, "fields": "id,name,gsm,pricePerTon"}}
+        ),
+        "GET /api/paper-types (304)": lambda rng, state: (
+            "GET", "/api/paper-types", {"headers": {"If-None-Match": state["etag"]}}
+        ),
+        "GET /api/machines": lambda rng, state: ("GET", "/api/machines", {}),
+        "POST /api/paper-types": create_paper_type,
+        "PUT /api/paper-types/{id}": update_paper_type,
+        "POST /api/calculate": lambda rng, state: (
+            "POST", "/api/calculate", {"params": {"limit": 10}, "json": random_job(rng)}
+        ),
+        "POST /api/calculate (pareto)": lambda rng, state: (
+            "POST", "/api/calculate", {"params": {"selection": "pareto"}, "json": random_job(rng)}
+        ),
+        "POST /api/calculate (normalized)": lambda rng, state: (
+            "POST", "/api/calculate", {"params": {"limit": 10, "shape": "normalized"}, "json": random_job(rng)}
+        ),
+        "POST /api/calculate/batch": lambda rng, state: (
+            "POST", "/api/calculate/batch", {"json": [random_job(rng) for _ in range(batch_size)]}
+        ),
+        "POST /api/calculate/booklet": lambda rng, state: (
+            "POST", "/api/calculate/booklet", {"json": {
+                "job": dict(random_job(rng), isBookletMode=True, finalWidth=148, finalHeight=210),
+                "innerParts": [{"pageCount": 16}, {"pageCount": rng.choice([8, 16, 32])}],
+            }}
+        ),
+        "POST /api/calculate/quantity-sweep": lambda rng, state: (
+            "POST", "/api/calculate/quantity-sweep", {"json": {
+                "job": random_job(rng), "start": 100, "stop": 5000, "step": 100,
+            }}
+        ),
+        "POST /api/calculate/gang-run": lambda rng, state: (
+            "POST", "/api/calculate/gang-run", {"json": {
+                "jobs": [dict(random_job(rng), isBookletMode=False) for _ in range(batch_size)],
+                "timeBudgetMs": 500,
+            }}
+        ),
+        "POST /api/quotes": lambda rng, state: ("POST", "/api/quotes", {"json": {"job": random_job(rng)}}),
+    }
+
+
+async def measure(http, name, make_request, state, requests, concurrency, warmup, seed):
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        method, path, kwargs = make_request(rng, state)
+        await http.request(method, path, **kwargs)
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        method, path, kwargs = make_request(rng, state)
+        async with semaphore:
+            started = time.perf_counter()
+            response = await http.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    milliseconds = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {
+        "scenario": name,
+        "requests": requests,
+        "errors": errors,
+        "p50Ms": float(p50),
+        "p95Ms": float(p95),
+        "p99Ms": float(p99),
+        "meanMs": float(milliseconds.mean()),
+        "maxMs": float(milliseconds.max()),
+        "rps": requests / elapsed if elapsed else None,
+    }
+
+
+async def run_scale(args, stock_sizes, print_sizes):
+    server, client, db, http = load_app(args.mongo_url, f"{args.db_name}_{stock_sizes}")
+    results = []
+    try:
+        if args.mongo_url:
+            await client.drop_database(db.name)
+        for handler in server.app.router.on_startup:
+            await handler()
+
+        await http.post("/api/initialize-data")
+        defaults = (await http.get("/api/paper-types")).json(), (await http.get("/api/machines")).json()
+        paper_types, machines = scaled_catalog(*defaults, stock_sizes, print_sizes, seed=args.seed)
+        # The scaled copies replace the defaults
+        for path, items in (("/api/paper-types", defaults[0]), ("/api/machines", defaults[1])):
+            for item in items:
+                await http.delete(f"{path}/{item['id']}")
+
+        started = time.perf_counter()
+        for path, items in (("/api/paper-types/bulk", paper_types), ("/api/machines/bulk", machines)):
+            for start in range(0, len(items), 1000):
+                response = await http.post(path, json=items[start:start + 1000])
+                response.raise_for_status()
+        import_seconds = time.perf_counter() - started
+
+        catalog = (await http.get("/api/paper-types"))
+        state = {
+            "etag": catalog.headers.get("etag"),
+            "paper_type_ids": [item["id"] for item in catalog.json()],
+            "created": 0,
+        }
+        snapshot = server.catalog_cache.snapshot
+        print(f"📦 Catalog: {len(snapshot.paper_types)} paper types, {len(snapshot.machines)} machines, "
+              f"{snapshot.arrays.pair_count} print/stock pairs (import {import_seconds:.2f}s)")
+
+        selected = scenarios(args.batch_size)
+        if args.only:
+            selected = {name: make for name, make in selected.items() if any(key in name for key in args.only)}
+        for index, (name, make_request) in enumerate(selected.items()):
+            requests = args.requests
+            if "batch" in name or "sweep" in name:
+                requests = max(1, requests // 10)
+            result = await measure(http, name, make_request, state, requests,
+                                   args.concurrency, args.warmup, args.seed + index)
+            result.update(stockSizes=stock_sizes, printSizes=print_sizes)
+            results.append(result)
+            print(f"  {name:<38} p50 {result['p50Ms']:9.2f}ms  p95 {result['p95Ms']:9.2f}ms  "
+                  f"p99 {result['p99Ms']:9.2f}ms  {result['rps']:8.1f} req/s"
+                  + (f"  ({result['errors']} errors)" if result["errors"] else ""))
+    finally:
+        await http.aclose()
+        for handler in server.app.router.on_shutdown:
+            await handler()
+        if args.mongo_url:
+            await client.drop_database(db.name)
+        sys.modules.pop("server", None)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).parent, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, tolerance):
+    """Print the change of every scenario against a baseline; True when nothing regressed"""
+    with open(baseline_path) as f:
+        baseline = {
+            (row["stockSizes"], row["scenario"]): row for row in json.load(f)["results"]
+        }
+    print("=" * 60)
+    print(f"📊 COMPARISON WITH {baseline_path} (tolerance {tolerance:.0%})")
+    print("=" * 60)
+    regressions = 0
+    for row in results:
+        before = baseline.get((row["stockSizes"], row["scenario"]))
+        if before is None:
+            continue
+        change = row["p95Ms"] / before["p95Ms"] - 1 if before["p95Ms"] else 0.0
+        regressed = change > tolerance
+        regressions += regressed
+        print(f"{'❌' if regressed else '✅'} {row['stockSizes']:>6} {row['scenario']:<38} "
+              f"p95 {before['p95Ms']:9.2f} -> {row['p95Ms']:9.2f}ms ({change:+.1%})")
+    return regressions == 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="12,1000,10000",
+                        help="comma separated stock sheet size counts (12 = the defaults)")
+    parser.add_argument("--print-sizes", default=None,
+                        help="comma separated print sheet size counts per scale (default: 9, or stock sizes / 100)")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=50, help="jobs per /calculate/batch and /calculate/gang-run request")
+    parser.add_argument("--only", action="append", help="only scenarios whose name contains this (repeatable)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mongo-url", default=None, help="use this mongod instead of mongomock")
+    parser.add_argument("--db-name", default="benchmark")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare p95 latencies with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown before failing")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    # server.py logs at INFO; one line per request would drown the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    scales = [int(value) for value in args.scales.split(",")]
+    if args.print_sizes:
+        print_sizes = [int(value) for value in args.print_sizes.split(",")]
+    else:
+        print_sizes = [max(9, scale // 100) for scale in scales]
+
+    print(f"🔧 Benchmarking in-process against {args.mongo_url or 'mongomock'}")
+    print("=" * 60)
+    results = []
+    for stock_sizes, prints in zip(scales, print_sizes):
+        print(f"📐 {stock_sizes} stock sheet sizes, {prints} print sheet sizes")
+        results += await run_scale(args, stock_sizes, prints)
+        print()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "mongo": "mongod" if args.mongo_url else "mongomock",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "batchSize": args.batch_size,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+    if args.compare:
+        return compare(results, args.compare, args.tolerance)
+    return True
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,69 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is a flat set of modules imported from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    """A fresh in-memory database"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    return AsyncMongoMockClient()["tests"]
+
+
+@pytest.fixture(scope="session")
+async def server(anyio_backend):
+    """server.py on an in-memory database, started up and shut down once per session"""
+    from mongomock_motor import AsyncMongoMockClient
+    from pymongo.errors import OperationFailure
+
+    import server
+
+    db = AsyncMongoMockClient()["tests"]
+
+    # mongomock has no change streams; fail like a standalone mongod so the
+    # catalog cache polls instead
+    def watch(*args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+    object.__setattr__(db, "watch", watch)
+
+    server.db = db
+    for component in (server.sequences, server.catalog_cache, server.quote_history, server.job_queue,
+                      server.status_log):
+        component.db = db
+    for handler in server.app.router.on_startup:
+        await handler()
+    yield server
+    for handler in server.app.router.on_shutdown:
+        await handler()
+
+
+@pytest.fixture
+async def client(server):
+    import httpx
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def load_catalog(server):
+    """Replace the catalog with the given paper types and machines"""
+    async def load(paper_types, machines):
+        await server.db.paper_types.delete_many({})
+        await server.db.machines.delete_many({})
+        await server.db.paper_types.insert_many([dict(item) for item in paper_types])
+        await server.db.machines.insert_many([dict(item) for item in machines])
+        await server.sequences.sync("paper_types", server.db.paper_types)
+        await server.sequences.sync("machines", server.db.machines)
+        await server.catalog_cache.reload()
+    return load
@@ -0,0 +1,145 @@
+"""Brute-force references the quote engine is checked against.
+
+Everything here loops over the catalog one combination at a time in plain
+Python, so it shares no code with the vectorised engine besides job_parts.
+"""
+import math
+import random
+from functools import lru_cache
+
+from quote_engine import job_parts
+from quote_engine.imposition import PRODUCT_LAYOUT_DEPTH, SHEET_LAYOUT_DEPTH
+
+
+@lru_cache(maxsize=None)
+def block_count(width, height, a, b, depth):
+    """Items per sheet of the best block layout, searched exhaustively"""
+    if min(width, height, a, b) <= 0:
+        return 0
+    best = max(math.floor(width / a) * math.floor(height / b), math.floor(width / b) * math.floor(height / a))
+    if depth <= 1:
+        return best
+    for x, y in ((a, b), (b, a)):
+        per_column, per_row = math.floor(height / y), math.floor(width / x)
+        if per_column:
+            for k in range(1, per_row + 1):
+                best = max(best, k * per_column + block_count(width - k * x, height, a, b, depth - 1))
+        if per_row:
+            for k in range(1, per_column + 1):
+                best = max(best, k * per_row + block_count(width, height - k * y, a, b, depth - 1))
+    return best
+
+
+def random_catalog(seed, paper_types=3, machines=3, sizes=3):
+    """Paper types and machines with random prices and sheet sizes"""
+    rng = random.Random(seed)
+    papers = [{
+        "id": paper_id,
+        "name": f"Paper {paper_id}",
+        "gsm": rng.choice([80, 90, 115, 130, 170, 250, 300]),
+        "pricePerTon": round(rng.uniform(700, 1800), 2),
+        "stockSheetSizes": [{
+            "id": sheet_id,
+            "name": f"Stock {sheet_id}",
+            "width": rng.randrange(500, 1020, 10),
+            "height": rng.randrange(650, 1400, 10),
+            "unit": "mm",
+        } for sheet_id in range(1, sizes + 1)],
+    } for paper_id in range(1, paper_types + 1)]
+    presses = [{
+        "id": machine_id,
+        "name": f"Press {machine_id}",
+        "setupCost": round(rng.uniform(10, 60), 2),
+        "sheetsPerHour": rng.choice([2000, 5000, 8000]),
+        "setupMinutes": rng.choice([5, 15, 30]),
+        "printSheetSizes": [{
+            "id": sheet_id,
+            "name": f"Print {sheet_id}",
+            "width": rng.randrange(300, 720, 10),
+            "height": rng.randrange(420, 1020, 10),
+            "clickCost": round(rng.uniform(0.02, 0.2), 4),
+            "duplexSupport": rng.random() < 0.5,
+            "unit": "mm",
+        } for sheet_id in range(1, sizes + 1)],
+    } for machine_id in range(1, machines + 1)]
+    return papers, presses
+
+
+def part_candidates(paper_types, machines, part):
+    """Every feasible machine/print sheet/paper type/stock sheet combination of a part"""
+    candidates = []
+    for machine in machines:
+        for print_sheet in machine["printSheetSizes"]:
+            per_print_sheet = block_count(
+                max(print_sheet["width"] - part.margin_left - part.margin_right, 0),
+                max(print_sheet["height"] - part.margin_top - part.margin_bottom, 0),
+                part.width, part.height, PRODUCT_LAYOUT_DEPTH,
+            )
+            if per_print_sheet == 0:
+                continue
+            for paper_type in paper_types:
+                for stock_sheet in paper_type["stockSheetSizes"]:
+                    if print_sheet["width"] > stock_sheet["width"] or print_sheet["height"] > stock_sheet["height"]:
+                        continue
+                    per_stock_sheet = block_count(
+                        stock_sheet["width"], stock_sheet["height"],
+                        print_sheet["width"], print_sheet["height"], SHEET_LAYOUT_DEPTH,
+                    )
+                    print_sheets = math.ceil(part.units / per_print_sheet)
+                    stock_sheets = math.ceil(print_sheets / per_stock_sheet)
+                    stock_area = stock_sheet["width"] * stock_sheet["height"] / 1000000
+                    paper_weight = stock_area * paper_type["gsm"] * stock_sheets / 1000
+                    paper_cost = paper_weight / 1000 * paper_type["pricePerTon"]
+                    click_cost = print_sheets * print_sheet["clickCost"] * part.click_multiplier
+                    setup_cost = machine["setupCost"] if part.setup_required else 0
+                    total_cost = paper_cost + click_cost + setup_cost
+                    used_area = part.width * part.height / 1000000 * per_print_sheet * per_stock_sheet
+                    candidates.append({
+                        "machineId": machine["id"],
+                        "printSheetSizeId": print_sheet["id"],
+                        "paperTypeId": paper_type["id"],
+                        "stockSheetSizeId": stock_sheet["id"],
+                        "productsPerPrintSheet": per_print_sheet,
+                        "printSheetsNeeded": print_sheets,
+                        "printSheetsPerStockSheet": per_stock_sheet,
+                        "stockSheetsNeeded": stock_sheets,
+                        "paperCost": paper_cost,
+                        "clickCost": click_cost,
+                        "setupCost": setup_cost,
+                        "totalCost": total_cost,
+                        "costPerUnit": total_cost / part.quantity,
+                        "wastePercentage": (stock_area - used_area) / stock_area * 100,
+                    })
+    return candidates
+
+
+def quote(paper_types, machines, job):
+    """Candidates of every part of a job, cheapest first (ties by waste)"""
+    return {
+        part.name: sorted(
+            part_candidates(paper_types, machines, part),
+            key=lambda candidate: (candidate["totalCost"], candidate["wastePercentage"]),
+        )
+        for part in job_parts(job)
+    }
+
+
+def pareto(candidates):
+    """(totalCost, wastePercentage) points no other candidate matches or beats on both"""
+    points = sorted({(c["totalCost"], c["wastePercentage"]) for c in candidates})
+    return [
+        (cost, waste) for cost, waste in points
+        if not any(
+            other_cost <= cost and other_waste <= waste and (other_cost, other_waste) != (cost, waste)
+            for other_cost, other_waste in points
+        )
+    ]
+
+
+def combination(candidate):
+    """Catalog ids of a candidate, embedded or normalized"""
+    if "machine" in candidate:
+        return (candidate["machine"]["id"], candidate["printSheetSize"]["id"],
+                candidate["paperType"]["id"], candidate["stockSheetSize"]["id"])
+    return (candidate["machineId"], candidate["printSheetSizeId"],
+            candidate["paperTypeId"], candidate["stockSheetSizeId"])
@@ -0,0 +1,97 @@
+import itertools
+from dataclasses import replace
+
+import pytest
+
+from quote_engine import CatalogArrays, booklet_parts, optimize_booklet
+
+from tests.reference import part_candidates, random_catalog
+
+
+def exhaustive_booklet(paper_types, machines, parts):
+    """Cheapest total over every machine assignment of every part.
+
+    Once a part's machine is fixed its cheapest running candidate there is
+    optimal, as setup only depends on the machine; setup is charged once per
+    machine used by a part that requires it.
+    """
+    running = []
+    for part in parts:
+        cheapest = {}
+        for candidate in part_candidates(paper_types, machines, replace(part.spec, setup_required=False)):
+            if part.paper_type_id is not None and candidate["paperTypeId"] != part.paper_type_id:
+                continue
+            if part.machine_id is not None and candidate["machineId"] != part.machine_id:
+                continue
+            machine_id = candidate["machineId"]
+            cheapest[machine_id] = min(cheapest.get(machine_id, float("inf")), candidate["totalCost"])
+        running.append(cheapest)
+
+    setup = {machine["id"]: machine["setupCost"] for machine in machines}
+    best = float("inf")
+    for assignment in itertools.product(*(sorted(cheapest) for cheapest in running)):
+        charged = {machine_id for part, machine_id in zip(parts, assignment) if part.spec.setup_required}
+        cost = sum(cheapest[machine_id] for cheapest, machine_id in zip(running, assignment))
+        best = min(best, cost + sum(setup[machine_id] for machine_id in charged))
+    return best
+
+
+JOB = {"finalWidth": 148, "finalHeight": 210, "quantity": 150, "totalPages": 40, "isDoubleSided": True,
+       "setupRequired": True, "coverSetupRequired": True}
+
+INNER_CONFIGS = [
+    [],
+    [{"pageCount": 16}, {"pageCount": 20}],
+    [{"pageCount": 8}, {"pageCount": 12, "paperTypeId": 2}, {"pageCount": 16, "machineId": 3}],
+    [{"pageCount": 4}, {"pageCount": 4}, {"pageCount": 8}, {"pageCount": 20}],
+]
+
+
+@pytest.mark.parametrize("inner_configs", INNER_CONFIGS)
+@pytest.mark.parametrize("seed", range(6))
+def test_optimize_booklet_matches_exhaustive_search(seed, inner_configs):
+    paper_types, machines = random_catalog(seed, paper_types=3, machines=4, sizes=3)
+    for machine in machines:
+        machine["setupCost"] *= 4  # large enough that sharing a press matters
+    catalog = CatalogArrays(paper_types, machines)
+    parts = booklet_parts(JOB, inner_configs)
+
+    result = optimize_booklet(catalog, JOB, inner_configs)
+
+    assert result["optimal"]
+    assert result["totalCost"] == pytest.approx(exhaustive_booklet(paper_types, machines, parts))
+    assert result["totalCost"] == pytest.approx(sum(p["candidate"]["totalCost"] for p in result["parts"]))
+    assert result["setupCost"] == pytest.approx(sum(p["candidate"]["setupCost"] for p in result["parts"]))
+    used = sorted({p["candidate"]["machine"]["id"] for p in result["parts"]})
+    assert result["machinesUsed"] == used
+
+
+def test_optimize_booklet_respects_pinned_cover():
+    paper_types, machines = random_catalog(3, machines=4)
+    catalog = CatalogArrays(paper_types, machines)
+    parts = booklet_parts(JOB, [], cover_paper_type_id=1, cover_machine_id=2)
+
+    result = optimize_booklet(catalog, JOB, [], cover_paper_type_id=1, cover_machine_id=2)
+
+    cover = result["parts"][0]["candidate"]
+    assert (cover["paperType"]["id"], cover["machine"]["id"]) == (1, 2)
+    assert result["totalCost"] == pytest.approx(exhaustive_booklet(paper_types, machines, parts))
+
+
+def test_optimize_booklet_node_limit_returns_a_feasible_assignment():
+    paper_types, machines = random_catalog(1, machines=4)
+    catalog = CatalogArrays(paper_types, machines)
+    configs = INNER_CONFIGS[3]
+    optimum = exhaustive_booklet(paper_types, machines, booklet_parts(JOB, configs))
+
+    result = optimize_booklet(catalog, JOB, configs, max_nodes=1)
+
+    assert not result["optimal"]
+    assert result["totalCost"] >= optimum - 1e-9
+    assert len(result["parts"]) == 5
+
+
+def test_optimize_booklet_without_a_feasible_option():
+    paper_types, machines = random_catalog(0)
+    with pytest.raises(ValueError, match="innerPages"):
+        optimize_booklet(CatalogArrays(paper_types, machines), JOB, [{"pageCount": 8, "machineId": 99}])
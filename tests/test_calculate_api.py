@@ -0,0 +1,90 @@
+import pytest
+
+from tests.reference import combination, pareto, quote, random_catalog
+from tests.test_quote_engine import JOBS
+
+pytestmark = pytest.mark.anyio
+
+
+def expected_quote(server, paper_types, machines, job):
+    """Reference quote of the job as the endpoint sees it, model defaults (margins) applied"""
+    return quote(paper_types, machines, server.PrintJob(**job).dict())
+
+
+@pytest.mark.parametrize("job", JOBS)
+async def test_calculate_returns_the_cheapest_candidates(server, client, load_catalog, job):
+    paper_types, machines = random_catalog(7)
+    await load_catalog(paper_types, machines)
+    expected = expected_quote(server, paper_types, machines, job)
+
+    response = await client.post("/api/calculate", params={"limit": 5}, json=job)
+
+    assert response.status_code == 200
+    parts = response.json()["parts"]
+    assert [part["part"] for part in parts] == list(expected)
+    for part in parts:
+        reference = expected[part["part"]]
+        assert part["totalCandidates"] == len(reference)
+        assert [c["totalCost"] for c in part["candidates"]] == pytest.approx(
+            [c["totalCost"] for c in reference[:5]]
+        )
+        by_combination = {combination(c): c for c in reference}
+        for candidate in part["candidates"]:
+            assert candidate["totalCost"] == pytest.approx(by_combination[combination(candidate)]["totalCost"])
+
+
+async def test_calculate_pareto_selection(server, client, load_catalog):
+    paper_types, machines = random_catalog(10, paper_types=4, machines=4, sizes=4)
+    await load_catalog(paper_types, machines)
+    job = JOBS[1]
+    expected = pareto(expected_quote(server, paper_types, machines, job)["product"])
+
+    response = await client.post("/api/calculate", params={"selection": "pareto"}, json=job)
+
+    candidates = response.json()["parts"][0]["candidates"]
+    assert [(c["totalCost"], c["wastePercentage"]) for c in candidates] == pytest.approx(expected)
+
+
+async def test_calculate_normalized_shape_references_the_catalog(server, client, load_catalog):
+    paper_types, machines = random_catalog(8)
+    await load_catalog(paper_types, machines)
+    job = JOBS[4]
+    expected = expected_quote(server, paper_types, machines, job)
+
+    response = await client.post("/api/calculate", params={"limit": 3, "shape": "normalized"}, json=job)
+
+    body = response.json()
+    machine_ids = {machine["id"] for machine in body["machines"]}
+    paper_type_ids = {paper_type["id"] for paper_type in body["paperTypes"]}
+    for part in body["parts"]:
+        reference = {combination(c): c for c in expected[part["part"]]}
+        for candidate in part["candidates"]:
+            assert candidate["totalCost"] == pytest.approx(reference[combination(candidate)]["totalCost"])
+            assert candidate["machineId"] in machine_ids
+            assert candidate["paperTypeId"] in paper_type_ids
+
+
+async def test_calculate_sees_catalog_changes(server, client, load_catalog):
+    paper_types, machines = random_catalog(9)
+    await load_catalog(paper_types, machines)
+    job = JOBS[0]
+    before = (await client.post("/api/calculate", params={"limit": 1}, json=job)).json()
+
+    paper_types = [{**paper_type, "pricePerTon": paper_type["pricePerTon"] * 2} for paper_type in paper_types]
+    await load_catalog(paper_types, machines)
+    after = (await client.post("/api/calculate", params={"limit": 1}, json=job)).json()
+
+    assert after["catalogVersion"] > before["catalogVersion"]
+    assert after["parts"][0]["candidates"][0]["totalCost"] == pytest.approx(
+        expected_quote(server, paper_types, machines, job)["product"][0]["totalCost"]
+    )
+
+
+@pytest.mark.parametrize("job, params", [
+    ({"finalWidth": 0, "finalHeight": 55, "quantity": 10}, {}),
+    ({"finalWidth": 85, "finalHeight": 55, "quantity": -1}, {}),
+    ({"finalWidth": 85, "finalHeight": 55, "quantity": 10}, {"limit": 0}),
+])
+async def test_calculate_rejects_invalid_input(client, job, params):
+    response = await client.post("/api/calculate", params=params, json=job)
+    assert response.status_code == 422
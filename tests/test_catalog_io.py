@@ -0,0 +1,146 @@
+import pytest
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from catalog_io import bulk_upsert, ensure_name_index
+from sequences import SequenceAllocator
+
+pytestmark = pytest.mark.anyio
+
+DEFAULTS = {"gsm": 80, "pricePerTon": 1000, "stockSheetSizes": []}
+
+
+@pytest.fixture
+async def paper_types(db):
+    await db.paper_types.create_index("id", unique=True)
+    await ensure_name_index(db.paper_types)
+    return db.paper_types
+
+
+async def stored(collection):
+    return {doc["name"]: doc async for doc in collection.find({}, {"_id": 0})}
+
+
+async def test_bulk_upsert_inserts_new_names_and_updates_existing_ones(db, paper_types):
+    sequences = SequenceAllocator(db)
+    await paper_types.insert_one({"id": 1, "name": "A", "gsm": 90, "pricePerTon": 800, "version": 3})
+    await sequences.sync("paper_types", paper_types)
+
+    result = await bulk_upsert(
+        paper_types, [{"name": "B", "gsm": 120}, {"name": "A", "pricePerTon": 950}, {"name": "C"}],
+        sequences, "paper_types", DEFAULTS,
+    )
+
+    assert result == {"inserted": 2, "updated": 1, "ids": [2, 1, 3]}
+    items = await stored(paper_types)
+    assert items["A"] == {"id": 1, "name": "A", "gsm": 90, "pricePerTon": 950, "version": 4}
+    assert items["B"] == {"id": 2, "name": "B", "gsm": 120, "pricePerTon": 1000, "stockSheetSizes": [], "version": 1}
+    assert items["C"]["gsm"] == 80
+
+
+async def test_bulk_upsert_reports_the_id_of_a_name_inserted_concurrently(db, paper_types):
+    class RacingSequences(SequenceAllocator):
+        """Another import inserts "Race" after this one looked the names up"""
+        async def reserve(self, name, count):
+            ids = await super().reserve(name, count)
+            (other_id,) = await super().reserve(name, 1)
+            await paper_types.insert_one({"id": other_id, "name": "Race", "gsm": 100, "version": 1})
+            return ids
+
+    result = await bulk_upsert(
+        paper_types, [{"name": "New"}, {"name": "Race", "gsm": 170}], RacingSequences(db), "paper_types", DEFAULTS,
+    )
+
+    items = await stored(paper_types)
+    assert await paper_types.count_documents({"name": "Race"}) == 1
+    assert result["ids"] == [items["New"]["id"], items["Race"]["id"]]
+    assert items["Race"]["gsm"] == 170
+    assert items["Race"]["version"] == 2
+
+
+async def test_bulk_upsert_retries_writes_that_lose_the_insert_race(db, paper_types):
+    await paper_types.insert_one({"id": 40, "name": "Race", "gsm": 100, "version": 1})
+    write = paper_types.bulk_write
+    calls = []
+
+    async def bulk_write(operations, ordered=True):
+        """The first write fails on the name index like a concurrent insert would"""
+        calls.append(len(operations))
+        if len(calls) > 1:
+            return await write(operations, ordered=ordered)
+        await write(operations[:1], ordered=False)
+        raise BulkWriteError({
+            "writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key", "keyPattern": {"name": 1}}],
+            "nUpserted": 1, "nMatched": 0, "upserted": [{"index": 0, "_id": None}],
+        })
+    object.__setattr__(paper_types, "bulk_write", bulk_write)
+
+    result = await bulk_upsert(
+        paper_types, [{"name": "New"}, {"name": "Race", "gsm": 250}], SequenceAllocator(db), "paper_types", DEFAULTS,
+    )
+
+    assert calls == [2, 1]
+    assert result == {"inserted": 1, "updated": 1, "ids": [1, 40]}
+    assert (await paper_types.find_one({"name": "Race"}))["gsm"] == 250
+
+
+async def test_bulk_upsert_raises_other_write_errors(db, paper_types):
+    await paper_types.insert_one({"id": 2, "name": "Taken"})
+    sequences = SequenceAllocator(db)  # out of sync: hands out id 2 again
+
+    with pytest.raises(BulkWriteError) as error:
+        await bulk_upsert(paper_types, [{"name": "X"}, {"name": "Y"}], sequences, "paper_types", DEFAULTS)
+
+    assert [write_error["index"] for write_error in error.value.details["writeErrors"]] == [1]
+
+
+async def test_ensure_name_index_is_unique(db):
+    await ensure_name_index(db.machines)
+
+    assert (await db.machines.index_information())["name_1"].get("unique")
+
+
+async def test_ensure_name_index_keeps_existing_duplicates_with_a_plain_index(db, caplog):
+    await db.machines.insert_many([{"name": "A"}, {"name": "A"}, {"name": "B"}])
+
+    await ensure_name_index(db.machines)
+
+    assert not (await db.machines.index_information())["name_1"].get("unique")
+    assert "duplicate names ['A']" in caplog.text
+
+
+async def test_ensure_name_index_replaces_a_plain_index(db):
+    machines = db.machines
+    await machines.create_index("name")
+    create_index = machines.create_index
+
+    async def conflicting_create_index(keys, **kwargs):
+        # mongomock reports the option conflict without the server's error code
+        try:
+            return await create_index(keys, **kwargs)
+        except OperationFailure as error:
+            raise OperationFailure(str(error), 85)
+    object.__setattr__(machines, "create_index", conflicting_create_index)
+
+    await ensure_name_index(machines)
+
+    assert (await machines.index_information())["name_1"].get("unique")
+
+
+async def test_bulk_import_endpoint_rejects_malformed_bodies(client):
+    for headers, body in (
+        ({"content-type": "application/json"}, b"not json"),
+        ({"content-type": "text/csv"}, b"name,gsm\n\xff\xfe,80\n"),
+        ({"content-type": "application/json"}, b"{}"),
+    ):
+        response = await client.post("/api/paper-types/bulk", content=body, headers=headers)
+        assert response.status_code == 422
+
+
+async def test_create_with_a_taken_name_conflicts(client):
+    paper_type = {"name": "Unique name test", "gsm": 80, "pricePerTon": 900, "stockSheetSizes": []}
+    assert (await client.post("/api/paper-types", json=paper_type)).status_code == 200
+
+    response = await client.post("/api/paper-types", json=paper_type)
+
+    assert response.status_code == 409
+
@@ -0,0 +1,226 @@
+import math
+import random
+import time
+
+import pytest
+
+from quote_engine import CatalogArrays, plan_gang_runs
+from quote_engine.engine import PartSpec
+from quote_engine.gang import GangJob, SheetPair, build_runs, improve_runs, pack
+from quote_engine.imposition import PRODUCT_LAYOUT_DEPTH
+
+from tests.reference import block_count, random_catalog
+
+SIZES = [(90, 50), (85, 55), (100, 100), (105, 148), (148, 210), (210, 297)]
+QUANTITIES = [50, 100, 250, 500, 1000]
+
+
+def gang_jobs(seed, count):
+    """A random pair and jobs priced alone on it, with their items per sheet"""
+    rng = random.Random(seed)
+    pair = SheetPair(
+        print_row=0,
+        stock_row=0,
+        width=rng.choice([320, 450, 700]),
+        height=rng.choice([450, 640, 1000]),
+        margin_left=5,
+        margin_top=5,
+        click_cost=round(rng.uniform(0.02, 0.2), 4),
+        print_sheets_per_stock_sheet=rng.choice([1, 2, 4]),
+        stock_sheet_cost=round(rng.uniform(0.05, 0.5), 3),
+        setup_cost=round(rng.uniform(10, 60), 2),
+    )
+    jobs, yields = {}, {}
+    for index in range(count):
+        width, height = rng.choice(SIZES)
+        quantity = rng.choice(QUANTITIES)
+        part = PartSpec("Flat", width, height, 0, 0, 0, 0, quantity, quantity, rng.choice([1, 2]), rng.random() < 0.8)
+        yields[index] = block_count(pair.width, pair.height, width, height, PRODUCT_LAYOUT_DEPTH)
+        print_sheets = math.ceil(quantity / yields[index])
+        stock_sheets = math.ceil(print_sheets / pair.print_sheets_per_stock_sheet)
+        paper_cost = stock_sheets * pair.stock_sheet_cost
+        click_cost = print_sheets * pair.click_cost
+        setup_cost = pair.setup_cost if part.setup_required else 0.0
+        jobs[index] = GangJob(
+            index, {}, part, 0, 0, yields[index], pair.print_sheets_per_stock_sheet, print_sheets, stock_sheets,
+            paper_cost, click_cost, setup_cost, paper_cost + click_cost + setup_cost,
+        )
+    return pair, jobs, yields
+
+
+def run_cost(pair, jobs, slots):
+    print_sheets = max(math.ceil(jobs[index].quantity / count) for index, count in slots.items())
+    stock_sheets = math.ceil(print_sheets / pair.print_sheets_per_stock_sheet)
+    setup = any(jobs[index].part.setup_required for index in slots)
+    return stock_sheets * pair.stock_sheet_cost + print_sheets * pair.click_cost + (pair.setup_cost if setup else 0.0)
+
+
+def partitions(indexes):
+    if not indexes:
+        yield []
+        return
+    first, rest = indexes[0], indexes[1:]
+    for partition in partitions(rest):
+        yield [[first]] + partition
+        for position in range(len(partition)):
+            yield partition[:position] + [[first] + partition[position]] + partition[position + 1:]
+
+
+def cheapest_plan(pair, jobs, yields):
+    """Lowest total over every partition of the jobs into runs and every run length.
+
+    A run is feasible when the shelf packer places the slots it needs, so
+    this is the optimum over the layouts the planner can build.
+    """
+    def group_cost(group):
+        best = sum(jobs[index].total_cost for index in group)
+        if len(group) < 2:
+            return best
+        seen = set()
+        for run_length in range(1, max(jobs[index].quantity for index in group) + 1):
+            slots = {index: math.ceil(jobs[index].quantity / run_length) for index in group}
+            key = tuple(slots.values())
+            if key in seen or any(slots[index] > yields[index] for index in group):
+                continue
+            seen.add(key)
+            items = [(index, jobs[index].part.width, jobs[index].part.height, count) for index, count in slots.items()]
+            if pack(pair.width, pair.height, items) is not None:
+                best = min(best, run_cost(pair, jobs, slots))
+        return best
+
+    costs = {}
+    best = math.inf
+    for partition in partitions(sorted(jobs)):
+        total = 0.0
+        for group in partition:
+            key = tuple(sorted(group))
+            if key not in costs:
+                costs[key] = group_cost(key)
+            total += costs[key]
+        best = min(best, total)
+    return best
+
+
+def plan_cost(jobs, runs, alone):
+    return sum(run.cost(jobs) for run in runs) + sum(jobs[index].total_cost for index in alone)
+
+
+def assert_valid(pair, jobs, runs, alone):
+    planned = sorted([index for run in runs for index in run.slots] + list(alone))
+    assert planned == sorted(jobs)
+    for run in runs:
+        assert len(run.slots) >= 1
+        assert run.cost(jobs) == pytest.approx(run_cost(pair, jobs, run.slots))
+        items = {index: 0 for index in run.slots}
+        boxes = []
+        for index, x, y, width, height, columns in run.layout.placements:
+            assert {width, height} == {jobs[index].part.width, jobs[index].part.height}
+            assert x >= 0 and y >= 0
+            assert x + columns * width <= pair.width + 1e-9 and y + height <= pair.height + 1e-9
+            items[index] += columns
+            boxes.append((x, y, x + columns * width, y + height))
+        assert items == run.slots
+        for i, a in enumerate(boxes):
+            for b in boxes[i + 1:]:
+                overlap = min(a[2], b[2]) - max(a[0], b[0]), min(a[3], b[3]) - max(a[1], b[1])
+                assert min(overlap) <= 1e-9
+
+
+def plan(pair, jobs, yields):
+    deadline = time.perf_counter() + 60
+    runs, alone = build_runs(pair, jobs, sorted(jobs), yields, deadline)
+    greedy = plan_cost(jobs, runs, alone)
+    finished, alone = improve_runs(pair, jobs, runs, alone, yields, deadline)
+    assert finished
+    return greedy, runs, alone
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_runs_are_valid_and_between_the_optimum_and_printing_alone(seed):
+    pair, jobs, yields = gang_jobs(seed, 5)
+    optimum = cheapest_plan(pair, jobs, yields)
+
+    greedy, runs, alone = plan(pair, jobs, yields)
+
+    assert_valid(pair, jobs, runs, alone)
+    total = plan_cost(jobs, runs, alone)
+    assert optimum - 1e-9 <= total <= greedy + 1e-9
+    assert greedy <= sum(job.total_cost for job in jobs.values()) + 1e-9
+
+
+def test_improve_runs_gets_close_to_the_optimum():
+    gaps = []
+    for seed in range(40):
+        pair, jobs, yields = gang_jobs(seed, 5)
+        _, runs, alone = plan(pair, jobs, yields)
+        gaps.append(plan_cost(jobs, runs, alone) / cheapest_plan(pair, jobs, yields) - 1)
+
+    assert sum(gap < 1e-6 for gap in gaps) >= 20
+    assert sum(gaps) / len(gaps) < 0.05
+
+
+def test_improve_runs_takes_a_job_out_of_a_run():
+    # Job 1 needs no setup and only shortens the run when left out
+    pair = SheetPair(0, 0, 450, 450, 5, 5, 0.0231, 2, 0.241, 36.5)
+    _, jobs, yields = gang_jobs(0, 0)
+    for index, (width, height, quantity, setup) in enumerate([
+        (148, 210, 100, True), (148, 210, 1000, False), (90, 50, 50, True), (100, 100, 500, True),
+        (148, 210, 50, True),
+    ]):
+        part = PartSpec("Flat", width, height, 0, 0, 0, 0, quantity, quantity, 1, setup)
+        yields[index] = block_count(pair.width, pair.height, width, height, PRODUCT_LAYOUT_DEPTH)
+        print_sheets = math.ceil(quantity / yields[index])
+        stock_sheets = math.ceil(print_sheets / 2)
+        paper_cost, click_cost = stock_sheets * pair.stock_sheet_cost, print_sheets * pair.click_cost
+        setup_cost = pair.setup_cost if setup else 0.0
+        jobs[index] = GangJob(index, {}, part, 0, 0, yields[index], 2, print_sheets, stock_sheets, paper_cost,
+                              click_cost, setup_cost, paper_cost + click_cost + setup_cost)
+
+    greedy, runs, alone = plan(pair, jobs, yields)
+
+    assert 1 in alone
+    assert plan_cost(jobs, runs, alone) < greedy
+    assert plan_cost(jobs, runs, alone) == pytest.approx(cheapest_plan(pair, jobs, yields))
+
+
+def test_past_deadline_keeps_the_plan_so_far():
+    pair, jobs, yields = gang_jobs(7, 5)
+
+    runs, alone = build_runs(pair, jobs, sorted(jobs), yields, time.perf_counter() - 1)
+    assert runs == [] and sorted(alone) == sorted(jobs)
+
+    runs, alone = build_runs(pair, jobs, sorted(jobs), yields, time.perf_counter() + 60)
+    greedy = plan_cost(jobs, runs, alone)
+    finished, alone = improve_runs(pair, jobs, runs, alone, yields, time.perf_counter() - 1)
+    assert not finished
+    assert plan_cost(jobs, runs, alone) == pytest.approx(greedy)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_plan_gang_runs_covers_every_job(seed):
+    paper_types, machines = random_catalog(seed)
+    rng = random.Random(seed)
+    jobs = [{
+        "finalWidth": width,
+        "finalHeight": height,
+        "quantity": rng.choice(QUANTITIES),
+        "isDoubleSided": rng.random() < 0.5,
+        "setupRequired": True,
+    } for width, height in rng.choices(SIZES, k=12)]
+    jobs.append({"finalWidth": 5000, "finalHeight": 5000, "quantity": 10})
+
+    result = plan_gang_runs(CatalogArrays(paper_types, machines), jobs, time_budget=30)
+
+    assert not result["timedOut"]
+    assert result["unplanned"] == [12]
+    produced = {}
+    for run in result["runs"]:
+        for job in run["jobs"]:
+            assert job["job"] not in produced
+            produced[job["job"]] = job["produced"]
+            assert job["produced"] == job["slots"] * run["printSheets"]
+    assert sorted(produced) == list(range(12))
+    assert all(produced[index] >= jobs[index]["quantity"] for index in produced)
+    assert result["totalCost"] == pytest.approx(sum(run["totalCost"] for run in result["runs"]))
+    assert result["totalCost"] <= result["standaloneCost"] + 1e-9
+    assert result["savings"] == pytest.approx(result["standaloneCost"] - result["totalCost"])
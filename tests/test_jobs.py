@@ -0,0 +1,179 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from jobs import CANCELLED, COMPLETED, FAILED, RUNNING, JobQueue
+
+pytestmark = pytest.mark.anyio
+
+LEASE = 0.3
+
+
+async def wait_for(queue, job_id, *statuses, timeout=5):
+    """The job document once it reaches one of `statuses`"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = await queue.jobs.find_one({"id": job_id})
+        if job["status"] in statuses:
+            return job
+        assert asyncio.get_running_loop().time() < deadline, f"job still {job['status']}"
+        await asyncio.sleep(0.02)
+
+
+class Gate:
+    """A handler that reads its inputs, then waits until released"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.runs = []
+
+    async def __call__(self, context):
+        items = [item async for chunk in context.inputs() for item in chunk]
+        self.runs.append(context.queue.owner)
+        self.started.set()
+        await self.release.wait()
+        await context.write_results([{"item": item} for item in items])
+        await context.progress(len(items), len(items), force=True)
+        return {"items": len(items), "owner": context.queue.owner}
+
+
+@pytest.fixture
+async def queues(db):
+    """Two job queues on one database, as on two replicas; stopped after the test"""
+    started = []
+
+    async def make(handler, start=True):
+        queue = JobQueue(db, workers=1, lease_seconds=LEASE, input_chunk_size=3)
+        queue.register("gate", handler)
+        if start:
+            await queue.start()
+        started.append(queue)
+        return queue
+    yield make
+    for queue in started:
+        await queue.stop()
+
+
+async def test_job_runs_with_its_inputs_and_writes_results(queues):
+    gate = Gate()
+    gate.release.set()
+    queue = await queues(gate)
+
+    job = await queue.submit("gate", {"x": 1}, list(range(10)))
+    done = await wait_for(queue, job["id"], COMPLETED)
+
+    assert done["summary"] == {"items": 10, "owner": queue.owner}
+    assert done["progress"] == 1.0
+    assert done["owner"] is None and done["leaseUntil"] is None
+    rows = await queue.result_rows(job["id"])
+    assert [row["item"] for row in rows] == list(range(10))
+    assert [row["index"] for row in await queue.result_rows(job["id"], after=6)] == [7, 8, 9]
+    assert await queue.inputs.count_documents({"jobId": job["id"]}) == 0
+
+
+async def test_submit_rejects_unknown_kinds(queues):
+    queue = await queues(Gate(), start=False)
+    with pytest.raises(ValueError):
+        await queue.submit("other", {})
+
+
+async def test_cancel_a_queued_job_discards_its_inputs(queues):
+    queue = await queues(Gate(), start=False)
+    job = await queue.submit("gate", {}, [1, 2, 3, 4])
+
+    cancelled = await queue.cancel(job["id"])
+
+    assert cancelled["status"] == CANCELLED
+    assert await queue.inputs.count_documents({"jobId": job["id"]}) == 0
+    assert await queue.cancel("missing") is None
+
+
+async def test_cancel_a_running_job(queues):
+    gate = Gate()
+    queue = await queues(gate)
+    job = await queue.submit("gate", {}, [1])
+    await gate.started.wait()
+
+    cancelled = await queue.cancel(job["id"])
+
+    assert cancelled["status"] == CANCELLED
+    assert cancelled["owner"] is None
+
+
+async def test_failing_handler_marks_the_job_failed(queues):
+    async def broken(context):
+        raise RuntimeError("no paper")
+    queue = await queues(broken)
+
+    job = await queue.submit("gate", {})
+    failed = await wait_for(queue, job["id"], FAILED)
+
+    assert failed["error"] == "no paper"
+
+
+async def test_a_live_lease_is_not_taken_over(queues):
+    gate = Gate()
+    first = await queues(gate)
+    job = await first.submit("gate", {}, [1, 2])
+    await gate.started.wait()
+
+    second = await queues(gate)
+    await asyncio.sleep(LEASE * 3)  # several heartbeats and reaper passes
+    gate.release.set()
+    done = await wait_for(first, job["id"], COMPLETED)
+
+    assert gate.runs == [first.owner]
+    assert done["summary"]["owner"] == first.owner
+    assert second.owner != first.owner
+
+
+async def test_the_job_of_a_stopped_replica_is_taken_over_after_its_lease(queues):
+    gate = Gate()
+    first = await queues(gate)
+    job = await first.submit("gate", {}, [1, 2, 3, 4])
+    await gate.started.wait()
+    await first.stop()
+    assert (await first.jobs.find_one({"id": job["id"]}))["status"] == RUNNING
+
+    second = await queues(gate)
+    gate.release.set()
+    done = await wait_for(second, job["id"], COMPLETED)
+
+    assert done["summary"] == {"items": 4, "owner": second.owner}
+    assert [row["item"] for row in await second.result_rows(job["id"])] == [1, 2, 3, 4]
+
+
+async def test_a_runner_that_loses_its_lease_writes_nothing(queues):
+    gate = Gate()
+    queue = await queues(gate)
+    job = await queue.submit("gate", {}, [1])
+    await gate.started.wait()
+
+    # Another replica takes the job over and keeps its lease alive
+    await queue.jobs.update_one({"id": job["id"]}, {"$set": {
+        "owner": "other replica", "leaseUntil": datetime.utcnow() + timedelta(minutes=1),
+    }})
+    await asyncio.sleep(LEASE)  # the next heartbeat finds the lease gone
+    gate.release.set()
+    await asyncio.sleep(0.1)
+
+    stolen = await queue.jobs.find_one({"id": job["id"]})
+    assert (stolen["status"], stolen["owner"], stolen["summary"]) == (RUNNING, "other replica", None)
+    assert await queue.result_rows(job["id"]) == []
+    assert gate.runs == [queue.owner]
+
+
+async def test_running_jobs_without_a_lease_are_run_again_on_start(db, queues):
+    await db.jobs.insert_one({
+        "id": "legacy", "kind": "gate", "params": {}, "status": RUNNING, "progress": 0.5,
+        "createdAt": datetime.utcnow(), "summary": None,
+    })
+    gate = Gate()
+    gate.release.set()
+
+    queue = await queues(gate)
+    done = await wait_for(queue, "legacy", COMPLETED)
+
+    assert done["summary"]["owner"] == queue.owner
@@ -0,0 +1,139 @@
+import dataclasses
+
+import numpy as np
+import pytest
+
+from quote_engine import CandidateTable, CatalogArrays, pareto_front, quote_job, rank
+
+from tests.reference import combination, pareto, quote, random_catalog
+
+JOBS = [
+    {"finalWidth": 85, "finalHeight": 55, "quantity": 1000},
+    {"finalWidth": 210, "finalHeight": 297, "quantity": 2500, "isDoubleSided": True, "setupRequired": True},
+    {"finalWidth": 148, "finalHeight": 210, "quantity": 750,
+     "marginTop": 5, "marginRight": 3, "marginBottom": 5, "marginLeft": 3},
+    {"finalWidth": 99, "finalHeight": 210, "quantity": 333, "setupRequired": True},
+    {"finalWidth": 148, "finalHeight": 210, "quantity": 200, "isBookletMode": True, "totalPages": 24,
+     "coverSetupRequired": True},
+    {"finalWidth": 210, "finalHeight": 210, "quantity": 120, "isBookletMode": True, "totalPages": 10,
+     "bindingEdge": "long", "isDoubleSided": True},
+    {"finalWidth": 2000, "finalHeight": 3000, "quantity": 10},
+]
+
+COMPARED = ("productsPerPrintSheet", "printSheetsNeeded", "printSheetsPerStockSheet", "stockSheetsNeeded",
+            "paperCost", "clickCost", "setupCost", "totalCost", "costPerUnit", "wastePercentage")
+
+
+def assert_matches(candidate, expected):
+    for key in COMPARED:
+        assert candidate[key] == pytest.approx(expected[key]), key
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("job", JOBS)
+def test_quote_job_prices_every_combination(seed, job):
+    paper_types, machines = random_catalog(seed)
+    expected = quote(paper_types, machines, job)
+
+    parts = quote_job(CatalogArrays(paper_types, machines), job)
+
+    assert [part["part"] for part in parts] == list(expected)
+    for part in parts:
+        reference = {combination(candidate): candidate for candidate in expected[part["part"]]}
+        assert part["totalCandidates"] == len(reference)
+        assert sorted(map(combination, part["candidates"])) == sorted(reference)
+        for candidate in part["candidates"]:
+            assert_matches(candidate, reference[combination(candidate)])
+        costs = [(c["totalCost"], c["wastePercentage"]) for c in part["candidates"]]
+        assert costs == sorted(costs)
+
+
+@pytest.mark.parametrize("limit", [1, 3, 10])
+@pytest.mark.parametrize("seed", range(4))
+def test_quote_job_limit_keeps_the_cheapest(seed, limit):
+    paper_types, machines = random_catalog(seed, paper_types=4, machines=4, sizes=4)
+    job = JOBS[1]
+    expected = quote(paper_types, machines, job)["product"]
+
+    (part,) = quote_job(CatalogArrays(paper_types, machines), job, limit=limit)
+
+    assert part["totalCandidates"] == len(expected)
+    assert [c["totalCost"] for c in part["candidates"]] == pytest.approx(
+        [c["totalCost"] for c in expected[:limit]]
+    )
+
+
+def candidate_table(total_cost, waste_percentage):
+    """A table with only the cost and waste columns filled in; print_index numbers the rows"""
+    rows = len(total_cost)
+    columns = {field.name: np.zeros(rows) for field in dataclasses.fields(CandidateTable) if field.name != "part"}
+    columns.update(
+        print_index=np.arange(rows),
+        total_cost=np.asarray(total_cost, dtype=float),
+        waste_percentage=np.asarray(waste_percentage, dtype=float),
+    )
+    return CandidateTable(part=None, **columns)
+
+
+def random_table(seed, rows):
+    rng = np.random.default_rng(seed)
+    # Few distinct values, so ties on cost and on waste are common
+    return candidate_table(rng.integers(0, 20, rows) / 4, rng.integers(0, 30, rows) * 1.5)
+
+
+def ordered_rows(table):
+    """Reference ranking: (total cost, waste) ascending"""
+    return sorted(range(len(table)), key=lambda row: (table.total_cost[row], table.waste_percentage[row]))
+
+
+@pytest.mark.parametrize("limit", [None, 0, 1, 5, 50, 500])
+@pytest.mark.parametrize("seed", range(5))
+def test_rank_orders_by_cost_then_waste(seed, limit):
+    table = random_table(seed, 200)
+    expected = ordered_rows(table)[:limit]
+
+    ranked = rank(table, limit)
+
+    keys = list(zip(ranked.total_cost, ranked.waste_percentage))
+    assert keys == [(table.total_cost[row], table.waste_percentage[row]) for row in expected]
+    assert len(set(ranked.print_index.tolist())) == len(ranked)
+
+
+def test_rank_empty_table():
+    assert len(rank(candidate_table([], []), 3)) == 0
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_pareto_front_keeps_the_non_dominated_points(seed):
+    table = random_table(seed, 300)
+    candidates = [
+        {"totalCost": cost, "wastePercentage": waste}
+        for cost, waste in zip(table.total_cost, table.waste_percentage)
+    ]
+
+    front = pareto_front(table)
+
+    assert list(zip(front.total_cost, front.waste_percentage)) == pareto(candidates)
+    assert all(np.diff(front.waste_percentage) < 0)
+
+
+def test_pareto_front_limit_and_empty_table():
+    table = candidate_table([1, 2, 3, 4], [40, 30, 20, 10])
+    assert pareto_front(table, limit=2).total_cost.tolist() == [1, 2]
+    assert len(pareto_front(candidate_table([], []))) == 0
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("job", JOBS[:6])
+def test_quote_job_pareto_selection(seed, job):
+    paper_types, machines = random_catalog(seed, paper_types=4, machines=4, sizes=4)
+    expected = quote(paper_types, machines, job)
+
+    parts = quote_job(CatalogArrays(paper_types, machines), job, selection="pareto")
+
+    for part in parts:
+        points = [(c["totalCost"], c["wastePercentage"]) for c in part["candidates"]]
+        reference = pareto(expected[part["part"]])
+        assert len(points) == len(reference)
+        for point, reference_point in zip(points, reference):
+            assert point == pytest.approx(reference_point)
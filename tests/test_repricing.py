@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from repricing import price_changes, reprice_part
+
+from tests.reference import combination, quote, random_catalog
+
+pytestmark = pytest.mark.anyio
+
+QUOTED_JOBS = [
+    ({"finalWidth": 85, "finalHeight": 55, "quantity": 1000}, {}),
+    ({"finalWidth": 210, "finalHeight": 297, "quantity": 2500, "isDoubleSided": True, "setupRequired": True}, {}),
+    ({"finalWidth": 148, "finalHeight": 210, "quantity": 750, "setupRequired": True}, {"product": {"machineId": 2}}),
+    ({"finalWidth": 99, "finalHeight": 210, "quantity": 5000}, {"product": {"paperTypeId": 1}}),
+    ({"finalWidth": 148, "finalHeight": 210, "quantity": 300, "isBookletMode": True, "totalPages": 24,
+      "setupRequired": True, "coverSetupRequired": True}, {}),
+    ({"finalWidth": 105, "finalHeight": 148, "quantity": 40000, "setupRequired": True}, {}),
+    # Only the cover is pinned: the inner pages may move to a paper or press that got cheaper
+    ({"finalWidth": 148, "finalHeight": 210, "quantity": 300, "isBookletMode": True, "totalPages": 24},
+     {"cover": {"paperTypeId": 1}}),
+    ({"finalWidth": 148, "finalHeight": 210, "quantity": 300, "isBookletMode": True, "totalPages": 24},
+     {"cover": {"machineId": 1}}),
+]
+
+
+def cheapest_total(server, paper_types, machines, job, selections):
+    """Reference: the sum over parts of the cheapest candidate allowed by the selections"""
+    total = 0
+    for name, candidates in quote(paper_types, machines, server.PrintJob(**job).dict()).items():
+        selection = selections.get(name, {})
+        allowed = [
+            candidate for candidate in candidates
+            if all(candidate[key] == value for key, value in selection.items())
+        ]
+        total += allowed[0]["totalCost"]
+    return total
+
+
+def editable(item):
+    return {key: value for key, value in item.items() if key not in ("id", "version")}
+
+
+async def wait_for_job(server, job_id):
+    for _ in range(500):
+        job = await server.job_queue.get(job_id)
+        if job["status"] in ("completed", "failed", "cancelled"):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError("reprice job did not finish")
+
+
+@pytest.mark.parametrize("seed", [1, 21])
+@pytest.mark.parametrize("change", [
+    ("paperType", 1, lambda item: {**item, "pricePerTon": item["pricePerTon"] * 1.01}),
+    ("paperType", 2, lambda item: {**item, "pricePerTon": item["pricePerTon"] * 3}),
+    ("paperType", 3, lambda item: {**item, "pricePerTon": item["pricePerTon"] * 0.4}),
+    ("paperType", 1, lambda item: {**item, "pricePerTon": item["pricePerTon"] * 0.3}),
+    ("machine", 1, lambda item: {**item, "setupCost": item["setupCost"] + 0.5}),
+    ("machine", 2, lambda item: {**item, "setupCost": item["setupCost"] * 20}),
+    ("machine", 1, lambda item: {**item, "printSheetSizes": [
+        {**sheet, "clickCost": sheet["clickCost"] * 0.1} for sheet in item["printSheetSizes"]
+    ]}),
+    ("machine", 3, lambda item: {**item, "printSheetSizes": [
+        {**sheet, "clickCost": sheet["clickCost"] * factor}
+        for sheet, factor in zip(item["printSheetSizes"], (1.02, 0.3, 4))
+    ]}),
+])
+async def test_saved_quotes_match_a_fresh_search_after_a_price_change(server, client, load_catalog, change, seed):
+    target, entity_id, edit = change
+    paper_types, machines = random_catalog(seed, paper_types=3, machines=3, sizes=3)
+    await load_catalog(paper_types, machines)
+    await server.quote_history.quotes.delete_many({})
+    saved = []
+    for job, selections in QUOTED_JOBS:
+        response = await client.post("/api/quotes", json={"job": job, "selections": selections})
+        assert response.status_code == 200
+        saved.append((response.json()["id"], job, selections, response.json()))
+
+    ids_key = "paperTypeIds" if target == "paperType" else "machineIds"
+    items = paper_types if target == "paperType" else machines
+    index = next(i for i, item in enumerate(items) if item["id"] == entity_id)
+    items[index] = {**edit(items[index]), "id": entity_id}
+    path = "paper-types" if target == "paperType" else "machines"
+    response = await client.put(f"/api/{path}/{entity_id}", json=editable(items[index]))
+    assert response.status_code == 200
+    job = await wait_for_job(server, response.headers["X-Reprice-Job"])
+
+    assert job["status"] == "completed"
+    for quote_id, quoted_job, selections, before in saved:
+        stored = await server.quote_history.get(quote_id)
+        if entity_id in before[ids_key]:
+            expected = cheapest_total(server, paper_types, machines, quoted_job, selections)
+        else:
+            # Only the quotes using the changed entity are re-priced
+            expected = before["totalCost"]
+        assert stored["totalCost"] == pytest.approx(expected), quoted_job
+        assert stored["totalCost"] == pytest.approx(sum(part["totalCost"] for part in stored["parts"]))
+
+def test_price_changes():
+    paper = {"pricePerTon": 1000, "gsm": 80, "stockSheetSizes": [{"id": 1, "width": 700, "height": 1000}]}
+    assert price_changes("paperType", paper, {**paper, "pricePerTon": 1100}) == [
+        {"field": "pricePerTon", "old": 1000, "new": 1100},
+    ]
+    assert price_changes("paperType", paper, {**paper, "gsm": 90}) == [{"field": "structure"}]
+    assert price_changes("paperType", paper, None) == [{"field": "structure"}]
+    assert price_changes("paperType", paper, dict(paper)) == []
+
+    sheet = {"id": 1, "width": 320, "height": 450, "clickCost": 0.1, "duplexSupport": True}
+    machine = {"setupCost": 30, "printSheetSizes": [sheet]}
+    assert price_changes("machine", machine, {**machine, "printSheetSizes": [{**sheet, "clickCost": 0.2}]}) == [
+        {"field": "clickCost", "sheetId": 1, "old": 0.1, "new": 0.2},
+    ]
+    assert price_changes("machine", machine, {**machine, "printSheetSizes": [{**sheet, "duplexSupport": False}]}) == [
+        {"field": "structure"},
+    ]
+
+
+def test_reprice_part_within_and_beyond_the_sensitivity_range():
+    part = {
+        "paperTypeId": 1, "machineId": 1, "printSheetSizeId": 1,
+        "paperWeight": 2.0, "paperCost": 2.0, "clickCost": 5.0, "setupCost": 0.0, "totalCost": 7.0,
+        "printSheetsNeeded": 50, "clickMultiplier": 1,
+        "sensitivity": {"pricePerTonUp": 100.0, "pricePerTonDown": None, "clickCostUp": 0.0, "setupCostUp": 0.0},
+    }
+    change = {"field": "pricePerTon", "old": 1000, "new": 1050}
+
+    repriced = reprice_part(part, "paperType", 1, [change], False, 100)
+
+    assert repriced["paperCost"] == pytest.approx(2.1)
+    assert repriced["totalCost"] == pytest.approx(7.1)
+    assert repriced["sensitivity"]["pricePerTonUp"] == pytest.approx(50.0)
+    assert reprice_part(part, "paperType", 1, [{**change, "new": 1200}], False, 100) is None
+    assert reprice_part(part, "paperType", 2, [change], False, 100) is part
+    # Another paper got cheaper: it may now beat this part's option
+    assert reprice_part(part, "paperType", 2, [{**change, "new": 900}], False, 100) is None
+    # Stored cost not priced at the old price: search again
+    assert reprice_part({**part, "paperCost": 3.0}, "paperType", 1, [change], False, 100) is None
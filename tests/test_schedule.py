@@ -0,0 +1,247 @@
+import itertools
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from quote_engine import CatalogArrays, job_parts, schedule_jobs
+from quote_engine.schedule import WorkingCalendar, machine_options, run_hours
+
+from tests.reference import part_candidates, random_catalog
+
+pytestmark = pytest.mark.anyio
+
+CALENDARS = [
+    {"days": [0, 1, 2, 3, 4], "startHour": 8.0, "endHour": 17.0},
+    {"days": [0, 1, 2, 3, 4, 5, 6], "startHour": 0.0, "endHour": 24.0},
+    {"days": [1, 3], "startHour": 6.5, "endHour": 22.25},
+    {"days": [5], "startHour": 0.0, "endHour": 24.0},
+]
+
+# A Monday
+START = datetime(2026, 3, 2, 9, 30)
+
+JOBS = [
+    {"finalWidth": 85, "finalHeight": 55, "quantity": 5000},
+    {"finalWidth": 210, "finalHeight": 297, "quantity": 25000, "isDoubleSided": True, "setupRequired": True},
+    {"finalWidth": 148, "finalHeight": 210, "quantity": 7500, "setupRequired": True},
+    {"finalWidth": 148, "finalHeight": 210, "quantity": 2000, "isBookletMode": True, "totalPages": 24},
+    {"finalWidth": 99, "finalHeight": 210, "quantity": 40000},
+    {"finalWidth": 105, "finalHeight": 148, "quantity": 300, "setupRequired": True},
+    {"finalWidth": 2000, "finalHeight": 3000, "quantity": 10},
+]
+
+
+def minute_book(calendar, moment, minutes):
+    """(start, end) of `minutes` of work, walking the calendar a minute at a time"""
+    def working(instant):
+        hour = instant.hour + instant.minute / 60
+        return instant.weekday() in calendar["days"] and calendar["startHour"] <= hour < calendar["endHour"]
+
+    current = moment
+    while not working(current):
+        current += timedelta(minutes=1)
+    start = current
+    while minutes:
+        if working(current):
+            minutes -= 1
+        current += timedelta(minutes=1)
+    return start, current
+
+
+@pytest.mark.parametrize("calendar", CALENDARS)
+@pytest.mark.parametrize("seed", range(5))
+def test_book_matches_a_minute_by_minute_walk(calendar, seed):
+    rng = random.Random(seed)
+    book = WorkingCalendar.from_dict(calendar)
+    for _ in range(20):
+        moment = START + timedelta(minutes=rng.randrange(0, 14 * 24 * 60))
+        minutes = rng.choice([0, 1, 59, 60, 240, 540, 541, 3000])
+
+        assert book.book(moment, minutes / 60) == minute_book(calendar, moment, minutes)
+
+
+def test_working_calendar_rejects_empty_windows():
+    for days, start, end in [([], 8, 17), ([0], 17, 8), ([0], 8, 25)]:
+        with pytest.raises(ValueError):
+            WorkingCalendar(days, start, end)
+
+
+def schedule_catalog(seed):
+    paper_types, machines = random_catalog(seed, machines=4)
+    for machine, calendar in zip(machines, CALENDARS):
+        machine["workingCalendar"] = calendar
+    return paper_types, machines
+
+
+def reference_options(paper_types, machines, job):
+    """{machine id: (cost, print sheets per part)} over the machines that print every part"""
+    options = {machine["id"]: (0.0, []) for machine in machines}
+    for part in job_parts(job):
+        cheapest = {}
+        for candidate in part_candidates(paper_types, machines, part):
+            key = (candidate["totalCost"], candidate["wastePercentage"])
+            if candidate["machineId"] not in cheapest or key < cheapest[candidate["machineId"]][0]:
+                cheapest[candidate["machineId"]] = (key, candidate["printSheetsNeeded"])
+        options = {
+            machine_id: (cost + cheapest[machine_id][0][0], sheets + [cheapest[machine_id][1]])
+            for machine_id, (cost, sheets) in options.items()
+            if machine_id in cheapest
+        }
+    return options
+
+
+@pytest.mark.parametrize("job", JOBS)
+@pytest.mark.parametrize("seed", range(4))
+def test_machine_options_are_the_cheapest_per_machine(seed, job):
+    paper_types, machines = schedule_catalog(seed)
+    catalog = CatalogArrays(paper_types, machines)
+    expected = reference_options(paper_types, machines, job)
+
+    options = machine_options(catalog, job)
+
+    assert {machines[index]["id"] for index in options} == set(expected)
+    for index, (cost, runs) in options.items():
+        cost_expected, sheets = expected[machines[index]["id"]]
+        assert cost == pytest.approx(cost_expected)
+        assert [sheets for sheets, _ in runs] == sheets
+
+
+def due_dates(seed):
+    rng = random.Random(seed)
+    return [rng.choice([None, START + timedelta(minutes=rng.randrange(30, 600, 15))]) for _ in JOBS]
+
+
+def hours(delta):
+    return delta.total_seconds() / 3600
+
+
+@pytest.mark.parametrize("hour_cost", [0.0, 5.0, 50.0, 5000.0])
+@pytest.mark.parametrize("seed", range(4))
+def test_schedule_replays_the_list_scheduler(seed, hour_cost):
+    paper_types, machines = schedule_catalog(seed)
+    catalog = CatalogArrays(paper_types, machines)
+    dues = due_dates(seed)
+
+    result = schedule_jobs(catalog, JOBS, START, hour_cost, dues)
+
+    # Replay the dispatch: every job takes the machine with the lowest score at its turn
+    options = {index: reference_options(paper_types, machines, job) for index, job in enumerate(JOBS)}
+    by_id = {machine["id"]: machine for machine in machines}
+
+    def runs(index, sheets):
+        return [(count, part.click_multiplier) for count, part in zip(sheets, job_parts(JOBS[index]))]
+
+    work = {
+        index: min(run_hours(by_id[machine_id], runs(index, sheets)) for machine_id, (_, sheets) in option.items())
+        for index, option in options.items() if option
+    }
+    order = sorted(work, key=lambda index: (dues[index] or datetime.max, -work[index], index))
+    assigned = {item["job"]: item for item in result["jobs"]}
+    assert sorted(assigned) == sorted(order)
+    assert result["unscheduled"] == [index for index in range(len(JOBS)) if index not in work]
+
+    available = {machine["id"]: START for machine in machines}
+    makespan_end = START
+    for index in order:
+        scores = {}
+        for machine_id, (cost, sheets) in options[index].items():
+            needed = run_hours(by_id[machine_id], runs(index, sheets))
+            start, end = WorkingCalendar.from_dict(by_id[machine_id]["workingCalendar"]).book(
+                available[machine_id], needed
+            )
+            late = max(hours(end - dues[index]), 0.0) if dues[index] else 0.0
+            scores[machine_id] = (cost + hour_cost * (max(hours(end - makespan_end), 0.0) + late), start, end,
+                                  cost, needed, late)
+
+        item = assigned[index]
+        chosen = scores[item["machineId"]]
+        assert chosen[0] == pytest.approx(min(score[0] for score in scores.values()))
+        assert (item["start"], item["end"]) == (chosen[1], chosen[2])
+        assert item["cost"] == pytest.approx(chosen[3])
+        assert item["hours"] == pytest.approx(chosen[4])
+        assert item["latenessHours"] == pytest.approx(chosen[5])
+        assert item["onTime"] == (chosen[5] == 0.0)
+        available[item["machineId"]] = item["end"]
+        makespan_end = max(makespan_end, item["end"])
+
+    assert result["end"] == makespan_end
+    assert result["makespanHours"] == pytest.approx(hours(makespan_end - START))
+    assert result["totalCost"] == pytest.approx(sum(item["cost"] for item in result["jobs"]))
+    assert result["lateJobs"] == sum(not item["onTime"] for item in result["jobs"])
+    for timeline in result["machines"]:
+        jobs = timeline["timeline"]
+        assert all(a["end"] <= b["start"] for a, b in zip(jobs, jobs[1:]))
+        assert timeline["busyHours"] == pytest.approx(sum(item["hours"] for item in jobs))
+
+
+def test_due_date_moves_a_late_job_to_a_faster_machine():
+    paper_types = [{"id": 1, "name": "Paper", "gsm": 100, "pricePerTon": 1000, "stockSheetSizes": [
+        {"id": 1, "name": "Stock", "width": 1000, "height": 1400, "unit": "mm"},
+    ]}]
+    machines = [{
+        "id": machine_id,
+        "name": f"Press {machine_id}",
+        "setupCost": 0,
+        "sheetsPerHour": sheets_per_hour,
+        "setupMinutes": 0,
+        "workingCalendar": CALENDARS[1],
+        "printSheetSizes": [{"id": 1, "name": "Print", "width": 500, "height": 700, "clickCost": click_cost,
+                             "duplexSupport": True, "unit": "mm"}],
+    } for machine_id, sheets_per_hour, click_cost in [(1, 1000, 0.01), (2, 2000, 0.02)]]
+    catalog = CatalogArrays(paper_types, machines)
+    job = {"finalWidth": 100, "finalHeight": 100, "quantity": 20000}
+
+    # 572 sheets: press 1 saves 5.72 in clicks, press 2 saves 0.286 hours
+    relaxed = schedule_jobs(catalog, [job], START, hour_cost=15.0)
+    due = schedule_jobs(catalog, [job], START, hour_cost=15.0, due_dates=[START])
+
+    assert relaxed["jobs"][0]["machineId"] == 1
+    assert due["jobs"][0]["machineId"] == 2
+    assert due["jobs"][0]["latenessHours"] == pytest.approx(572 / 2000)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_schedule_without_time_cost_is_the_cheapest_assignment(seed):
+    paper_types, machines = schedule_catalog(seed)
+    catalog = CatalogArrays(paper_types, machines)
+    options = [reference_options(paper_types, machines, job) for job in JOBS]
+    cheapest = min(
+        sum(option[machine_id][0] for option, machine_id in zip(options, assignment))
+        for assignment in itertools.product(*(sorted(option) for option in options if option))
+    )
+
+    result = schedule_jobs(catalog, JOBS, START, hour_cost=0.0)
+
+    assert result["totalCost"] == pytest.approx(cheapest)
+    assert result["unconstrainedCost"] == pytest.approx(cheapest)
+
+
+async def test_schedule_endpoint(server, client, load_catalog):
+    paper_types, machines = schedule_catalog(2)
+    await load_catalog(paper_types, machines)
+    dues = due_dates(2)
+    expected = schedule_jobs(CatalogArrays(paper_types, machines), [server.PrintJob(**job).dict() for job in JOBS],
+                             START, 50.0, dues)
+
+    response = await client.post("/api/schedule", json={
+        "jobs": [{"job": job, "dueDate": due.isoformat() if due else None} for job, due in zip(JOBS, dues)],
+        "start": START.isoformat(),
+        "hourCost": 50.0,
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["unscheduled"] == expected["unscheduled"]
+    assert [(item["job"], item["machineId"]) for item in body["jobs"]] == [
+        (item["job"], item["machineId"]) for item in expected["jobs"]
+    ]
+    assert body["totalCost"] == pytest.approx(expected["totalCost"])
+    assert body["makespanHours"] == pytest.approx(expected["makespanHours"])
+
+
+async def test_schedule_endpoint_rejects_bad_requests(client):
+    assert (await client.post("/api/schedule", json={"jobs": []})).status_code == 422
+    assert (await client.post("/api/schedule", json={"jobs": [{}]})).status_code == 422
+    response = await client.post("/api/schedule", json={"jobs": [{"quoteId": "missing"}]})
+    assert response.status_code == 404